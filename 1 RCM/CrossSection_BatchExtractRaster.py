@@ -1,62 +1,171 @@
-import arcpy
-import datetime
+import numpy as np
 import config  # Import the configuration module
+import backends
+import cross_section_geometry as geometry
+from cross_section_store import CrossSectionStoreWriter, DEFAULT_BATCH_ROWS
 
-# Processes the feature class by splitting it based on a unique ID and extracting values from rasters to points.
-def BatchExtractRaster(input_feature_class, group_by_fields, raster_ntl, raster_building_fa, workspace):
-    # Set workspace and other environment settings
-    arcpy.env.workspace = workspace
-    arcpy.env.overwriteOutput = True
-
-    # Split the feature class based on a unique ID (e.g., "CrosSecID")
-    unique_ids = [row[0] for row in arcpy.da.SearchCursor(input_feature_class, ["CrosSecID"])]
-    start_time_overall = datetime.datetime.now()
-    Iterations_Left = len(unique_ids)
-    for unique_id in set(unique_ids):
-        start_time_iteration = datetime.datetime.now()
-        print("Unique ID:", unique_id)
-
-        output_feature_name = f"SelectedCrossSection_SAMPLENAME_{unique_id}"
-        where_clause = f"CrosSecID = {unique_id}"
-
-        arcpy.FeatureClassToFeatureClass_conversion(input_feature_class, arcpy.env.workspace, output_feature_name,
-                                                    where_clause)
-
-        # Generate Points Along Lines
-        output_points_class = f"SelectedCrossSectionPoints_SAMPLENAME_{unique_id}"
-        if not arcpy.Exists(output_points_class):
-            arcpy.management.GeneratePointsAlongLines(Input_Features=output_feature_name,
-                                                      Output_Feature_Class=output_points_class,
-                                                      Point_Placement="DISTANCE", Distance="100 Meters")
-
-        # Extract NTL Values to Points
-        SelectedCrossSection_Points_NTL_Extract_JPN_NLCs_3s_Name_ = f"{workspace}/SelectedCrossSectionPointsNTLExt_SAMPLENAME___0000{unique_id}"
-        if not arcpy.Exists(SelectedCrossSection_Points_NTL_Extract_JPN_NLCs_3s_Name_):
-            arcpy.sa.ExtractValuesToPoints(in_point_features=output_points_class,
-                                           in_raster=raster_ntl,
-                                           out_point_features=SelectedCrossSection_Points_NTL_Extract_JPN_NLCs_3s_Name_,
-                                           interpolate_values="NONE", add_attributes="VALUE_ONLY")
-
-        # Extract BuildingFA Values to Points
-        SelectedCrossSection_Points_BuildingFA_Extract_JPN_NLCs_3s_Name_ = f"{workspace}/SelectedCrossSectionPointsBuildingFAExt_SAMPLENAME___0000{unique_id}"
-        if not arcpy.Exists(SelectedCrossSection_Points_BuildingFA_Extract_JPN_NLCs_3s_Name_):
-            arcpy.sa.ExtractValuesToPoints(in_point_features=output_points_class,
-                                           in_raster=raster_building_fa,
-                                           out_point_features=SelectedCrossSection_Points_BuildingFA_Extract_JPN_NLCs_3s_Name_,
-                                           interpolate_values="NONE", add_attributes="VALUE_ONLY")
-
-        # Delete the intermediate datasets
-        arcpy.Delete_management(output_points_class)
-        arcpy.Delete_management(output_feature_name)
-
-        # Print Iteration Time
-        end_time_iteration = datetime.datetime.now()
-        iteration_duration = end_time_iteration - start_time_iteration
-        overall_duration = end_time_iteration - start_time_overall
-        Iterations_Left = Iterations_Left - 1
-        print(
-            f"Iteration Time: {iteration_duration}, Overall Time: {overall_duration}, Iterations Left: {Iterations_Left}")
-        print("***************************")
+# Samples the NTL and building floor area rasters along every cross-section in one vectorized pass.
+def sample_cross_sections(backend, lines, cross_section_ids, raster_ntl, raster_building_fa, distance=100):
+    """
+    Generates the points every `distance` map units along all lines at once, converts them to pixel indices and
+    gathers both rasters with one fancy-indexing read each.
+
+    Parameters:
+    backend (backends.Backend): Backend used to read the rasters.
+    lines (list): Cross-section lines as (n, 2) vertex arrays.
+    cross_section_ids (array-like): CrosSecID of each line.
+    raster_ntl (str): Path to the NTL raster.
+    raster_building_fa (str): Path to the building floor area raster.
+    distance (float): Spacing of the points in map units.
+
+    Returns:
+    dict: Long table with one row per point, keyed by (CrosSecID, point_index), with the x, y, NTL and BuildingFA
+    columns. point_index starts at 1 for each CrosSecID, like the OBJECTID of the point feature classes. Points on
+    NoData cells or outside a raster are NaN (ExtractValuesToPoints wrote -9999), and NaN is written as NULL to the
+    point feature classes and the cross-section store.
+    """
+    cross_section_ids = np.asarray(cross_section_ids, dtype=np.int64)
+    if len(lines) == 0:
+        return {"CrosSecID": np.empty(0, dtype=np.int64), "point_index": np.empty(0, dtype=np.int64),
+                "x": np.empty(0), "y": np.empty(0), "NTL": np.empty(0), "BuildingFA": np.empty(0)}
+
+    points, line_index, _ = geometry.points_along_lines(lines, distance)
+
+    # Sort by CrosSecID (stable, so points keep their order along the line) and number the points per CrosSecID
+    ids = cross_section_ids[line_index]
+    order = np.argsort(ids, kind='stable')
+    ids, points = ids[order], points[order]
+    group_start = np.concatenate([[True], ids[1:] != ids[:-1]])
+    starts = np.flatnonzero(group_start)
+    point_index = np.arange(len(ids)) - np.repeat(starts, np.diff(np.append(starts, len(ids)))) + 1
+
+    return {
+        "CrosSecID": ids,
+        "point_index": point_index,
+        "x": points[:, 0],
+        "y": points[:, 1],
+        "NTL": backend.sample_values(raster_ntl, points),
+        "BuildingFA": backend.sample_values(raster_building_fa, points),
+    }
+
+# Writes the sampled points of each cross-section to the point feature classes read by export.py.
+def write_cross_section_points(backend, table, workspace, spatial_reference=None):
+    boundaries = np.flatnonzero(np.diff(table["CrosSecID"])) + 1
+    for rows in np.split(np.arange(len(table["CrosSecID"])), boundaries):
+        if len(rows) == 0:
+            continue
+        unique_id = table["CrosSecID"][rows[0]]
+        points = np.column_stack([table["x"][rows], table["y"][rows]])
+        for label in ("NTL", "BuildingFA"):
+            output_points = f"{workspace}/SelectedCrossSectionPoints{label}Ext_SAMPLENAME___0000{unique_id}"
+            backend.write_features(output_points, "Point", points, {"RASTERVALU": table[label][rows]},
+                                   spatial_reference)
+
+# Columns of the cross-section store (see cross_section_store.py) holding the sampled points of a table
+def store_columns(table):
+    return {"CrosSecID": table["CrosSecID"], "OBJECTID": table["point_index"], "RASTERVALU": table["NTL"],
+            "BuildingFA": table["BuildingFA"]}
+
+# Writes the sampled points to a cross-section store, read by CrossSection_curvefitting.py instead of the CSV files.
+def write_cross_section_store(table, store_path, batch_rows=DEFAULT_BATCH_ROWS):
+    with CrossSectionStoreWriter(store_path, batch_rows) as writer:
+        writer.write(store_columns(table))
+
+# Splits a sampled table into the (OBJECTID, NTL) profiles of its cross-sections
+def table_profiles(table):
+    ids = table["CrosSecID"]
+    starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]])) if len(ids) else np.empty(0, dtype=int)
+    stops = np.append(starts[1:], len(ids))
+    files = [str(ids[start]) for start in starts]
+    sections = [(table["point_index"][start:stop], table["NTL"][start:stop]) for start, stop in zip(starts, stops)]
+    return files, sections
+
+# Samples the cross-sections chunk by chunk and yields their profiles, for the streaming pipeline of main.py.
+def iter_cross_section_profiles(input_feature_class, raster_ntl, raster_building_fa, backend=None, distance=100,
+                                chunk_size=256, store_path=None, store_batch_rows=DEFAULT_BATCH_ROWS):
+    """
+    The lines are read lazily and sampled chunk_size cross-sections at a time, so only one chunk of points is held
+    here and the consumer pulling the chunks sets the pace. Nothing is written unless store_path is given.
+
+    Parameters:
+    input_feature_class (str): Merged cross-section feature class with a CrosSecID field.
+    raster_ntl (str): Path to the NTL raster.
+    raster_building_fa (str): Path to the building floor area raster.
+    backend (str or backends.Backend): Backend used for reading, ArcpyBackend if None.
+    distance (float): Spacing of the points in map units.
+    chunk_size (int): Number of cross-sections per chunk.
+    store_path (str): Optional cross-section store directory the sampled points are also written to.
+    store_batch_rows (int): Number of rows per part of the store.
+
+    Yields:
+    tuple: (files, sections), the CrosSecID of each cross-section of the chunk as a string and its (OBJECTID, NTL)
+    arrays, as taken by CrossSection_curvefitting.fit_sections.
+    """
+    backend = backends.get_backend(backend or "arcpy", tile_size=config.raster_tile_size,
+                                   cache_bytes=config.raster_cache_bytes)
+    writer = CrossSectionStoreWriter(store_path, store_batch_rows) if store_path else None
+
+    def sample_chunk(lines, cross_section_ids):
+        table = sample_cross_sections(backend, lines, cross_section_ids, raster_ntl, raster_building_fa, distance)
+        if writer is not None:
+            writer.write(store_columns(table))
+        return table_profiles(table)
+
+    lines, cross_section_ids = [], []
+    for line, unique_id in backend.iter_lines(input_feature_class, "CrosSecID"):
+        # Cut the chunks between CrosSecIDs, so the lines of a cross-section are sampled together
+        if len(lines) >= chunk_size and unique_id != cross_section_ids[-1]:
+            yield sample_chunk(lines, cross_section_ids)
+            lines, cross_section_ids = [], []
+        lines.append(line)
+        cross_section_ids.append(unique_id)
+    if lines:
+        yield sample_chunk(lines, cross_section_ids)
+
+    if writer is not None:
+        writer.close()
+    print(f"Raster tile cache: {backend.cache_stats()}")
+
+# Extracts the raster values to points along each cross-section.
+def BatchExtractRaster(input_feature_class, group_by_fields, raster_ntl, raster_building_fa, workspace, backend=None,
+                       distance=100, store_path=None, store_batch_rows=DEFAULT_BATCH_ROWS, write_points=False):
+    """
+    The sampled points are written to the cross-section store when store_path is given. The two point feature classes
+    per CrosSecID of the geoprocessing chain (read by export.py) are only written without a store, or with
+    write_points.
+
+    Parameters:
+    input_feature_class (str): Merged cross-section feature class with a CrosSecID field.
+    group_by_fields (list): Unused, the cross-sections are grouped by CrosSecID.
+    raster_ntl (str): Path to the NTL raster.
+    raster_building_fa (str): Path to the building floor area raster.
+    workspace (str): Workspace for the per-cross-section point feature classes, or None to not write them.
+    backend (str or backends.Backend): Backend used for reading and writing, ArcpyBackend if None.
+    distance (float): Spacing of the points in map units.
+    store_path (str): Cross-section store directory the sampled points are written to (see cross_section_store.py).
+    store_batch_rows (int): Number of rows per part of the store.
+    write_points (bool): Also write the point feature classes when store_path is given.
+
+    Returns:
+    dict: Long table of the sampled points (see sample_cross_sections).
+    """
+    backend = backends.get_backend(backend or "arcpy", tile_size=config.raster_tile_size,
+                                   cache_bytes=config.raster_cache_bytes)
+
+    lines, cross_section_ids = [], []
+    for line, unique_id in backend.iter_lines(input_feature_class, "CrosSecID"):
+        lines.append(line)
+        cross_section_ids.append(unique_id)
+
+    table = sample_cross_sections(backend, lines, cross_section_ids, raster_ntl, raster_building_fa, distance)
+    print(f"Sampled {len(table['CrosSecID'])} points along {len(set(cross_section_ids))} cross-sections.")
+    print(f"Raster tile cache: {backend.cache_stats()}")
+
+    if workspace and (write_points or not store_path):
+        write_cross_section_points(backend, table, workspace, backend.spatial_reference(input_feature_class))
+    if store_path:
+        write_cross_section_store(table, store_path, store_batch_rows)
+    return table
 
 
 if __name__ == '__main__':
@@ -65,6 +174,10 @@ if __name__ == '__main__':
         group_by_fields=config.group_by_fields,
         raster_ntl=config.raster_ntl,
         raster_building_fa=config.raster_building_fa,
-        workspace=config.workspace_script2
+        workspace=config.workspace_script2,
+        backend=config.backend,
+        store_path=config.cross_section_store,
+        store_batch_rows=config.cross_section_store_batch_rows,
+        write_points=config.write_point_feature_classes
     )
 
@@ -1,161 +1,192 @@
-import arcpy
+import csv
+import os
+import re
+import shutil
+import tempfile
+import traceback
+from collections import Counter
+from contextlib import nullcontext
+from multiprocessing import Pool
 import config  # Import the configuration module
-
-# This function processes GIS data to extract cross-sections from raster and feature class inputs.
-def BatchGeneration(workspace, scratch_workspace, input_raster, feature_class, output_gdb, toolbox_path):
-    # Set environment settings
-    arcpy.env.workspace = workspace
-    arcpy.env.scratchWorkspace = scratch_workspace
-    arcpy.env.overwriteOutput = True
-
+import backends
+import cross_section_geometry as geometry
+
+try:
+    import arcpy
+except ImportError:
+    # arcpy is only needed by ArcpyBackend
+    arcpy = None
+
+# Backend of the current worker process, created once by init_worker
+worker_backend = None
+
+# Creates the backend of a worker process, with its own scratch workspace for arcpy inside scratch_root (removed by
+# BatchGeneration once the pool is closed, since the pool terminates its workers without running their exit handlers)
+def init_worker(backend_name, workspace, cache_options, scratch_root=None):
+    global worker_backend
+    worker_backend = backends.get_backend(backend_name, **cache_options)
+    if worker_backend.name == "arcpy":
+        arcpy.env.workspace = workspace
+        arcpy.env.scratchWorkspace = tempfile.mkdtemp(prefix="rcm_scratch_", dir=scratch_root)
+
+# Generates the cross-sections of one polygon; errors are returned instead of raised so one polygon cannot stop the run.
+def process_polygon(backend, input_raster, rings, NLC_ID, distance, keep_buckets):
+    """
+    Returns:
+    tuple: (NLC_ID, lines, columns, stats, error), where error is None or a dict with the error message and traceback.
+    """
+    stats = Counter()
     try:
-        # Import necessary toolbox for data management tools
-        arcpy.ImportToolbox(toolbox_path)
-
-        # Load the input raster
-        raster = arcpy.Raster(input_raster)
-
-        # Use a SearchCursor to iterate over each feature in the feature class
-        with arcpy.da.SearchCursor(feature_class, ["SHAPE@", "NLC_ID"]) as cursor:
-            for row in cursor:
-                geometry, NLC_ID = row
-                name = f"{feature_class.split('/')[-1]}_{NLC_ID}"
-
-                # Create a temporary in-memory feature class for the current feature
-                temp_feature_class = "in_memory/temp_feature"
-                arcpy.CopyFeatures_management(geometry, temp_feature_class)
-
-                # Set the path for the output feature class
-                copied_features = f"{output_gdb}/{name}"
-
-                # Copy the temporary feature class to the desired location
-                arcpy.CopyFeatures_management(temp_feature_class, copied_features)
-
-                # Clean up the in-memory feature class
-                arcpy.Delete_management(temp_feature_class)
-
-                # Extract by Mask
-                extract_by_mask = f"{output_gdb}/Extract_{name}"
-                extract_result = arcpy.sa.ExtractByMask(in_raster=raster, in_mask_data=copied_features)
-                extract_result.save(extract_by_mask)
-
-                # Raster to Polygon
-                polygon_output = f"{output_gdb}/Poly_{name}"
-                arcpy.conversion.RasterToPolygon(in_raster=extract_by_mask, out_polygon_features=polygon_output,
-                                                 simplify="NO_SIMPLIFY", raster_field="Value")
-
-                # Summary Statistics
-                summary_output = f"{output_gdb}/Summary_{name}"
-                arcpy.analysis.Statistics(in_table=polygon_output, out_table=summary_output,
-                                          statistics_fields=[["GRIDCODE", "MAX"]])
-
-                # Join Field
-                joined_output = arcpy.management.JoinField(in_data=polygon_output, in_field="GRIDCODE",
-                                                           join_table=summary_output, join_field="MAX_GRIDCODE")
-
-                # Select Layer By Attribute
-                selected_output, _ = arcpy.management.SelectLayerByAttribute(in_layer_or_view=joined_output,
-                                                                             selection_type="NEW_SELECTION",
-                                                                             where_clause="MAX_GRIDCODE IS NOT NULL")
-
-                # Polygon to Line
-                line_output = f"{output_gdb}/Perimeter_{name}"
-                arcpy.management.PolygonToLine(in_features=copied_features, out_feature_class=line_output)
-
-                # Generate Points Along Lines
-                points_output = f"{output_gdb}/BoundaryPoints_{name}"
-                arcpy.management.GeneratePointsAlongLines(Input_Features=line_output,
-                                                          Output_Feature_Class=points_output,
-                                                          Point_Placement="DISTANCE", Distance="100 Meters")
-
-                # Add Field: PseudoHeight
-                pseudo_height_field = arcpy.management.AddField(in_table=points_output, field_name="PseudoHeight",
-                                                                field_type="LONG")
-
-                # Calculate Field: PseudoHeight=1
-                arcpy.management.CalculateField(in_table=pseudo_height_field, field="PseudoHeight", expression="1",
-                                                expression_type="PYTHON3")
-
-                # Construct Sight Lines
-                sight_lines_output = f"{output_gdb}/SightLines_{name}"
-                arcpy.ddd.ConstructSightLines(in_observer_points=pseudo_height_field,
-                                              in_target_features=pseudo_height_field,
-                                              out_line_feature_class=sight_lines_output,
-                                              observer_height_field="PseudoHeight", target_height_field="PseudoHeight")
-
-                # Copy Features (2)
-                max_pixel_polygon_output = f"{output_gdb}/MaxPoly_{name}"
-                arcpy.management.CopyFeatures(in_features=selected_output, out_feature_class=max_pixel_polygon_output)
-
-                # Select Layer By Location
-                intersect_output, _, _ = arcpy.management.SelectLayerByLocation(in_layer=[sight_lines_output],
-                                                                                overlap_type="INTERSECT",
-                                                                                select_features=max_pixel_polygon_output)
-
-                # Copy Features (3)
-                cross_section_output = f"{output_gdb}/CrossSection_{name}"
-                arcpy.management.CopyFeatures(in_features=intersect_output, out_feature_class=cross_section_output)
-
-                # Add Field: Bearing
-                bearing_field = arcpy.management.AddField(in_table=cross_section_output, field_name="Bearing",
-                                                          field_type="DOUBLE")
-
-                # Calculate Geometry Attributes: Line bearing
-                calculated_bearing = arcpy.management.CalculateGeometryAttributes(in_features=bearing_field,
-                                                                                  geometry_property=[
-                                                                                      ["Bearing", "LINE_BEARING"]])
-
-                # Add Field: BearingRoundup
-                bearing_roundup_field = arcpy.management.AddField(in_table=calculated_bearing,
-                                                                  field_name="BearingRoundup", field_type="LONG")
-
-                # Calculate Field: BearingRoundup
-                arcpy.management.CalculateField(in_table=bearing_roundup_field, field="BearingRoundup",
-                                                expression="Roundup(!Bearing!)", expression_type="PYTHON3", code_block="""def Roundup(value):
-    return int((value + 4.5) // 5 * 5)""")
-
-                # Summary Statistics: Maximum length
-                summary_length_output = f"{output_gdb}/LengthSummary_{name}"
-                arcpy.analysis.Statistics(in_table=bearing_roundup_field, out_table=summary_length_output,
-                                          statistics_fields=[["Shape_Length", "MAX"], ["Shape_Length", "MIN"]])
-
-                # Join Field (2)
-                joined_length_output = arcpy.management.JoinField(in_data=bearing_roundup_field,
-                                                                  in_field="Shape_Length",
-                                                                  join_table=summary_length_output,
-                                                                  join_field="MAX_Shape_Length")
-
-                # Select Layer By Attribute
-                filtered_output, _ = arcpy.management.SelectLayerByAttribute(in_layer_or_view=joined_length_output,
-                                                                             selection_type="NEW_SELECTION",
-                                                                             where_clause="BearingRoundup = 90 OR BearingRoundup = 180 OR MAX_Shape_Length IS NOT NULL")
-
-                # Copy Features (4)
-                selected_cross_section_output = f"{output_gdb}/SelectedCrossSection_{name}"
-                arcpy.management.CopyFeatures(in_features=filtered_output,
-                                              out_feature_class=selected_cross_section_output)
-
-                # Sort: Descending length
-                sorted_output = f"{output_gdb}/Sorted_{name}"
-                arcpy.management.Sort(in_dataset=selected_cross_section_output, out_dataset=sorted_output,
-                                      sort_field=[["Shape_Length", "DESCENDING"]])
-
-                # Delete Identical
-                deduplicated_output = arcpy.management.DeleteIdentical(in_dataset=sorted_output,
-                                                                       fields=["BearingRoundup"])
-
-                # Add Field: CrosSecID
-                cross_sec_id_field = arcpy.management.AddField(in_table=deduplicated_output, field_name="CrosSecID",
-                                                               field_type="LONG", field_alias="CrossSectionID")
-
-                # Calculate Field: CrosSecID
-                arcpy.management.CalculateField(in_table=cross_sec_id_field, field="CrosSecID",
-                                                expression=f"int({NLC_ID}) * 10000 + !OBJECTID!",
-                                                expression_type="PYTHON3")
-
+        values, transform = backend.extract_by_mask(input_raster, rings)
+        lines, columns = geometry.generate_cross_sections(rings, values, transform, NLC_ID, distance, keep_buckets,
+                                                          stats=stats)
     except Exception as e:
-        arcpy.AddError(f"An error occurred: {str(e)}")
-        print(f"An error occurred: {str(e)}")
+        return NLC_ID, None, None, stats, {"NLC_ID": NLC_ID, "error": str(e), "traceback": traceback.format_exc()}
+    return NLC_ID, lines, columns, stats, None
+
+# Runs process_polygon in a worker process with the worker's backend
+def process_polygon_task(task):
+    return process_polygon(worker_backend, *task)
+
+# Writes the per-polygon errors to a CSV report
+def write_error_report(errors, error_report):
+    with open(error_report, "w", newline="") as csv_file:
+        csv_writer = csv.DictWriter(csv_file, fieldnames=["NLC_ID", "error", "traceback"])
+        csv_writer.writeheader()
+        csv_writer.writerows(errors)
+    print(f"Error report saved to '{error_report}'.")
+
+# Deletes the Sorted_<feature class>_<NLC_ID> feature classes of output_gdb whose polygon is no longer in the feature
+# class (outputs is the set of the expected names), so merging the workspace does not pick up stale cross-sections
+def remove_stale_outputs(backend, output_gdb, layer_name, outputs):
+    pattern = re.compile(rf"^Sorted_{re.escape(layer_name)}_-?\d+(\.\d+)?$", re.IGNORECASE)
+    expected = {name.lower() for name in outputs}
+    stale = [name for name in backend.list_feature_classes(output_gdb)
+             if pattern.match(name) and name.lower() not in expected]
+    for name in stale:
+        backend.delete_feature_class(f"{output_gdb}/{name}")
+    if stale:
+        print(f"Removed the cross-sections of {len(stale)} polygon(s) no longer in '{layer_name}'.")
+    return stale
+
+# This function extracts the cross-sections of every polygon in memory and writes only the selected lines.
+def BatchGeneration(workspace, scratch_workspace, input_raster, feature_class, output_gdb, toolbox_path, backend=None,
+                    distance=100, keep_buckets=(90, 180), workers=1, error_report=None, unit_cache=None):
+    """
+    For each polygon, the NTL raster is extracted by mask and the cross-sections are generated by
+    cross_section_geometry.generate_cross_sections, without the intermediate feature classes (Extract_, Poly_,
+    Summary_, Perimeter_, BoundaryPoints_, SightLines_, MaxPoly_, CrossSection_, ...) of the geoprocessing chain.
+    With workers > 1, the polygons are shared out to a process pool and the results are merged in NLC_ID order, so
+    the output does not depend on the number of workers.
+
+    Parameters:
+    workspace (str): Workspace for relative feature class paths (arcpy backend).
+    scratch_workspace (str): Scratch workspace (arcpy backend; each worker process uses its own temporary one).
+    input_raster (str): Path to the NTL raster.
+    feature_class (str): Polygon feature class with an NLC_ID field.
+    output_gdb (str): Workspace where the Sorted_<feature class>_<NLC_ID> cross-sections are written, or None to
+                      only return them.
+    toolbox_path (str): Unused, the Data Management toolbox is no longer needed.
+    backend (str or backends.Backend): Backend used for reading and writing, ArcpyBackend if None.
+    distance (float): Spacing of the boundary points in map units.
+    keep_buckets (tuple or None): BearingRoundup buckets kept besides the longest line (None keeps every bucket).
+    workers (int): Number of worker processes (1 processes the polygons in this process).
+    error_report (str): Optional path of a CSV file listing the polygons that failed (an earlier report is removed
+                        when no polygon fails).
+    unit_cache (stage_cache.UnitCache): Optional journal of the polygons already written (given by the stage runner of
+                                        main.py). Polygons whose geometry and parameters are unchanged are skipped,
+                                        and each polygon is recorded as soon as its cross-sections are written.
+                                        The output of a recomputed polygon is overwritten, or deleted if it no
+                                        longer has cross-sections or fails, and the outputs and journal entries of
+                                        polygons removed from the feature class are dropped.
+
+    Returns:
+    tuple: (results, errors), results maps NLC_ID -> (lines, columns) as returned by generate_cross_sections (the
+    polygons skipped by unit_cache are left out) and errors lists the failed polygons with their error message and
+    traceback.
+    """
+    backend = backends.get_backend(backend or "arcpy", tile_size=config.raster_tile_size,
+                                   cache_bytes=config.raster_cache_bytes)
+    if backend.name == "arcpy":
+        arcpy.env.workspace = workspace
+        arcpy.env.scratchWorkspace = scratch_workspace
+    spatial_reference = backend.spatial_reference(feature_class)
+
+    # Fingerprint of each polygon, to skip the ones already written by an earlier run
+    fingerprints = {}
+    layer_name = feature_class.split('/')[-1]
+    outputs = set()
+
+    def polygon_tasks():
+        for rings, NLC_ID in backend.iter_polygons(feature_class, "NLC_ID"):
+            outputs.add(f"Sorted_{layer_name}_{NLC_ID}")
+            if unit_cache is not None:
+                fingerprints[NLC_ID] = unit_cache.fingerprint(NLC_ID, rings)
+                if unit_cache.done(NLC_ID, fingerprints[NLC_ID]):
+                    continue
+            yield input_raster, rings, NLC_ID, distance, keep_buckets
+
+    # Write the cross-sections of each polygon as soon as they are generated, so a stopped run keeps them
+    outcomes = []
+    cache_options = {"tile_size": backend.tile_size, "cache_bytes": backend.cache_bytes}
+    scratch_root = tempfile.mkdtemp(prefix="rcm_workers_") if workers > 1 and backend.name == "arcpy" else None
+    pool = Pool(workers, initializer=init_worker, initargs=(backend.name, workspace, cache_options, scratch_root)) \
+        if workers > 1 else None
+    try:
+        with pool or nullcontext():
+            if pool:
+                polygon_outcomes = pool.imap_unordered(process_polygon_task, polygon_tasks(), chunksize=8)
+            else:
+                polygon_outcomes = (process_polygon(backend, *task) for task in polygon_tasks())
+            for outcome in polygon_outcomes:
+                NLC_ID, lines, columns, _, error = outcome
+                outcomes.append(outcome)
+                if output_gdb:
+                    output = f"{output_gdb}/Sorted_{layer_name}_{NLC_ID}"
+                    if error is None and len(lines):
+                        backend.write_features(output, "LineString", lines, columns, spatial_reference)
+                    else:
+                        # The polygon may have had cross-sections in an earlier run
+                        backend.delete_feature_class(output)
+                if error is None and unit_cache is not None:
+                    unit_cache.record(NLC_ID, fingerprints[NLC_ID])
+    finally:
+        if scratch_root:
+            shutil.rmtree(scratch_root, ignore_errors=True)
+
+    # Drop the polygons removed from the feature class since an earlier run
+    if output_gdb:
+        remove_stale_outputs(backend, output_gdb, layer_name, outputs)
+        if backend.name == "arcpy":
+            arcpy.env.workspace = workspace
+    if unit_cache is not None:
+        polygon_ids = {str(NLC_ID) for NLC_ID in fingerprints}
+        for unit in unit_cache.units() - polygon_ids:
+            unit_cache.forget(unit)
+
+    # Merge the results deterministically by NLC_ID
+    results, errors, stats = {}, [], Counter()
+    for NLC_ID, lines, columns, polygon_stats, error in sorted(outcomes, key=lambda outcome: outcome[0]):
+        stats.update(polygon_stats)
+        if error is not None:
+            print(f"An error occurred for NLC_ID {NLC_ID}: {error['error']}")
+            errors.append(error)
+            continue
+        results[NLC_ID] = (lines, columns)
+
+    print(f"Sight lines evaluated: {stats['evaluated']}, pruned: {stats['pruned']}")
+    print(f"Polygons processed: {len(results)}, failed: {len(errors)}")
+    if unit_cache is not None:
+        print(f"Polygons unchanged since the last run, skipped: {unit_cache.skipped}")
+    if workers <= 1:
+        print(f"Raster tile cache: {backend.cache_stats()}")
+    if error_report and errors:
+        write_error_report(errors, error_report)
+    elif error_report and os.path.exists(error_report):
+        # Remove the report of an earlier run so it is not mistaken for failures of this one
+        os.remove(error_report)
+        print(f"No errors, stale error report '{error_report}' removed.")
+    return results, errors
 
 
 if __name__ == '__main__':
@@ -165,6 +196,10 @@ if __name__ == '__main__':
         config.input_raster,
         config.feature_class,
         config.output_gdb,
-        config.toolbox_path
+        config.toolbox_path,
+        backend=config.backend,
+        distance=config.boundary_point_distance,
+        keep_buckets=config.cross_section_buckets,
+        workers=config.generation_workers,
+        error_report=config.generation_error_report
     )
-
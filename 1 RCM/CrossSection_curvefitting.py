@@ -1,8 +1,29 @@
 import os
+import time
+import traceback
+from collections import defaultdict, deque
+from contextlib import nullcontext
+from functools import lru_cache
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from scipy.optimize import curve_fit
+from cross_section_store import CrossSectionStore, is_store
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is only needed to write the fit results as Parquet
+    pa = pq = None
+
+# Status codes of the rows of fit_results.csv
+FIT_OK = 0  # Fitted
+FIT_NO_DATA = 1  # The RASTERVALU column has no data
+FIT_INSUFFICIENT_POINTS = 2  # Fewer than 3 valid points
+FIT_NOT_CONVERGED = 3  # The fit did not converge
+FIT_ERROR = 4  # The file could not be read or processed
 
 
 def normal_distribution(x, pi, mu, sigma):
@@ -55,64 +76,696 @@ def fit_data(x, y):
         return pi, mu, sigma
 
 
-def curve_fitting(csv_folder, fit_results_folder, fit_results_csv):
+def stack_sections(sections):
     """
-    Perform curve fitting on CSV data and save results.
+    Stack cross-sections of different lengths into padded arrays.
 
     Parameters:
-    csv_folder (str): Path to the folder containing the CSV files.
-    fit_results_folder (str): Path to the folder to save the fit results plots.
-    fit_results_csv (str): Path to the output CSV file to save the fit parameters.
-    """
-    results_df = pd.DataFrame(columns=["File", "Mu", "Sigma", "Pi", "Peak", "Span"])
-
-    for filename in os.listdir(csv_folder):
-        if filename.endswith(".csv"):
-            print(filename)
-            file_path = os.path.join(csv_folder, filename)
-            data = pd.read_csv(file_path)
-            if data.iloc[:, 1].isna().all():
-                print(f"Skipping {filename} because the second column has no data.")
+    sections (list): List of (x, y) array pairs.
+
+    Returns:
+    tuple: (x, y, mask) arrays of shape (number of sections, longest section), where mask marks the finite points;
+    padded and non-finite points are set to 0.
+    """
+    length = max((len(x) for x, _ in sections), default=0)
+    x_batch = np.zeros((len(sections), length))
+    y_batch = np.zeros((len(sections), length))
+    mask = np.zeros((len(sections), length), dtype=bool)
+    for i, (x, y) in enumerate(sections):
+        x_batch[i, :len(x)] = x
+        y_batch[i, :len(y)] = y
+        mask[i, :len(x)] = np.isfinite(x) & np.isfinite(y)
+    x_batch[~mask] = 0
+    y_batch[~mask] = 0
+    return x_batch, y_batch, mask
+
+
+def fit_data_batch(sections, max_iterations=250, tolerance=1.49012e-08):
+    """
+    Fit the normal distribution function to many cross-sections at once.
+
+    Batched counterpart of fit_data: every section starts from the same initial guess (max of y, mean and standard
+    deviation of x) and is refined by Levenberg-Marquardt steps solved for the whole batch with NumPy, with Nielsen's
+    gain-ratio update of the damping. A section stops iterating once the relative change of the sum of squares or of
+    the parameters falls below the tolerance (the ftol/xtol defaults of curve_fit), including a rejected step that is
+    already below it. A section whose damping overflows without any step reducing the sum of squares has not
+    converged (curve_fit raises in that case).
+
+    Parameters:
+    sections (list): List of (x, y) array pairs, one per cross-section.
+    max_iterations (int): Maximum number of Levenberg-Marquardt iterations.
+    tolerance (float): Relative tolerance on the sum of squares and on the parameters.
+
+    Returns:
+    tuple: (params, converged), an array of shape (number of sections, 3) with the fitted (pi, mu, sigma) and a boolean
+    array that is False where fit_data would return None (fewer than 3 valid points or no convergence); the
+    parameters of those sections are NaN.
+    """
+    x, y, mask = stack_sections(sections)
+    count = mask.sum(axis=1)
+
+    # Initial guess of fit_data: [max(y), mean(x), std(x)] over the valid points
+    safe_count = np.maximum(count, 1)
+    mean_x = x.sum(axis=1) / safe_count
+    std_x = np.sqrt((((x - mean_x[:, None]) * mask) ** 2).sum(axis=1) / safe_count)
+    max_y = np.where(mask, y, -np.inf).max(axis=1, initial=-np.inf)
+    params = np.column_stack([max_y, mean_x, std_x])
+
+    def sum_of_squares(index, candidate):
+        pi, mu, sigma = candidate[:, 0:1], candidate[:, 1:2], candidate[:, 2:3]
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            residual = (y[index] - pi * np.exp(-(x[index] - mu) ** 2 / (2 * sigma ** 2))) * mask[index]
+            return (residual ** 2).sum(axis=1)
+
+    active = (count >= 3) & np.isfinite(params).all(axis=1) & (std_x > 0)
+    converged = np.zeros(len(sections), dtype=bool)
+    damping = np.full(len(sections), np.nan)
+    damping_factor = np.full(len(sections), 2.0)
+    sum_squares = np.full(len(sections), np.inf)
+    sum_squares[active] = sum_of_squares(np.flatnonzero(active), params[active])
+
+    for _ in range(max_iterations):
+        index = np.flatnonzero(active)
+        if len(index) == 0:
+            break
+        p = params[index]
+        pi, mu, sigma = p[:, 0:1], p[:, 1:2], p[:, 2:3]
+        x_index, mask_index = x[index], mask[index]
+
+        # Residuals and Jacobian of the model with respect to (pi, mu, sigma), zero at padded points
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            exponential = np.exp(-(x_index - mu) ** 2 / (2 * sigma ** 2)) * mask_index
+            residual = (y[index] - pi * exponential) * mask_index
+            jacobian = np.stack([exponential,
+                                 pi * exponential * (x_index - mu) / sigma ** 2,
+                                 pi * exponential * (x_index - mu) ** 2 / sigma ** 3], axis=2)
+        normal_matrix = np.einsum('nki,nkj->nij', jacobian, jacobian)
+        gradient = np.einsum('nki,nk->ni', jacobian, residual)
+
+        # The damping starts at 0.1 * max(diag(J'J)) for each section
+        lam = damping[index]
+        first = np.isnan(lam)
+        lam[first] = 0.1 * np.diagonal(normal_matrix[first], axis1=1, axis2=2).max(axis=1)
+        with np.errstate(invalid='ignore'):
+            damped = normal_matrix + lam[:, None, None] * np.eye(3)
+            try:
+                step = np.linalg.solve(damped, gradient[:, :, None])[:, :, 0]
+            except np.linalg.LinAlgError:
+                step = np.einsum('nij,nj->ni', np.linalg.pinv(damped), gradient)
+
+        # Gain ratio between the actual and the predicted reduction of the sum of squares
+        candidate = p + step
+        new_sum_squares = sum_of_squares(index, candidate)
+        predicted = np.einsum('ni,ni->n', step, lam[:, None] * step + gradient)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain = (sum_squares[index] - new_sum_squares) / predicted
+        improved = np.isfinite(new_sum_squares) & (predicted > 0) & (gain > 0)
+
+        accepted = index[improved]
+        reduction = sum_squares[accepted] - new_sum_squares[improved]
+        small_reduction = reduction <= tolerance * sum_squares[accepted]
+        small_step = (np.abs(step[improved]) <= tolerance * (np.abs(candidate[improved]) + tolerance)).all(axis=1)
+        params[accepted] = candidate[improved]
+        sum_squares[accepted] = new_sum_squares[improved]
+        lam[improved] *= np.maximum(1 / 3, 1 - (2 * gain[improved] - 1) ** 3)
+        damping_factor[accepted] = 2.0
+        lam[~improved] *= damping_factor[index[~improved]]
+        damping_factor[index[~improved]] *= 2
+        damping[index] = lam
+
+        # A section has converged when the fit stops changing, or when the rejected step is already below the
+        # parameter tolerance (MINPACK's xtol test on the trust region)
+        rejected = index[~improved]
+        rejected_small_step = (np.abs(step[~improved]) <= tolerance * (np.abs(p[~improved]) + tolerance)).all(axis=1)
+        done = np.concatenate([accepted[small_reduction | small_step], rejected[rejected_small_step]])
+        converged[done] = True
+        active[done] = False
+
+        # A section whose damping overflows without any step reducing the sum of squares has failed (curve_fit
+        # raises in that case, so fit_data returns None)
+        overflow = index[~(lam < 1e300) & active[index]]
+        active[overflow] = False
+
+    converged &= np.isfinite(params).all(axis=1)
+    params[~converged] = np.nan
+    return params, converged
+
+
+class FitResults:
+    """
+    Array-backed fit results: one row per file with an interned file id, a status code (FIT_OK, FIT_NO_DATA, ...) and
+    float columns for the fit parameters, grown by doubling instead of copying a DataFrame per row.
+    """
+
+    COLUMNS = ["Mu", "Sigma", "Pi", "Peak", "Span"]
+
+    def __init__(self, capacity=1024):
+        self.files = []
+        self.file_ids = {}
+        self.size = 0
+        self.file_id = np.zeros(capacity, dtype=np.int32)
+        self.status = np.zeros(capacity, dtype=np.int8)
+        self.values = np.full((capacity, len(self.COLUMNS)), np.nan)
+
+    def __len__(self):
+        return self.size
+
+    def intern(self, file):
+        file_id = self.file_ids.get(file)
+        if file_id is None:
+            file_id = self.file_ids[file] = len(self.files)
+            self.files.append(file)
+        return file_id
+
+    def reserve(self, capacity):
+        if capacity <= len(self.status):
+            return
+        capacity = max(capacity, 2 * len(self.status))
+        self.file_id = np.resize(self.file_id, capacity)
+        self.status = np.resize(self.status, capacity)
+        values = np.full((capacity, len(self.COLUMNS)), np.nan)
+        values[:self.size] = self.values[:self.size]
+        self.values = values
+
+    def add(self, file, status, mu=np.nan, sigma=np.nan, pi=np.nan, peak=np.nan, span=np.nan):
+        self.reserve(self.size + 1)
+        self.file_id[self.size] = self.intern(file)
+        self.status[self.size] = status
+        self.values[self.size] = (mu, sigma, pi, peak, span)
+        self.size += 1
+
+    def extend(self, other):
+        self.reserve(self.size + other.size)
+        file_ids = np.array([self.intern(file) for file in other.files], dtype=np.int32)
+        rows = slice(self.size, self.size + other.size)
+        self.file_id[rows] = file_ids[other.file_id[:other.size]] if other.size else []
+        self.status[rows] = other.status[:other.size]
+        self.values[rows] = other.values[:other.size]
+        self.size += other.size
+
+    def clear(self):
+        self.files, self.file_ids, self.size = [], {}, 0
+
+    def to_frame(self):
+        frame = pd.DataFrame({"File": np.array(self.files, dtype=object)[self.file_id[:self.size]]})
+        for i, column in enumerate(self.COLUMNS):
+            frame[column] = self.values[:self.size, i]
+        frame["Status"] = self.status[:self.size]
+        return frame
+
+
+class FitResultsWriter:
+    """
+    Writes FitResults to a CSV (or .parquet) file, in a single write or in chunks of flush_rows rows for very large
+    runs.
+    """
+
+    def __init__(self, path, flush_rows=None):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.results = FitResults()
+        self.rows_written = 0
+        self.parquet_writer = None
+
+    def extend(self, results):
+        self.results.extend(results)
+        if self.flush_rows and len(self.results) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        frame = self.results.to_frame()
+        if self.path.endswith(".parquet"):
+            if pa is None:
+                raise ImportError("Writing the fit results as Parquet requires pyarrow.")
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self.parquet_writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode="a" if self.rows_written else "w", header=not self.rows_written, index=False)
+        self.rows_written += len(frame)
+        self.results.clear()
+
+    def close(self):
+        if len(self.results) or not self.rows_written:
+            self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+def fit_sections(files, sections, batched=True):
+    """
+    Fit a chunk of cross-sections. Errors are recorded per cross-section, so one bad cross-section cannot stop the
+    chunk.
+
+    Parameters:
+    files (list): Name of each cross-section, written to the File column.
+    sections (list): (x, y) arrays of each cross-section, or None for a cross-section that could not be read.
+    batched (bool): Fit the chunk at once with fit_data_batch instead of one fit_data call per cross-section.
+
+    Returns:
+    tuple: (results, errors), a FitResults with one row per cross-section in the order of files (failed fits included
+    with their status code) and the cross-sections that raised an error, as dicts with the file name, error message
+    and traceback.
+    """
+    errors = []
+    # Status and (mu, sigma, pi, peak, span) of each cross-section, in the order of files
+    rows = [(FIT_ERROR, ())] * len(files)
+
+    valid_sections = []
+    for i, (file, section) in enumerate(zip(files, sections)):
+        if section is None:
+            continue
+        if np.isnan(section[1]).all():
+            print(f"Skipping {file} because the second column has no data.")
+            rows[i] = (FIT_NO_DATA, ())
+        else:
+            valid_sections.append((i, *section))
+
+    if batched:
+        batch_params, batch_converged = fit_data_batch([(x, y) for _, x, y in valid_sections])
+
+    for j, (i, x, y) in enumerate(valid_sections):
+        file = files[i]
+        try:
+            y_filled = np.where(np.isnan(y), 0, y)
+            CSspan = (max(x) - min(x)) * 0.1  # Calculate the span of each cross section (km)
+            max_value = np.max(y_filled)  # Calculate the peak value of each cross section (nW/cm2/sr)
+            if batched:
+                result = tuple(batch_params[j]) if batch_converged[j] else None
             else:
-                x = data["OBJECTID"].values
-                y = data["RASTERVALU"].values
-                y_filled = np.where(np.isnan(y), 0, y)
                 result = fit_data(x, y)
-                if result is None:
-                    pi, mu, sigma = None, None, None
-                else:
-                    pi, mu, sigma = result
-
-                    if pi is not None:
-                        CSspan = (max(x) - min(x)) * 0.1  # Calculate the span of each cross section (km)
-                        max_value = np.max(y_filled)  # Calculate the peak value of each cross section (nW/cm2/sr)
-                        results_df = results_df.append({"File": filename[:-4], "Mu": mu, "Sigma": sigma, "Pi": pi,
-                                                        "Peak": max_value, "Span": CSspan}, ignore_index=True)
-
-                        x_fit = np.linspace(min(x), max(x), 100)
-                        y_fit = normal_distribution(x_fit, pi, mu, sigma)
-                        plt.plot(x, y, label='Data Points')
-                        plt.plot(x_fit, y_fit, 'r-', label='Fit Curve')
-                        plt.legend()
-                        plt.xlabel('OBJECTID')
-                        plt.ylabel('NTL(nW/cm2/sr)')
-                        plot_filename = os.path.splitext(filename)[0] + "_plot.png"
-                        plot_path = os.path.join(fit_results_folder, plot_filename)
-                        plt.savefig(plot_path)
-                        plt.close()
-                    else:
-                        print("Skipping this dataset due to insufficient data points or an error in fitting.")
-
-    results_df.to_csv(fit_results_csv, index=False)
+            if result is None:
+                print(f"Skipping {file} due to insufficient data points or an error in fitting.")
+                valid_points = np.count_nonzero(np.isfinite(x) & np.isfinite(y))
+                status = FIT_INSUFFICIENT_POINTS if valid_points < 3 else FIT_NOT_CONVERGED
+                rows[i] = (status, (np.nan, np.nan, np.nan, max_value, CSspan))
+                continue
+
+            pi, mu, sigma = result
+            rows[i] = (FIT_OK, (mu, sigma, pi, max_value, CSspan))
+        except Exception as e:
+            errors.append({"File": file, "error": str(e), "traceback": traceback.format_exc()})
+
+    results = FitResults(len(files))
+    for file, (status, values) in zip(files, rows):
+        results.add(file, status, *values)
+    return results, errors
+
+
+def fit_files(csv_folder, filenames, batched=True):
+    """
+    Read and fit a chunk of cross-section CSV files (see fit_sections).
+
+    Parameters:
+    csv_folder (str): Path to the folder containing the CSV files.
+    filenames (list): Names of the CSV files of the chunk.
+    batched (bool): Fit the chunk at once with fit_data_batch instead of one fit_data call per file.
+
+    Returns:
+    tuple: (results, errors) as returned by fit_sections, with File being the CSV file name stem.
+    """
+    errors, sections = [], []
+    # Read every cross-section of the chunk first, so they can be fitted as one batch
+    for filename in filenames:
+        print(filename)
+        try:
+            data = pd.read_csv(os.path.join(csv_folder, filename))
+            sections.append((data["OBJECTID"].values, data["RASTERVALU"].values.astype(float)))
+        except Exception as e:
+            sections.append(None)
+            errors.append({"File": filename, "error": str(e), "traceback": traceback.format_exc()})
+
+    results, fit_errors = fit_sections([filename[:-4] for filename in filenames], sections, batched)
+    return results, errors + fit_errors
+
+
+# Opens a cross-section store once per process, so its section index is built once
+@lru_cache(maxsize=None)
+def open_store(store_path):
+    return CrossSectionStore(store_path)
+
+
+def fit_store_sections(store_path, part, first, last, batched=True):
+    """
+    Fit a chunk of the cross-sections of a cross-section store (see cross_section_store.py), read as views of the
+    store columns (see fit_sections).
+
+    Parameters:
+    store_path (str): Path to the cross-section store directory.
+    part (int): Part of the store holding the chunk.
+    first (int): Index of the first cross-section of the chunk in the part.
+    last (int): Index after the last cross-section of the chunk in the part.
+    batched (bool): Fit the chunk at once with fit_data_batch instead of one fit_data call per cross-section.
+
+    Returns:
+    tuple: (results, errors) as returned by fit_sections, with File being the CrosSecID.
+    """
+    files, sections = [], []
+    for cross_section_id, columns in open_store(store_path).iter_sections(["OBJECTID", "RASTERVALU"], part, first,
+                                                                            last):
+        files.append(str(cross_section_id))
+        sections.append((columns["OBJECTID"], columns["RASTERVALU"]))
+    return fit_sections(files, sections, batched)
+
+
+def chunk_files(chunk):
+    """Names of the cross-sections of a chunk: its CSV file names, or the CrosSecIDs of a store chunk."""
+    if isinstance(chunk, tuple):
+        store_path, part, first, last = chunk
+        ids, _, _ = open_store(store_path).section_bounds(part)
+        return [str(cross_section_id) for cross_section_id in ids[first:last]]
+    return [filename[:-4] for filename in chunk]
+
+
+def fit_files_task(task):
+    """
+    Run fit_files (or fit_store_sections) on one chunk, in a worker process or in this process.
+
+    Parameters:
+    task (tuple): (chunk index, csv_folder, chunk, batched), chunk being a list of CSV file names, or
+                  (part, first, last) cross-sections of a cross-section store.
+
+    Returns:
+    tuple: (chunk index, process id, results, errors, seconds).
+    """
+    chunk_index, csv_folder, chunk, batched = task
+    start = time.perf_counter()
+    try:
+        if isinstance(chunk, tuple):
+            results, errors = fit_store_sections(csv_folder, *chunk, batched)
+        else:
+            results, errors = fit_files(csv_folder, chunk, batched)
+    except Exception as e:
+        files = chunk_files((csv_folder, *chunk) if isinstance(chunk, tuple) else chunk)
+        results, errors = FitResults(len(files)), []
+        for file in files:
+            results.add(file, FIT_ERROR)
+            errors.append({"File": file, "error": str(e), "traceback": traceback.format_exc()})
+    return chunk_index, os.getpid(), results, errors, time.perf_counter() - start
+
+
+def fit_sections_task(task):
+    """
+    Run fit_sections on one chunk of the streaming pipeline; an error fails the cross-sections of the chunk instead
+    of the run.
+
+    Parameters:
+    task (tuple): (files, sections, batched).
+
+    Returns:
+    tuple: (results, errors) as returned by fit_sections.
+    """
+    files, sections, batched = task
+    try:
+        return fit_sections(files, sections, batched)
+    except Exception as e:
+        results, errors = FitResults(len(files)), []
+        for file in files:
+            results.add(file, FIT_ERROR)
+            errors.append({"File": file, "error": str(e), "traceback": traceback.format_exc()})
+        return results, errors
+
+
+def fit_stream(chunks, batched=True, workers=1, max_pending=None):
+    """
+    Fit a stream of cross-section chunks as they are produced, yielding their results in the order of the chunks.
+
+    Pool.imap would pull the whole input up front, so with workers > 1 the chunks are submitted one by one and at
+    most max_pending of them are in flight: the producer is only resumed when the oldest chunk is done, which bounds
+    the memory held by the stream.
+
+    Parameters:
+    chunks (iterable): (files, sections) chunks, as taken by fit_sections.
+    batched (bool): Fit each chunk at once with fit_data_batch instead of one fit_data call per cross-section.
+    workers (int): Number of worker processes (1 fits the chunks in this process, one at a time).
+    max_pending (int): Maximum number of chunks in flight (2 * workers if None).
+
+    Yields:
+    tuple: (results, errors) of each chunk, as returned by fit_sections.
+    """
+    if workers <= 1:
+        for files, sections in chunks:
+            yield fit_sections_task((files, sections, batched))
+        return
+
+    max_pending = max_pending or 2 * workers
+    with Pool(workers) as pool:
+        pending = deque()
+        for files, sections in chunks:
+            pending.append(pool.apply_async(fit_sections_task, ((files, sections, batched),)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def curve_fitting(csv_folder, fit_results_folder, fit_results_csv, batched=True, workers=1, chunk_size=256,
+                  flush_rows=None):
+    """
+    Perform curve fitting on CSV data and save results.
+
+    The CSV files are split into chunks of chunk_size files. csv_folder can also be a cross-section store (see
+    cross_section_store.py), whose cross-sections are then read as views of its columns, in chunks of chunk_size
+    cross-sections of one part, and named by their CrosSecID. With workers > 1 the chunks are shared out to a process
+    pool and their results are streamed back as they finish, then written in file name order, so fit_results.csv does
+    not depend on the number of workers. Every file gets a row, with a Status column (FIT_OK, FIT_NO_DATA,
+    FIT_INSUFFICIENT_POINTS, FIT_NOT_CONVERGED or FIT_ERROR) and NaN fit parameters when the fit failed.
+
+    Parameters:
+    csv_folder (str): Path to the folder containing the CSV files, or to a cross-section store.
+    fit_results_folder (str): Unused, the fit plots are rendered afterwards by plot_fits.
+    fit_results_csv (str): Path to the output CSV file (or .parquet file) to save the fit parameters.
+    batched (bool): Fit each chunk at once with fit_data_batch instead of one fit_data call per file.
+    workers (int): Number of worker processes (1 fits the chunks in this process).
+    chunk_size (int): Number of CSV files per chunk.
+    flush_rows (int): Write the results every flush_rows rows instead of once at the end (None keeps them in memory).
+
+    Returns:
+    list: Files that failed, with their error message and traceback.
+    """
+    if is_store(csv_folder):
+        store = open_store(csv_folder)
+        sections = [len(store.section_bounds(part)[0]) for part in range(len(store.parts))]
+        chunks = [(part, start, min(start + chunk_size, sections[part])) for part in range(len(store.parts))
+                  for start in range(0, sections[part], chunk_size)]
+        chunk_lengths = [last - first for _, first, last in chunks]
+    else:
+        filenames = sorted(filename for filename in os.listdir(csv_folder) if filename.endswith(".csv"))
+        chunks = [filenames[start:start + chunk_size] for start in range(0, len(filenames), chunk_size)]
+        chunk_lengths = [len(chunk) for chunk in chunks]
+    tasks = [(i, csv_folder, chunk, batched) for i, chunk in enumerate(chunks)]
+
+    writer = FitResultsWriter(fit_results_csv, flush_rows)
+    errors, pending, next_chunk = [], {}, 0
+    worker_times = defaultdict(lambda: [0, 0, 0.0])
+    with Pool(workers) if workers > 1 else nullcontext() as pool:
+        for outcome in (pool.imap_unordered(fit_files_task, tasks) if pool else map(fit_files_task, tasks)):
+            chunk_index, pid, results, chunk_errors, seconds = outcome
+            fitted = np.count_nonzero(results.status[:len(results)] == FIT_OK)
+            print(f"Chunk {chunk_index + 1}/{len(tasks)} fitted by process {pid} in {seconds:.2f} s "
+                  f"({fitted} fits, {len(chunk_errors)} errors).")
+            worker_times[pid][0] += 1
+            worker_times[pid][1] += chunk_lengths[chunk_index]
+            worker_times[pid][2] += seconds
+
+            # Write the chunks in file name order as soon as the preceding ones are in
+            pending[chunk_index] = (results, chunk_errors)
+            while next_chunk in pending:
+                results, chunk_errors = pending.pop(next_chunk)
+                writer.extend(results)
+                errors.extend(chunk_errors)
+                next_chunk += 1
+    writer.close()
+
+    for pid, (chunk_count, files, seconds) in sorted(worker_times.items()):
+        print(f"Process {pid}: {chunk_count} chunks, {files} files, {seconds:.2f} s.")
+    for error in errors:
+        print(f"An error occurred for {error['File']}: {error['error']}")
+
     print(f"Fit results have been saved to '{fit_results_csv}'.")
+    return errors
+
+
+def read_fit_results(fit_results_csv):
+    """
+    Read the fit results written by curve_fitting, with File kept as the CSV file name stem.
+
+    Parameters:
+    fit_results_csv (str): Path to the fit results CSV (or .parquet) file.
+
+    Returns:
+    DataFrame: The fit results.
+    """
+    if fit_results_csv.endswith(".parquet"):
+        return pd.read_parquet(fit_results_csv).astype({"File": str})
+    return pd.read_csv(fit_results_csv, dtype={"File": str})
+
+
+# Reads the points of one cross-section, from its CSV file or from a cross-section store
+def read_section(csv_folder, file):
+    if is_store(csv_folder):
+        columns = open_store(csv_folder).section(int(file), ["OBJECTID", "RASTERVALU"])
+        return columns["OBJECTID"], columns["RASTERVALU"]
+    data = pd.read_csv(os.path.join(csv_folder, f"{file}.csv"))
+    return data["OBJECTID"].values, data["RASTERVALU"].values
+
+
+def section_residuals_task(task):
+    """
+    Root mean square residual of the fitted cross-sections of one chunk.
+
+    Parameters:
+    task (tuple): (csv_folder, rows), rows being (File, Mu, Sigma, Pi) tuples.
+
+    Returns:
+    list: RMSE of each row (NaN if its CSV file cannot be read).
+    """
+    csv_folder, rows = task
+    rmse = []
+    for file, mu, sigma, pi in rows:
+        try:
+            x, y = read_section(csv_folder, file)
+            valid = np.isfinite(x) & np.isfinite(y)
+            rmse.append(np.sqrt(np.mean((y[valid] - normal_distribution(x[valid], pi, mu, sigma)) ** 2)))
+        except Exception:
+            rmse.append(np.nan)
+    return rmse
+
+
+def draw_fit(ax, x, y, pi, mu, sigma):
+    x_fit = np.linspace(np.nanmin(x), np.nanmax(x), 100)
+    ax.plot(x, y, label='Data Points')
+    ax.plot(x_fit, normal_distribution(x_fit, pi, mu, sigma), 'r-', label='Fit Curve')
+
+
+def render_fit_plots_task(task):
+    """
+    Render the fits of a batch of cross-sections, as one contact sheet or as one PNG per cross-section. Figures are
+    drawn on matplotlib's Agg canvas without pyplot, so no GUI backend or global figure state is involved.
+
+    Parameters:
+    task (tuple): (csv_folder, rows, output, contact_sheet), rows being (File, Mu, Sigma, Pi, RMSE) tuples and output
+                  the contact sheet PNG path, or the folder of the per-section PNGs.
+
+    Returns:
+    list: Paths of the written images.
+    """
+    csv_folder, rows, output, contact_sheet = task
+    if not contact_sheet:
+        written = []
+        for file, mu, sigma, pi, _ in rows:
+            try:
+                x, y = read_section(csv_folder, file)
+            except Exception as e:
+                print(f"Cannot plot {file}: {e}")
+                continue
+            figure = Figure()
+            ax = figure.subplots()
+            draw_fit(ax, x, y, pi, mu, sigma)
+            ax.legend()
+            ax.set_xlabel('OBJECTID')
+            ax.set_ylabel('NTL(nW/cm2/sr)')
+            plot_path = os.path.join(output, f"{file}_plot.png")
+            figure.savefig(plot_path)
+            written.append(plot_path)
+        return written
+
+    columns = int(np.ceil(np.sqrt(len(rows))))
+    panel_rows = int(np.ceil(len(rows) / columns))
+    figure = Figure(figsize=(3.2 * columns, 2.6 * panel_rows))
+    axes = figure.subplots(panel_rows, columns, squeeze=False).ravel()
+    for ax, (file, mu, sigma, pi, rmse) in zip(axes, rows):
+        try:
+            x, y = read_section(csv_folder, file)
+        except Exception as e:
+            ax.set_title(f"{file}: {e}", fontsize=7)
+            continue
+        draw_fit(ax, x, y, pi, mu, sigma)
+        ax.set_title(file if np.isnan(rmse) else f"{file} (RMSE {rmse:.2f})", fontsize=8)
+        ax.tick_params(labelsize=6)
+    for ax in axes[len(rows):]:
+        ax.set_axis_off()
+    figure.tight_layout()
+    figure.savefig(output, dpi=100)
+    return [output]
+
+
+def plot_fits(csv_folder, fit_results_csv, fit_results_folder, policy="all", every=100, worst=50, workers=1,
+              panels=16, contact_sheet=True):
+    """
+    Render the fitted curves of selected cross-sections, as a separate step after curve_fitting.
+
+    Parameters:
+    csv_folder (str): Path to the folder containing the CSV files, or to a cross-section store.
+    fit_results_csv (str): Path to the fit results CSV (or .parquet) file written by curve_fitting.
+    fit_results_folder (str): Path to the folder to save the plots.
+    policy (str): Fitted cross-sections to plot: "none", "every" (every Nth in file order), "worst" (the K with the
+                  largest root mean square residual) or "all".
+    every (int): N of the "every" policy.
+    worst (int): K of the "worst" policy.
+    workers (int): Number of worker processes (1 renders in this process).
+    panels (int): Number of cross-sections per contact sheet (and per task without contact sheets).
+    contact_sheet (bool): Write multi-panel contact sheets (fit_contact_sheet_<n>.png) instead of one
+                          <File>_plot.png per cross-section.
+
+    Returns:
+    list: Paths of the written images.
+    """
+    if policy == "none":
+        return []
+    if policy not in ("every", "worst", "all"):
+        raise ValueError(f"Unknown plot policy '{policy}', expected 'none', 'every', 'worst' or 'all'.")
+
+    results = read_fit_results(fit_results_csv)
+    results = results[results["Status"] == FIT_OK] if "Status" in results.columns else results.dropna()
+    rows = list(results[["File", "Mu", "Sigma", "Pi"]].itertuples(index=False, name=None))
+
+    with Pool(workers) if workers > 1 else nullcontext() as pool:
+        run = pool.map if pool else lambda function, tasks: list(map(function, tasks))
+
+        rmse = np.full(len(rows), np.nan)
+        if policy == "every":
+            rows, rmse = rows[::every], rmse[::every]
+        elif policy == "worst":
+            chunks = [(csv_folder, rows[start:start + 256]) for start in range(0, len(rows), 256)]
+            rmse = np.array([value for chunk in run(section_residuals_task, chunks) for value in chunk])
+            order = np.argsort(-np.nan_to_num(rmse, nan=-np.inf), kind='stable')[:worst]
+            rows, rmse = [rows[i] for i in order], rmse[order]
+
+        rows = [row + (error,) for row, error in zip(rows, rmse)]
+        tasks = []
+        for start in range(0, len(rows), panels):
+            output = fit_results_folder
+            if contact_sheet:
+                output = os.path.join(fit_results_folder, f"fit_contact_sheet_{start // panels + 1:04d}.png")
+            tasks.append((csv_folder, rows[start:start + panels], output, contact_sheet))
+        written = [path for paths in run(render_fit_plots_task, tasks) for path in paths]
+
+    print(f"{len(written)} fit plot(s) of {len(rows)} cross-section(s) saved to '{fit_results_folder}'.")
+    return written
 
 
 if __name__ == '__main__':
     import config
 
     curve_fitting(
-        csv_folder=config.csv_output_folder,
+        csv_folder=config.cross_section_store or config.csv_output_folder,
         fit_results_folder=config.fit_results_folder,
-        fit_results_csv=config.fit_results_csv
+        fit_results_csv=config.fit_results_csv,
+        batched=config.batched_curve_fitting,
+        workers=config.curve_fitting_workers,
+        chunk_size=config.curve_fitting_chunk_size,
+        flush_rows=config.fit_results_flush_rows
     )
 
+    plot_fits(
+        csv_folder=config.cross_section_store or config.csv_output_folder,
+        fit_results_csv=config.fit_results_csv,
+        fit_results_folder=config.fit_results_folder,
+        policy=config.plot_policy,
+        every=config.plot_every,
+        worst=config.plot_worst,
+        workers=config.plot_workers,
+        panels=config.plot_panels
+    )
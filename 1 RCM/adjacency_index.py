@@ -0,0 +1,93 @@
+import json
+import os
+import time
+import numpy as np
+from scipy import sparse
+
+# Manifest of an index directory: checksum of the polygon geometries and the layer it was built from
+MANIFEST = "adjacency.json"
+
+# Arrays of an index directory, one .npy file each
+ARRAYS = ("ids", "indptr", "indices")
+
+
+class AdjacencyIndex:
+    """
+    Polygon adjacency graph saved as memory-mapped CSR arrays: ids (sorted polygon ids), indptr and indices (the
+    positions of the neighbours of each polygon, see backends.adjacency_csr). Loading an index only maps the files,
+    so it is reused across runs without rebuilding the graph.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        self.path = path
+        self.checksum = self.manifest["checksum"]
+        self.ids, self.indptr, self.indices = (np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                                               for name in ARRAYS)
+
+    @staticmethod
+    def write(path, ids, indptr, indices, checksum, feature_class, id_field):
+        """Save a graph to an index directory (the manifest is written last, so an interrupted write is rebuilt)."""
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        for name, values in zip(ARRAYS, (ids, indptr, indices)):
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(values))
+        manifest = {"checksum": checksum, "feature_class": feature_class, "id_field": id_field,
+                    "polygons": len(ids), "edges": len(indices), "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, polygon_ids):
+        """Positions of polygon ids in the graph (KeyError if an id is not in the index)."""
+        polygon_ids = np.asarray(polygon_ids)
+        positions = np.searchsorted(self.ids, polygon_ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == polygon_ids[found]
+        if not found.all():
+            raise KeyError(f"Polygon ids not in the adjacency index: {polygon_ids[~found][:10].tolist()}")
+        return positions
+
+    def neighbors(self, polygon_id):
+        """Sorted ids of the polygons intersecting a polygon."""
+        position = self.positions([polygon_id])[0]
+        return np.asarray(self.ids[self.indices[self.indptr[position]:self.indptr[position + 1]]])
+
+    def matrix(self):
+        """Binary adjacency matrix (scipy CSR, rows and columns in id order), e.g. for spatial lags."""
+        return sparse.csr_matrix((np.ones(len(self.indices)), self.indices, self.indptr), shape=(len(self), len(self)))
+
+
+def load_adjacency_index(backend, feature_class, id_field, path):
+    """
+    Load the adjacency index of a polygon layer, or build and save it if it is missing or its geometry checksum no
+    longer matches the layer (attribute updates, e.g. of the cluster field, keep it valid).
+
+    Parameters:
+    backend (backends.Backend): Backend used to read the layer.
+    feature_class (str): Path to the polygon layer.
+    id_field (str): Field identifying the polygons.
+    path (str): Path to the index directory.
+
+    Returns:
+    AdjacencyIndex: The index.
+    """
+    checksum = backend.geometry_checksum(feature_class, id_field)
+    if os.path.isfile(os.path.join(path, MANIFEST)):
+        index = AdjacencyIndex(path)
+        if (index.checksum, index.manifest["id_field"]) == (checksum, id_field):
+            print(f"Adjacency index loaded from '{path}': {len(index)} polygons.")
+            return index
+        del index
+        print(f"Adjacency index '{path}' is out of date, rebuilding it.")
+
+    start = time.perf_counter()
+    ids, indptr, indices = backend.adjacency_graph(feature_class, id_field)
+    AdjacencyIndex.write(path, ids, indptr, indices, checksum, feature_class, id_field)
+    print(f"Adjacency index of {len(ids)} polygons saved to '{path}' ({time.perf_counter() - start:.1f} s).")
+    return AdjacencyIndex(path)
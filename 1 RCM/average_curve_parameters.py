@@ -1,46 +1,106 @@
 import pandas as pd
+from CrossSection_curvefitting import FIT_OK
+
+# CrosSecID = NLC_ID * 10000 + rank of the cross-section (see cross_section_geometry.generate_cross_sections)
+CROSS_SECTION_ID_FACTOR = 10000
+
+# NLC_ID of each fit result, from the CrosSecID at the end of its File (a CrosSecID, or a CSV file name stem such as
+# SelectedCrossSectionPointsNTLExt_SAMPLENAME___0000<CrosSecID>)
+def polygon_ids(files):
+    cross_section_ids = pd.to_numeric(files.astype(str).str.extract(r'(\d+)$', expand=False))
+    unmatched = cross_section_ids.isna()
+    if unmatched.any():
+        print(f"Warning: {unmatched.sum()} File value(s) without a trailing CrosSecID are left out of the averages "
+              f"(e.g. {files[unmatched].iloc[0]!r}).")
+    return cross_section_ids // CROSS_SECTION_ID_FACTOR
 
 def process_and_save_csv(input_file_path, output_file_path, output_file_path_skipna):
     """
     Processes the fit results CSV to calculate average curve parameters for each polygon.
 
     Parameters:
-    input_file_path (str): Path to the input fit results CSV file.
+    input_file_path (str): Path to the input fit results CSV (or .parquet) file.
     output_file_path (str): Path to save the grouped average fit results CSV file.
     output_file_path_skipna (str): Path to save the grouped average fit results CSV file, skipping NaN values.
     """
     # Load the CSV file into a DataFrame
-    df = pd.read_csv(input_file_path)
+    if input_file_path.endswith(".parquet"):
+        df = pd.read_parquet(input_file_path)
+    else:
+        df = pd.read_csv(input_file_path)
+
+    # Keep the fitted cross-sections only (failed fits are listed with their status code)
+    if 'Status' in df.columns:
+        print(f"Fit status counts:\n{df['Status'].value_counts().sort_index()}")
+        df = df[df['Status'] == FIT_OK].drop(columns='Status')
 
     # Check for missing values in the DataFrame
     missing_values_info = df.isnull().sum()
     print("Missing values information:")
     print(missing_values_info)
 
-    # Divide the 'File' column by 10000 and take the integer part
-    df['File_grouped'] = (df['File'] // 100000).astype(int)
+    # Replace the 'File' column by the NLC_ID of the polygon of each cross-section
+    df = df.assign(File_grouped=polygon_ids(df['File'])).drop(columns='File').dropna(subset=['File_grouped'])
+    df['File_grouped'] = df['File_grouped'].astype('int64')
 
     # Group by the new 'File_grouped' column and calculate the mean
     grouped_df = df.groupby('File_grouped').mean()
 
+    save_grouped_results(grouped_df, output_file_path, output_file_path_skipna)
+
+
+# Saves the average fit results grouped by 'File_grouped' to the two output CSV files
+def save_grouped_results(grouped_df, output_file_path, output_file_path_skipna):
     # Reset the index and rename the 'File_grouped' column back to 'File'
-    grouped_df.reset_index(inplace=True)
+    grouped_df = grouped_df.reset_index()
     grouped_df.rename(columns={'File_grouped': 'File'}, inplace=True)
 
     # Save the new DataFrame to a CSV file
     grouped_df.to_csv(output_file_path, index=False)
     print(f"Grouped fit results saved to '{output_file_path}'.")
 
-    # Group by 'File_grouped' and calculate the mean, skipping missing values
-    grouped_df_skipna = df.groupby('File_grouped').mean()
+    # The mean already skips missing values, so the skipna file holds the same averages
+    grouped_df.to_csv(output_file_path_skipna, index=False)
+    print(f"Grouped fit results (skipping NaN) saved to '{output_file_path_skipna}'.")
 
-    # Reset the index and rename the 'File_grouped' column back to 'File'
-    grouped_df_skipna.reset_index(inplace=True)
-    grouped_df_skipna.rename(columns={'File_grouped': 'File'}, inplace=True)
 
-    # Save the new DataFrame to a CSV file, skipping NaN values
-    grouped_df_skipna.to_csv(output_file_path_skipna, index=False)
-    print(f"Grouped fit results (skipping NaN) saved to '{output_file_path_skipna}'.")
+class PolygonAverages:
+    """
+    Streaming counterpart of process_and_save_csv: fit results are added chunk by chunk and only the per-polygon sums
+    and counts are kept, so the averages are those of grouping the whole table without holding it in memory.
+    """
+
+    def __init__(self):
+        self.sums = None
+        self.counts = None
+        self.status_counts = pd.Series(dtype=int)
+
+    def add(self, df):
+        """Add a chunk of fit results (a DataFrame as written by curve_fitting)."""
+        # Keep the fitted cross-sections only (failed fits are listed with their status code)
+        if 'Status' in df.columns:
+            self.status_counts = self.status_counts.add(df['Status'].value_counts(), fill_value=0).astype(int)
+            df = df[df['Status'] == FIT_OK].drop(columns='Status')
+        df = df.assign(File_grouped=polygon_ids(df['File'])).drop(columns='File').dropna(subset=['File_grouped'])
+        df['File_grouped'] = df['File_grouped'].astype('int64')
+
+        grouped = df.groupby('File_grouped')
+        sums, counts = grouped.sum(), grouped.count()
+        if self.sums is None:
+            self.sums, self.counts = sums, counts
+        else:
+            self.sums = self.sums.add(sums, fill_value=0)
+            self.counts = self.counts.add(counts, fill_value=0)
+
+    def mean(self):
+        """Return the average fit results of each polygon, indexed by 'File_grouped'."""
+        if self.sums is None:
+            return pd.DataFrame(index=pd.Index([], name='File_grouped'))
+        return (self.sums / self.counts).sort_index()
+
+    def save(self, output_file_path, output_file_path_skipna):
+        print(f"Fit status counts:\n{self.status_counts.sort_index()}")
+        save_grouped_results(self.mean(), output_file_path, output_file_path_skipna)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,484 @@
+import hashlib
+import os
+import sqlite3
+from contextlib import closing
+import numpy as np
+import cross_section_geometry as geometry
+import raster_cache
+
+try:
+    import arcpy
+except ImportError:
+    # arcpy is only needed by ArcpyBackend and the legacy geoprocessing workflow
+    arcpy = None
+
+try:
+    import fiona
+    import rasterio
+    from shapely import wkb
+    from shapely.geometry import shape
+    from shapely.strtree import STRtree
+except ImportError:
+    # fiona, rasterio and shapely are only needed by OpenSourceBackend
+    fiona = rasterio = wkb = shape = STRtree = None
+
+# Geometry type names used by write_features, mapped to the ArcGIS feature class geometry types
+ARCPY_GEOMETRY_TYPES = {'Point': 'POINT', 'LineString': 'POLYLINE', 'Polygon': 'POLYGON'}
+
+# Field names that refer to the object/feature id rather than an attribute
+OID_FIELDS = ('OID@', 'OBJECTID', 'fid')
+
+
+# Raster rows/columns (row_start, row_stop, column_start, column_stop) covering a bounding box, clipped to the raster
+def window_for_bounds(transform, raster_shape, window_bounds):
+    xmin, ymin, xmax, ymax = window_bounds
+    row_start, column_start = geometry.world_to_pixel(transform, xmin, ymax)
+    row_stop, column_stop = geometry.world_to_pixel(transform, xmax, ymin)
+    row_start, row_stop = np.clip([row_start, row_stop + 1], 0, raster_shape[0])
+    column_start, column_stop = np.clip([column_start, column_stop + 1], 0, raster_shape[1])
+    return int(row_start), int(row_stop), int(column_start), int(column_stop)
+
+# Polygon adjacency graph as CSR arrays from the (source, target) index pairs of intersecting polygons: the neighbours
+# of polygon i are indices[indptr[i]:indptr[i + 1]], sorted, without duplicates or i itself
+def adjacency_csr(n_polygons, sources, targets):
+    sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+    keep = sources != targets
+    pairs = np.unique(sources[keep] * n_polygons + targets[keep])
+    indices = pairs % n_polygons
+    indptr = np.searchsorted(pairs // n_polygons, np.arange(n_polygons + 1))
+    return indptr, indices
+
+# Convert NumPy scalars to plain Python values for cursors and feature properties
+def python_value(value):
+    value = value.item() if hasattr(value, 'item') else value
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+# Size of the envelope of a GeoPackage geometry blob by envelope indicator (bits 1-3 of the flags byte)
+GPKG_ENVELOPE_BYTES = (0, 32, 48, 48, 64)
+
+# Decode a GeoPackage geometry blob: an 8-byte header (flags in byte 3), an optional envelope and the WKB geometry
+def gpkg_geometry(blob):
+    return wkb.loads(bytes(blob[8 + GPKG_ENVELOPE_BYTES[(blob[3] >> 1) & 0x07]:]))
+
+# SQLite connection to a GeoPackage with the ST_ functions called by its R-tree triggers (GDAL registers them when it
+# opens the file, plain sqlite3 does not, so an UPDATE would fail to prepare)
+def gpkg_connection(path):
+    connection = sqlite3.connect(path)
+    connection.create_function("ST_IsEmpty", 1, lambda blob: None if blob is None else int(bool(blob[3] & 0x10)))
+    for name, k in (("ST_MinX", 0), ("ST_MinY", 1), ("ST_MaxX", 2), ("ST_MaxY", 3)):
+        connection.create_function(name, 1, lambda blob, k=k: None if blob is None else gpkg_geometry(blob).bounds[k])
+    return connection
+
+
+class Backend:
+    """
+    Raster and vector access used by the RCM stages.
+
+    Subclasses only implement data access (reading polygons/lines/tables, raster sources, writing features, merging
+    and adjacency). Raster reads go through a raster_cache tile cache with a byte budget, and mask extraction,
+    points along lines and value sampling are shared NumPy code on top of it, so every backend produces the same
+    cross-section tables from the same inputs.
+    """
+    name = None
+
+    def __init__(self, tile_size=raster_cache.DEFAULT_TILE_SIZE, cache_bytes=raster_cache.DEFAULT_CACHE_BYTES):
+        self.tile_size = tile_size
+        self.cache_bytes = cache_bytes
+        self.tile_cache = raster_cache.TileCache(cache_bytes)
+        self.rasters = {}
+
+    def iter_polygons(self, feature_class, id_field):
+        """Yield (rings, id) for each polygon, where rings is a list of (n, 2) vertex arrays."""
+        raise NotImplementedError
+
+    def iter_lines(self, feature_class, id_field):
+        """Yield (coords, id) for each line, where coords is an (n, 2) vertex array."""
+        raise NotImplementedError
+
+    def list_feature_classes(self, workspace):
+        raise NotImplementedError
+
+    def spatial_reference(self, dataset):
+        raise NotImplementedError
+
+    def read_table(self, table, fields):
+        """Return a dict mapping each field to a NumPy array of its values."""
+        raise NotImplementedError
+
+    def write_features(self, output, geometry_type, geometries, columns, spatial_reference=None):
+        """Write geometries ('Point', 'LineString' or 'Polygon') and their attribute columns to a new feature class."""
+        raise NotImplementedError
+
+    def update_field(self, feature_class, id_field, field, values):
+        """Set field to values[id] for every feature whose id is a key of values."""
+        raise NotImplementedError
+
+    def merge(self, inputs, output):
+        raise NotImplementedError
+
+    def delete_feature_class(self, feature_class):
+        """Delete a feature class, if it exists."""
+        raise NotImplementedError
+
+    def adjacency_graph(self, feature_class, id_field):
+        """
+        Return (ids, indptr, indices): the polygon ids and the CSR arrays of the polygons each one intersects (see
+        adjacency_csr), built in one pass over the layer.
+        """
+        raise NotImplementedError
+
+    def adjacency(self, feature_class, id_field):
+        """Return a dict mapping each polygon id to the sorted ids of the polygons it intersects (itself excluded)."""
+        ids, indptr, indices = self.adjacency_graph(feature_class, id_field)
+        return {feature_id: ids[indices[indptr[i]:indptr[i + 1]]].tolist() for i, feature_id in enumerate(ids.tolist())}
+
+    def geometry_checksum(self, feature_class, id_field):
+        """
+        Return a SHA-256 digest of the ids and geometries of the features (attributes are left out), used to tell
+        whether a cached adjacency index still matches the layer.
+        """
+        digest = hashlib.sha256()
+        for rings, feature_id in sorted(self.iter_polygons(feature_class, id_field), key=lambda item: item[1]):
+            digest.update(repr(feature_id).encode())
+            for ring in rings:
+                digest.update(np.ascontiguousarray(ring, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def raster_source(self, raster):
+        """Return a raster_cache source (transform, shape and read_block) for the raster."""
+        raise NotImplementedError
+
+    # Windowed, tile-cached access to a raster; every raster of the backend shares one cache budget
+    def raster(self, raster):
+        cached_raster = self.rasters.get(raster)
+        if cached_raster is None:
+            cached_raster = raster_cache.CachedRaster(self.raster_source(raster), self.tile_cache, self.tile_size)
+            self.rasters[raster] = cached_raster
+        return cached_raster
+
+    # Hit/miss statistics of the raster tile cache
+    def cache_stats(self):
+        return self.tile_cache.stats
+
+    # Cell values covering window_bounds as (array, transform), with NoData as NaN
+    def read_raster_window(self, raster, window_bounds):
+        cached_raster = self.raster(raster)
+        row_start, row_stop, column_start, column_stop = window_for_bounds(
+            cached_raster.transform, cached_raster.shape, window_bounds)
+        x_origin, cell_width, _, y_origin, _, cell_height = cached_raster.transform
+        window_transform = (x_origin + column_start * cell_width, cell_width, 0.0,
+                            y_origin + row_start * cell_height, 0.0, cell_height)
+        return cached_raster.read_window(row_start, row_stop, column_start, column_stop), window_transform
+
+    # Cell values inside a polygon (cell centre rule, as ExtractByMask) and NaN elsewhere
+    def extract_by_mask(self, raster, rings):
+        array, transform = self.read_raster_window(raster, geometry.bounds(rings))
+        x, y = geometry.pixel_centers(transform, array.shape)
+        return np.where(geometry.points_in_polygon(x, y, rings), array, np.nan), transform
+
+    # Points every `distance` map units along each line
+    def points_along_lines(self, lines, distance):
+        points, line_index, _ = geometry.points_along_lines(lines, distance)
+        return np.split(points, np.cumsum(np.bincount(line_index, minlength=len(lines)))[:-1])
+
+    # Cell values under each point (no interpolation, as ExtractValuesToPoints), NaN outside the raster
+    def sample_values(self, raster, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cached_raster = self.raster(raster)
+        rows, columns = geometry.world_to_pixel(cached_raster.transform, points[:, 0], points[:, 1])
+        return cached_raster.sample(rows, columns)
+
+
+class ArcpyBackend(Backend):
+    """Backend on top of ArcGIS geodatabases and rasters."""
+    name = 'arcpy'
+
+    def __init__(self, **cache_options):
+        if arcpy is None:
+            raise ImportError("ArcpyBackend requires arcpy (ArcGIS Pro).")
+        super().__init__(**cache_options)
+        arcpy.env.overwriteOutput = True
+
+    def iter_polygons(self, feature_class, id_field):
+        with arcpy.da.SearchCursor(feature_class, ["SHAPE@", id_field]) as cursor:
+            for shape_geometry, feature_id in cursor:
+                rings = []
+                for part in shape_geometry:
+                    ring = []
+                    for point in part:
+                        # Rings of a part are separated by None
+                        if point is None:
+                            rings.append(np.array(ring))
+                            ring = []
+                        else:
+                            ring.append((point.X, point.Y))
+                    if ring:
+                        rings.append(np.array(ring))
+                yield rings, feature_id
+
+    def iter_lines(self, feature_class, id_field):
+        with arcpy.da.SearchCursor(feature_class, ["SHAPE@", id_field]) as cursor:
+            for shape_geometry, feature_id in cursor:
+                coords = [(point.X, point.Y) for part in shape_geometry for point in part if point is not None]
+                yield np.array(coords), feature_id
+
+    def list_feature_classes(self, workspace):
+        arcpy.env.workspace = workspace
+        return arcpy.ListFeatureClasses() or []
+
+    def spatial_reference(self, dataset):
+        return arcpy.Describe(dataset).spatialReference
+
+    def read_table(self, table, fields):
+        with arcpy.da.SearchCursor(table, fields) as cursor:
+            rows = list(cursor)
+        return {field: np.array([row[k] for row in rows]) for k, field in enumerate(fields)}
+
+    def write_features(self, output, geometry_type, geometries, columns, spatial_reference=None):
+        out_path, out_name = os.path.split(output)
+        arcpy.management.CreateFeatureclass(out_path, out_name, ARCPY_GEOMETRY_TYPES[geometry_type],
+                                            spatial_reference=spatial_reference)
+        for field, values in columns.items():
+            values = np.asarray(values)
+            field_type = "LONG" if values.dtype.kind in "iub" else "DOUBLE" if values.dtype.kind == "f" else "TEXT"
+            arcpy.management.AddField(output, field, field_type)
+
+        shape_field = "SHAPE@XY" if geometry_type == 'Point' else "SHAPE@"
+        with arcpy.da.InsertCursor(output, [shape_field] + list(columns)) as cursor:
+            for k, feature_geometry in enumerate(geometries):
+                if geometry_type == 'Point':
+                    shape_value = (float(feature_geometry[0]), float(feature_geometry[1]))
+                elif geometry_type == 'LineString':
+                    shape_value = arcpy.Polyline(arcpy.Array([arcpy.Point(*xy) for xy in feature_geometry]),
+                                                 spatial_reference)
+                else:
+                    shape_value = arcpy.Polygon(arcpy.Array([arcpy.Array([arcpy.Point(*xy) for xy in ring])
+                                                             for ring in feature_geometry]), spatial_reference)
+                cursor.insertRow([shape_value] + [python_value(columns[field][k]) for field in columns])
+
+    def update_field(self, feature_class, id_field, field, values):
+        with arcpy.da.UpdateCursor(feature_class, [id_field, field]) as cursor:
+            for row in cursor:
+                if row[0] in values:
+                    row[1] = python_value(values[row[0]])
+                    cursor.updateRow(row)
+
+    def merge(self, inputs, output):
+        arcpy.Merge_management(inputs=inputs, output=output)
+
+    def delete_feature_class(self, feature_class):
+        if arcpy.Exists(feature_class):
+            arcpy.management.Delete(feature_class)
+
+    def geometry_checksum(self, feature_class, id_field):
+        # Hash the WKB of the shapes as returned by the cursor, without building the rings; the ORDER BY clause needs
+        # the name of the OID field, not the OID@ token
+        if id_field in OID_FIELDS:
+            id_field, order_field = "OID@", arcpy.Describe(feature_class).OIDFieldName
+        else:
+            order_field = id_field
+        digest = hashlib.sha256()
+        with arcpy.da.SearchCursor(feature_class, [id_field, "SHAPE@WKB"],
+                                   sql_clause=(None, f"ORDER BY {order_field}")) as cursor:
+            for feature_id, wkb in cursor:
+                digest.update(repr(feature_id).encode())
+                digest.update(bytes(wkb or b""))
+        return digest.hexdigest()
+
+    def adjacency_graph(self, feature_class, id_field):
+        # One PolygonNeighbors run replaces a SelectLayerByLocation query per polygon
+        id_field = "OBJECTID" if id_field in OID_FIELDS else id_field
+        neighbor_table = "memory/polygon_neighbors"
+        arcpy.analysis.PolygonNeighbors(feature_class, neighbor_table,
+                                        in_fields=None if id_field == "OBJECTID" else [id_field])
+
+        ids = np.unique(arcpy.da.FeatureClassToNumPyArray(feature_class, [id_field])[id_field])
+        pairs = arcpy.da.TableToNumPyArray(neighbor_table, [f"src_{id_field}", f"nbr_{id_field}"])
+        arcpy.Delete_management(neighbor_table)
+        sources = np.searchsorted(ids, pairs[f"src_{id_field}"])
+        targets = np.searchsorted(ids, pairs[f"nbr_{id_field}"])
+        return (ids, *adjacency_csr(len(ids), sources, targets))
+
+    def raster_source(self, raster):
+        return raster_cache.ArcpyRasterSource(raster)
+
+
+class OpenSourceBackend(Backend):
+    """
+    Backend on top of GeoTIFF rasters (rasterio) and GeoPackage layers (fiona/shapely).
+
+    Feature classes are addressed as "<file>.gpkg/<layer>" and workspaces as "<file>.gpkg", mirroring
+    "<file>.gdb/<feature class>". Files are opened per call, so instances can be used from worker processes.
+    """
+    name = 'opensource'
+
+    def __init__(self, **cache_options):
+        if fiona is None:
+            raise ImportError("OpenSourceBackend requires fiona, rasterio and shapely.")
+        super().__init__(**cache_options)
+
+    @staticmethod
+    def split_layer(feature_class):
+        index = feature_class.lower().rfind('.gpkg')
+        if index < 0:
+            raise ValueError(f"Expected a '<file>.gpkg/<layer>' path, got '{feature_class}'.")
+        return feature_class[:index + 5], feature_class[index + 6:] or None
+
+    @staticmethod
+    def gpkg_table(connection, layer):
+        """Table name (the first feature layer if layer is None), geometry column and primary key of a layer."""
+        if layer is None:
+            layer = connection.execute("SELECT table_name FROM gpkg_contents WHERE data_type = 'features' "
+                                       "ORDER BY table_name").fetchone()[0]
+        geometry_column = connection.execute("SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?",
+                                             (layer,)).fetchone()[0]
+        primary_key = next(row[1] for row in connection.execute(f'PRAGMA table_info("{layer}")') if row[5])
+        return layer, geometry_column, primary_key
+
+    @staticmethod
+    def feature_value(feature, field):
+        if field in OID_FIELDS:
+            return int(feature.id)
+        return feature['properties'][field]
+
+    def iter_features(self, feature_class):
+        path, layer = self.split_layer(feature_class)
+        with fiona.open(path, layer=layer) as source:
+            for feature in source:
+                yield feature
+
+    def iter_polygons(self, feature_class, id_field):
+        for feature in self.iter_features(feature_class):
+            polygon_shape = shape(feature['geometry'])
+            rings = []
+            for polygon in getattr(polygon_shape, 'geoms', [polygon_shape]):
+                rings.append(np.array(polygon.exterior.coords))
+                rings.extend(np.array(interior.coords) for interior in polygon.interiors)
+            yield rings, self.feature_value(feature, id_field)
+
+    def iter_lines(self, feature_class, id_field):
+        for feature in self.iter_features(feature_class):
+            line_shape = shape(feature['geometry'])
+            coords = [xy for line in getattr(line_shape, 'geoms', [line_shape]) for xy in line.coords]
+            yield np.array(coords), self.feature_value(feature, id_field)
+
+    def list_feature_classes(self, workspace):
+        return fiona.listlayers(workspace) if os.path.exists(workspace) else []
+
+    def spatial_reference(self, dataset):
+        if '.gpkg' in dataset.lower():
+            path, layer = self.split_layer(dataset)
+            with fiona.open(path, layer=layer) as source:
+                return source.crs_wkt
+        with rasterio.open(dataset) as source:
+            return source.crs.to_wkt() if source.crs else None
+
+    def read_table(self, table, fields):
+        features = list(self.iter_features(table))
+        return {field: np.array([self.feature_value(feature, field) for feature in features]) for field in fields}
+
+    def write_features(self, output, geometry_type, geometries, columns, spatial_reference=None):
+        properties = {}
+        for field, values in columns.items():
+            kind = np.asarray(values).dtype.kind
+            properties[field] = 'int' if kind in "iub" else 'float' if kind == "f" else 'str'
+
+        records = []
+        for k, feature_geometry in enumerate(geometries):
+            if geometry_type == 'Point':
+                coordinates = (float(feature_geometry[0]), float(feature_geometry[1]))
+            elif geometry_type == 'LineString':
+                coordinates = [tuple(map(float, xy)) for xy in feature_geometry]
+            else:
+                coordinates = [[tuple(map(float, xy)) for xy in ring] for ring in feature_geometry]
+            records.append({'geometry': {'type': geometry_type, 'coordinates': coordinates},
+                            'properties': {field: python_value(columns[field][k]) for field in columns}})
+
+        path, layer = self.split_layer(output)
+        schema = {'geometry': geometry_type, 'properties': properties}
+        with fiona.open(path, 'w', driver='GPKG', layer=layer, schema=schema, crs_wkt=spatial_reference) as sink:
+            sink.writerecords(records)
+
+    def update_field(self, feature_class, id_field, field, values):
+        # A GeoPackage is a SQLite database: update the rows in place, so the fids and the other columns are untouched
+        path, layer = self.split_layer(feature_class)
+        with closing(gpkg_connection(path)) as connection, connection:
+            layer, _, primary_key = self.gpkg_table(connection, layer)
+            key = primary_key if id_field in OID_FIELDS else id_field
+            connection.executemany(f'UPDATE "{layer}" SET "{field}" = ? WHERE "{key}" = ?',
+                                   ((python_value(value), python_value(feature_id))
+                                    for feature_id, value in values.items()))
+
+    def merge(self, inputs, output):
+        schema, crs_wkt, records = None, None, []
+        for feature_class in inputs:
+            path, layer = self.split_layer(feature_class)
+            with fiona.open(path, layer=layer) as source:
+                if schema is None:
+                    schema = {'geometry': source.schema['geometry'], 'properties': dict(source.schema['properties'])}
+                    crs_wkt = source.crs_wkt
+                for field, field_type in source.schema['properties'].items():
+                    schema['properties'].setdefault(field, field_type)
+                records.extend({'geometry': feature['geometry'], 'properties': dict(feature['properties'])}
+                               for feature in source)
+
+        fields = list(schema['properties'])
+        for record in records:
+            record['properties'] = {field: record['properties'].get(field) for field in fields}
+
+        path, layer = self.split_layer(output)
+        with fiona.open(path, 'w', driver='GPKG', layer=layer, schema=schema, crs_wkt=crs_wkt) as sink:
+            sink.writerecords(records)
+
+    def delete_feature_class(self, feature_class):
+        path, layer = self.split_layer(feature_class)
+        if layer in self.list_feature_classes(path):
+            fiona.remove(path, driver='GPKG', layer=layer)
+
+    def geometry_checksum(self, feature_class, id_field):
+        if id_field not in OID_FIELDS:
+            return super().geometry_checksum(feature_class, id_field)
+        # A GeoPackage is a SQLite database: hash the stored geometry blobs without decoding the features
+        path, layer = self.split_layer(feature_class)
+        with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as connection:
+            layer, geometry_column, primary_key = self.gpkg_table(connection, layer)
+            digest = hashlib.sha256()
+            for feature_id, blob in connection.execute(f'SELECT "{primary_key}", "{geometry_column}" FROM "{layer}" '
+                                                       f'ORDER BY "{primary_key}"'):
+                digest.update(repr(feature_id).encode())
+                digest.update(blob or b"")
+        return digest.hexdigest()
+
+    def adjacency_graph(self, feature_class, id_field):
+        features = list(self.iter_features(feature_class))
+        ids = np.array([self.feature_value(feature, id_field) for feature in features])
+        shapes = [shape(feature['geometry']) for feature in features]
+
+        # Same relationship as SelectLayerByLocation INTERSECT: shared edges and shared vertices both count
+        sources, targets = STRtree(shapes).query(shapes, predicate='intersects')
+        # Polygons in id order, so the neighbour lists are sorted by id
+        order = np.argsort(ids, kind='stable')
+        positions = np.empty(len(ids), dtype=np.int64)
+        positions[order] = np.arange(len(ids))
+        return (ids[order], *adjacency_csr(len(ids), positions[sources], positions[targets]))
+
+    def raster_source(self, raster):
+        return raster_cache.RasterioRasterSource(raster)
+
+
+# Registered backends, selected by name in config.py
+BACKENDS = {
+    'arcpy': ArcpyBackend,
+    'opensource': OpenSourceBackend,
+}
+
+# Return a backend instance from its name (None keeps the legacy geoprocessing workflow)
+def get_backend(backend, **cache_options):
+    if backend is None or isinstance(backend, Backend):
+        return backend
+    backend_class = BACKENDS.get(backend)
+    if backend_class is None:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {sorted(BACKENDS)}.")
+    return backend_class(**cache_options)
@@ -0,0 +1,159 @@
+from itertools import combinations
+import numpy as np
+from scipy.stats import norm
+from sklearn.metrics import adjusted_rand_score, calinski_harabasz_score, davies_bouldin_score
+
+# Default memory budget of the pairwise distance blocks (bytes)
+DEFAULT_MEMORY_BYTES = 256 * 2 ** 20
+
+
+def silhouette_values(data, labels, rows=None, memory_bytes=DEFAULT_MEMORY_BYTES):
+    """
+    Exact silhouette of the given rows against all the points, with the pairwise distances computed in blocks of
+    rows that fit in memory_bytes instead of one (n, n) matrix. Points alone in their cluster get 0, as in sklearn.
+
+    Parameters:
+    data (ndarray): Data, one row per point.
+    labels (ndarray): Cluster label of each point (every label, including DBSCAN noise, counts as a cluster).
+    rows (ndarray): Indices of the points to score (all points if None).
+    memory_bytes (int): Memory budget of a block of distances.
+
+    Returns:
+    ndarray: Silhouette of each row.
+    """
+    data = np.asarray(data, dtype=float)
+    _, labels = np.unique(labels, return_inverse=True)
+    rows = np.arange(len(data)) if rows is None else np.asarray(rows)
+    n_clusters = labels.max() + 1
+    cluster_sizes = np.bincount(labels, minlength=n_clusters)
+    membership = np.zeros((len(data), n_clusters))
+    membership[np.arange(len(data)), labels] = 1
+    squared_norms = np.einsum('ij,ij->i', data, data)
+
+    # Each block holds the distances of block_rows rows to every point, and a temporary of the same size
+    block_rows = max(1, memory_bytes // (16 * len(data)))
+    values = np.empty(len(rows))
+    for start in range(0, len(rows), block_rows):
+        block = rows[start:start + block_rows]
+        distances = squared_norms[block, None] + squared_norms[None, :] - 2 * data[block] @ data.T
+        np.sqrt(np.maximum(distances, 0, out=distances), out=distances)
+        # Sum of the distances of each row to the points of each cluster
+        cluster_sums = distances @ membership
+        del distances
+
+        own = labels[block]
+        own_sizes = cluster_sizes[own]
+        a = cluster_sums[np.arange(len(block)), own] / np.maximum(own_sizes - 1, 1)
+        means = cluster_sums / cluster_sizes
+        means[np.arange(len(block)), own] = np.inf
+        b = means.min(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            s = (b - a) / np.maximum(a, b)
+        values[start:start + len(block)] = np.where((own_sizes > 1) & np.isfinite(s), s, 0)
+    return values
+
+
+def stratified_sample(labels, sample_size, random_state=0):
+    """
+    Draws a sample of about sample_size points stratified by cluster (proportional allocation, at least two points
+    per cluster where possible).
+
+    Returns:
+    list: (indices of the sampled points, size of the cluster) for each cluster.
+    """
+    rng = np.random.default_rng(random_state)
+    strata = []
+    for label in np.unique(labels):
+        members = np.flatnonzero(labels == label)
+        size = min(len(members), max(2, round(sample_size * len(members) / len(labels))))
+        strata.append((rng.choice(members, size, replace=False), len(members)))
+    return strata
+
+
+def silhouette(data, labels, sample_size=None, memory_bytes=DEFAULT_MEMORY_BYTES, confidence=0.95, random_state=0):
+    """
+    Mean silhouette of a clustering, exact or estimated from a stratified sample.
+
+    The sampled points are scored against all the points (not only against the sample), and the mean is the
+    stratified estimate, with a normal confidence interval from the within-cluster variances (finite population
+    corrected).
+
+    Parameters:
+    data (ndarray): Data, one row per point.
+    labels (ndarray): Cluster label of each point.
+    sample_size (int): Number of sampled points, or None for the exact silhouette of all the points.
+    memory_bytes (int): Memory budget of a block of distances.
+    confidence (float): Confidence level of the interval.
+    random_state (int): Seed of the sample.
+
+    Returns:
+    dict: "silhouette", "ci_low", "ci_high" (equal to the silhouette when exact) and "sample_size", or None values if
+    the clustering has fewer than 2 clusters or as many clusters as points.
+    """
+    labels = np.asarray(labels)
+    n_labels = len(np.unique(labels))
+    if n_labels < 2 or n_labels >= len(labels):
+        return {"silhouette": None, "ci_low": None, "ci_high": None, "sample_size": 0}
+
+    if not sample_size or sample_size >= len(labels):
+        value = float(silhouette_values(data, labels, memory_bytes=memory_bytes).mean())
+        return {"silhouette": value, "ci_low": value, "ci_high": value, "sample_size": len(labels)}
+
+    strata = stratified_sample(labels, sample_size, random_state)
+    rows = np.concatenate([members for members, _ in strata])
+    values = silhouette_values(data, labels, rows, memory_bytes)
+
+    mean, variance, start = 0.0, 0.0, 0
+    for members, population in strata:
+        stratum = values[start:start + len(members)]
+        start += len(members)
+        weight = population / len(labels)
+        mean += weight * stratum.mean()
+        if len(stratum) > 1:
+            variance += weight ** 2 * stratum.var(ddof=1) / len(stratum) * (1 - len(stratum) / population)
+    half_width = norm.ppf(0.5 + confidence / 2) * np.sqrt(variance)
+    return {"silhouette": float(mean), "ci_low": float(mean - half_width), "ci_high": float(mean + half_width),
+            "sample_size": len(rows)}
+
+
+def evaluate_clustering(data, labels, sample_size=None, memory_bytes=DEFAULT_MEMORY_BYTES, random_state=0):
+    """
+    Cluster quality metrics of a clustering: silhouette (see silhouette), Calinski-Harabasz and Davies-Bouldin. The
+    last two only need the cluster centroids, so their memory grows linearly with the number of points.
+
+    Returns:
+    dict: "silhouette", "silhouette_ci_low", "silhouette_ci_high", "silhouette_sample_size", "calinski_harabasz" and
+    "davies_bouldin" (None for fewer than 2 clusters).
+    """
+    scores = silhouette(data, labels, sample_size, memory_bytes, random_state=random_state)
+    metrics = {"silhouette": scores["silhouette"], "silhouette_ci_low": scores["ci_low"],
+               "silhouette_ci_high": scores["ci_high"], "silhouette_sample_size": scores["sample_size"],
+               "calinski_harabasz": None, "davies_bouldin": None}
+    if scores["silhouette"] is not None:
+        metrics["calinski_harabasz"] = float(calinski_harabasz_score(data, labels))
+        metrics["davies_bouldin"] = float(davies_bouldin_score(data, labels))
+    return metrics
+
+
+def compare_clusterings(labelings):
+    """
+    Adjusted Rand Index of every pair of clusterings (computed from their contingency table, linear in memory).
+
+    Parameters:
+    labelings (dict): Labels of each clustering, by name.
+
+    Returns:
+    dict: ARI by (name, name) pair.
+    """
+    return {(first, second): float(adjusted_rand_score(labelings[first], labelings[second]))
+            for first, second in combinations(labelings, 2)}
+
+
+# Formats a silhouette with its confidence interval for the log
+def format_silhouette(metrics):
+    if metrics["silhouette"] is None:
+        return "n/a"
+    if metrics["silhouette_ci_low"] == metrics["silhouette_ci_high"]:
+        return f"{metrics['silhouette']:.4f}"
+    return (f"{metrics['silhouette']:.4f} (95% CI {metrics['silhouette_ci_low']:.4f} to "
+            f"{metrics['silhouette_ci_high']:.4f}, {metrics['silhouette_sample_size']} sampled)")
@@ -1,49 +1,81 @@
-import arcpy
-from collections import Counter
+import numpy as np
+from scipy import sparse
+import backends
+from adjacency_index import load_adjacency_index
 
-def classify_remaining_polygons(polygon_layer, cluster_field, temp_layer):
-    """
-    Classifies remaining polygons with null cluster information based on adjacent polygons' cluster values.
 
-    Parameters:
-    polygon_layer (str): Path to the polygon layer.
-    cluster_field (str): Name of the cluster field.
-    temp_layer (str): Path to the temporary layer.
+def majority_vote_fill(indptr, indices, codes):
     """
-    # Creates a temporary layer to store the selected features
-    arcpy.MakeFeatureLayer_management(polygon_layer, temp_layer)
-
-    # Select polygons with NULL clustering results
-    query = "{} IS NULL".format(cluster_field)
-    arcpy.SelectLayerByAttribute_management(temp_layer, "NEW_SELECTION", query)
+    Fills the unclassified polygons with the most common class of their classified neighbours, as a sparse
+    matrix-vector vote over the whole adjacency graph, repeated until no polygon changes (fixed point), so NULL
+    polygons surrounded by other NULL polygons are filled from the outside in. Ties go to the smallest class code.
 
-    # Get an OID list for polygons clustered at NULL
-    null_polygons = [row[0] for row in arcpy.da.SearchCursor(temp_layer, "OID@")]
+    Parameters:
+    indptr (ndarray): CSR row pointers of the adjacency graph.
+    indices (ndarray): CSR neighbour indices of the adjacency graph.
+    codes (ndarray): Class code (0 to k - 1) of each polygon, -1 for the unclassified ones.
 
-    # For each polygon clustered at NULL
-    for oid in null_polygons:
-        # Select the current polygon
-        arcpy.SelectLayerByAttribute_management(temp_layer, "NEW_SELECTION", "OBJECTID = {}".format(oid))
+    Returns:
+    ndarray: Class codes after the fill (-1 for the polygons with no classified polygon in their connected component).
+    """
+    codes = np.array(codes, dtype=np.int64)
+    n_polygons, n_classes = len(codes), int(codes.max()) + 1 if len(codes) else 0
+    adjacency = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(n_polygons, n_polygons))
+    rounds = 0
+    while n_classes > 0:
+        unclassified = np.flatnonzero(codes < 0)
+        classified = np.flatnonzero(codes >= 0)
+        # One column per class, with a 1 for each classified polygon
+        membership = sparse.csr_matrix((np.ones(len(classified)), (classified, codes[classified])),
+                                       shape=(n_polygons, n_classes))
+        votes = (adjacency[unclassified] @ membership).toarray()
+        voted = votes.max(axis=1) > 0
+        if not voted.any():
+            break
+        # All the polygons of a round vote from the classes of the previous round
+        codes[unclassified[voted]] = votes[voted].argmax(axis=1)
+        rounds += 1
+    print(f"Majority vote converged after {rounds} round(s).")
+    return codes
 
-        # Select the polygons that adjacent to the current polygon
-        arcpy.SelectLayerByLocation_management(temp_layer, "INTERSECT", temp_layer, selection_type="NEW_SELECTION")
 
-        # Get a list of clustering results for adjacent polygons
-        adjacent_clusters = [row[0] for row in arcpy.da.SearchCursor(temp_layer, cluster_field) if row[0] is not None]
+def classify_remaining_polygons(polygon_layer, cluster_field, backend=None, adjacency_index=None):
+    """
+    Classifies remaining polygons with null cluster information based on adjacent polygons' cluster values.
 
-        # If the adjacent_clusters list is empty, slip the current iteration
-        if not adjacent_clusters:
-            continue
+    The adjacency graph of the layer is built once (CSR arrays from one spatial index pass), the NULL polygons are
+    filled by majority_vote_fill and the new values are written back in one bulk update, instead of a selection
+    and an update cursor per NULL polygon.
 
-        # Determine the most common clustering results
-        most_common_cluster = Counter(adjacent_clusters).most_common(1)[0][0]
+    Parameters:
+    polygon_layer (str): Path to the polygon layer.
+    cluster_field (str): Name of the cluster field.
+    backend (str or backends.Backend): Backend used to read and update the layer (arcpy if None).
+    adjacency_index (str): Directory of the persisted adjacency index of the layer (see adjacency_index.py), reused
+                           while the polygon geometries are unchanged (None builds the graph in memory).
+    """
+    backend = backends.get_backend(backend if backend is not None else "arcpy")
+    if adjacency_index:
+        index = load_adjacency_index(backend, polygon_layer, "OID@", adjacency_index)
+        ids, indptr, indices = index.ids, index.indptr, index.indices
+    else:
+        ids, indptr, indices = backend.adjacency_graph(polygon_layer, "OID@")
+    columns = backend.read_table(polygon_layer, ["OID@", cluster_field])
+    clusters = dict(zip(columns["OID@"].tolist(), columns[cluster_field].tolist()))
 
-        # Update the clustering results for the current polygons clustered at NULL
-        with arcpy.da.UpdateCursor(temp_layer, cluster_field, "OBJECTID = {}".format(oid)) as cursor:
-            for row in cursor:
-                row[0] = most_common_cluster
-                cursor.updateRow(row)
+    # Encode the cluster values of the polygons (in graph order) as class codes, -1 for NULL
+    values = [clusters.get(feature_id) for feature_id in ids.tolist()]
+    missing = np.array([value is None or value != value for value in values], dtype=bool)
+    classes, codes = np.unique(np.array([value for value, null in zip(values, missing) if not null]),
+                               return_inverse=True)
+    all_codes = np.full(len(ids), -1, dtype=np.int64)
+    all_codes[~missing] = codes
+    all_codes = majority_vote_fill(indptr, indices, all_codes)
 
+    filled = np.flatnonzero(missing & (all_codes >= 0))
+    backend.update_field(polygon_layer, "OID@", cluster_field,
+                         dict(zip(ids[filled].tolist(), classes[all_codes[filled]].tolist())))
+    print(f"{len(filled)} of {int(missing.sum())} NULL polygon(s) classified.")
     print("Process completed!")
 
 
@@ -53,5 +85,6 @@ if __name__ == '__main__':
     classify_remaining_polygons(
         polygon_layer=config.polygon_layer,
         cluster_field=config.cluster_field,
-        temp_layer=config.temp_layer
+        backend=config.backend,
+        adjacency_index=config.adjacency_index
     )
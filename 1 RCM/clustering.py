@@ -1,19 +1,229 @@
+import json
+import os
+from contextlib import nullcontext
+from multiprocessing import Pool
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import seaborn as sns
+from matplotlib.figure import Figure
+from scipy.optimize import linear_sum_assignment
+from threadpoolctl import threadpool_limits
 from sklearn.cluster import KMeans, AgglomerativeClustering, DBSCAN
 from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import silhouette_score, adjusted_rand_score
 from sklearn.decomposition import PCA
+import cluster_metrics
 
-def cluster_polygons(input_csv, output_csv):
+# Data of the current worker process, set once by init_worker
+worker_data = None
+
+# Thread pool limiter of the current worker process, set once by init_worker; keep it referenced for the life of the
+# worker, as it holds the single-thread limits and the original limits to restore
+worker_limits = None
+
+# Stores the standardized data in a worker process and keeps K-Means single-threaded there, as the restarts are already
+# spread over the processes
+def init_worker(data):
+    global worker_data, worker_limits
+    worker_data = data
+    worker_limits = threadpool_limits(1)
+
+# Runs one K-Means restart and returns its labels and inertia
+def kmeans_restart(data, n_clusters, seed):
+    kmeans = KMeans(n_clusters=n_clusters, random_state=seed).fit(data)
+    return kmeans.labels_, kmeans.inertia_
+
+# Runs one K-Means restart on the data of the worker process
+def kmeans_restart_task(task):
+    return kmeans_restart(worker_data, *task)
+
+def align_labels(labels, reference, n_clusters):
+    """
+    Relabels a clustering so that its clusters match those of a reference clustering, by maximizing the number of
+    points with the same label (Hungarian matching of the contingency table).
+
+    Parameters:
+    labels (ndarray): Labels to align, in [0, n_clusters).
+    reference (ndarray): Reference labels, in [0, n_clusters).
+    n_clusters (int): Number of clusters.
+
+    Returns:
+    ndarray: The aligned labels.
+    """
+    contingency = np.zeros((n_clusters, n_clusters), dtype=np.int64)
+    np.add.at(contingency, (labels, reference), 1)
+    rows, columns = linear_sum_assignment(contingency, maximize=True)
+    mapping = np.empty(n_clusters, dtype=labels.dtype)
+    mapping[rows] = columns
+    return mapping[labels]
+
+def consensus_kmeans(data, n_clusters, iterations=100, workers=1):
+    """
+    Consensus of K-Means restarts with the seeds 0 to iterations - 1. The labels of each restart are aligned to those
+    of the restart with the lowest inertia, so a cluster keeps its label across restarts, and the votes of every
+    polygon are counted in one bincount.
+
+    Parameters:
+    data (ndarray): Standardized data, one row per polygon.
+    n_clusters (int): Number of clusters.
+    iterations (int): Number of K-Means restarts.
+    workers (int): Number of worker processes running the restarts (1 runs them in this process).
+
+    Returns:
+    tuple: (labels, stability, votes), the consensus label of each polygon, the share of restarts that agree with it
+    and the (polygons, n_clusters) vote counts.
+    """
+    tasks = [(n_clusters, seed) for seed in range(iterations)]
+    if workers > 1:
+        with Pool(workers, initializer=init_worker, initargs=(data,)) as pool:
+            restarts = pool.map(kmeans_restart_task, tasks)
+    else:
+        restarts = [kmeans_restart(data, *task) for task in tasks]
+
+    reference = min(restarts, key=lambda restart: restart[1])[0]
+    aligned = np.stack([align_labels(labels, reference, n_clusters) for labels, _ in restarts])
+
+    # Count the votes of every (polygon, cluster) pair at once
+    polygons = np.arange(len(data))
+    votes = np.bincount((polygons * n_clusters + aligned).ravel(), minlength=len(data) * n_clusters)
+    votes = votes.reshape(len(data), n_clusters)
+    labels = votes.argmax(axis=1)
+    stability = votes[polygons, labels] / iterations
+    return labels, stability, votes
+
+# Fits and scores one candidate of the model selection sweep (see cluster_metrics.evaluate_clustering)
+def score_candidate(data, method, params, silhouette_sample, memory_bytes):
+    if method == "kmeans":
+        model = KMeans(n_clusters=params["k"], random_state=0).fit(data)
+        labels, extra = model.labels_, {"inertia": float(model.inertia_)}
+    else:
+        labels = DBSCAN(eps=params["eps"], min_samples=params["min_samples"]).fit_predict(data)
+        extra = {"clusters": int(len(np.unique(labels[labels >= 0]))), "noise": float(np.mean(labels < 0))}
+    scores = cluster_metrics.evaluate_clustering(data, labels, silhouette_sample, memory_bytes)
+    return {"method": method, **params, **extra, **scores}
+
+# Scores one candidate on the data of the worker process
+def score_candidate_task(task):
+    return score_candidate(worker_data, *task)
+
+def knee_point(x, y):
+    """
+    Kneedle rule for a decreasing convex curve such as the K-Means inertia: x and y are scaled to [0, 1] and the knee
+    is the point farthest above the line joining the ends of the flipped curve.
+
+    Parameters:
+    x (array-like): Increasing x values (e.g. the number of clusters).
+    y (array-like): Decreasing y values (e.g. the inertia).
+
+    Returns:
+    x value at the knee (the first x if the curve is flat).
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if len(x) < 3 or np.ptp(y) == 0:
+        return x[0].item()
+    x_scaled = (x - x.min()) / np.ptp(x)
+    y_scaled = (y.max() - y) / np.ptp(y)
+    return x[np.argmax(y_scaled - x_scaled)].item()
+
+def select_model(data, k_values=range(1, 11), dbscan_eps=(0.5,), dbscan_min_samples=(5,), workers=1,
+                 silhouette_sample=10000, report_prefix=None, memory_bytes=cluster_metrics.DEFAULT_MEMORY_BYTES):
+    """
+    Headless model selection: sweeps the number of K-Means clusters and the DBSCAN parameters in a worker pool,
+    scores every candidate (inertia, sampled silhouette, Calinski-Harabasz, Davies-Bouldin) and chooses k at the knee
+    of the inertia curve, and the DBSCAN parameters with the best silhouette.
+
+    Parameters:
+    data (ndarray): Standardized data, one row per polygon.
+    k_values (iterable): Numbers of K-Means clusters to try.
+    dbscan_eps (iterable): DBSCAN eps values to try.
+    dbscan_min_samples (iterable): DBSCAN min_samples values to try.
+    workers (int): Number of worker processes (1 runs the sweep in this process).
+    silhouette_sample (int): Number of polygons sampled for the silhouette (None computes it exactly).
+    report_prefix (str): Optional path prefix of the report, written as <prefix>.json and <prefix>.png.
+    memory_bytes (int): Memory budget of the pairwise distance blocks of the silhouette, per process.
+
+    Returns:
+    dict: The report, with the scores of every candidate ("kmeans", "dbscan"), the chosen "k" and "dbscan" parameters.
+    """
+    tasks = [("kmeans", {"k": int(k)}, silhouette_sample, memory_bytes) for k in k_values if k <= len(data)]
+    tasks += [("dbscan", {"eps": float(eps), "min_samples": int(min_samples)}, silhouette_sample, memory_bytes)
+              for eps in dbscan_eps for min_samples in dbscan_min_samples]
+    with Pool(workers, initializer=init_worker, initargs=(data,)) if workers > 1 else nullcontext() as pool:
+        scores = pool.map(score_candidate_task, tasks) if pool else [score_candidate(data, *task) for task in tasks]
+
+    kmeans_scores = [score for score in scores if score["method"] == "kmeans"]
+    dbscan_scores = [score for score in scores if score["method"] == "dbscan"]
+    k = knee_point([score["k"] for score in kmeans_scores], [score["inertia"] for score in kmeans_scores])
+    # The knee can fall on k = 1 for a flat curve; at least 2 clusters are kept
+    k = max(int(k), 2) if len(data) > 1 else 1
+    # DBSCAN candidates finding fewer than 2 clusters have no silhouette and are only kept if no other is left
+    best_dbscan, best_silhouette = None, -np.inf
+    for score in dbscan_scores:
+        silhouette = -np.inf if score["silhouette"] is None else score["silhouette"]
+        if best_dbscan is None or silhouette > best_silhouette:
+            best_dbscan, best_silhouette = score, silhouette
+    report = {
+        "k": k,
+        "dbscan": {"eps": best_dbscan["eps"], "min_samples": best_dbscan["min_samples"]} if best_dbscan else None,
+        "kmeans_scores": kmeans_scores,
+        "dbscan_scores": dbscan_scores,
+        "silhouette_sample": silhouette_sample,
+    }
+    print(f"Model selection: k = {k} (knee of the inertia), DBSCAN {report['dbscan']}")
+
+    if report_prefix:
+        with open(f"{report_prefix}.json", "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        plot_model_selection(report, f"{report_prefix}.png")
+        print(f"Model selection report saved to '{report_prefix}.json' and '{report_prefix}.png'.")
+    return report
+
+# Plots the K-Means scores of the model selection sweep, with the chosen k
+def plot_model_selection(report, output_png):
+    scores = pd.DataFrame(report["kmeans_scores"]).astype({"silhouette": float, "calinski_harabasz": float,
+                                                           "davies_bouldin": float})
+    figure = Figure(figsize=(12, 8))
+    axes = figure.subplots(2, 2).ravel()
+    for ax, column, title in zip(axes, ["inertia", "silhouette", "calinski_harabasz", "davies_bouldin"],
+                                 ["Elbow Method (inertia)", "Silhouette (sampled)", "Calinski-Harabasz",
+                                  "Davies-Bouldin"]):
+        ax.plot(scores["k"], scores[column], marker='o')
+        ax.axvline(report["k"], color='r', linestyle='--')
+        ax.set_title(title)
+        ax.set_xlabel('Number of clusters')
+    figure.tight_layout()
+    figure.savefig(output_png)
+
+# Saves a scatter plot of the polygons on the first two principal components, colored by cluster
+def save_pca_plot(df_pca, labels, title, palette, output_png):
+    figure = Figure(figsize=(10, 6))
+    ax = figure.subplots()
+    sns.scatterplot(data=df_pca.assign(Cluster=labels), x='PC1', y='PC2', hue='Cluster', palette=palette,
+                    legend='full', ax=ax)
+    ax.set_title(title)
+    figure.savefig(output_png)
+
+def cluster_polygons(input_csv, output_csv, iterations=100, workers=1, n_clusters=None, k_values=range(1, 11),
+                     dbscan_eps=(0.5,), dbscan_min_samples=(5,), silhouette_sample=10000,
+                     memory_bytes=cluster_metrics.DEFAULT_MEMORY_BYTES):
     """
     Clusters polygons based on average curve parameters using different clustering algorithms.
 
     Parameters:
     input_csv (str): Path to the input CSV file containing average curve parameters.
     output_csv (str): Path to save the clustered results CSV file.
+    iterations (int): Number of K-Means restarts of the consensus clustering.
+    workers (int): Number of worker processes running the model selection sweep and the K-Means restarts.
+    n_clusters (int): Number of K-Means clusters, or None to choose it at the knee of the inertia curve.
+    k_values (iterable): Numbers of clusters tried by the model selection.
+    dbscan_eps (iterable): DBSCAN eps values tried by the model selection (the best silhouette is used).
+    dbscan_min_samples (iterable): DBSCAN min_samples values tried by the model selection.
+    silhouette_sample (int): Number of polygons sampled (stratified by cluster) for the silhouette scores, or None
+                             for the exact silhouette.
+    memory_bytes (int): Memory budget of the pairwise distance blocks of the silhouette, per process.
+
+    The model selection report (<output>_model_selection.json/.png), the cluster quality metrics
+    (<output>_metrics.json) and the PCA plots (<output>_pca_<method>.png) are saved next to output_csv instead of
+    being shown, so the clustering can run unattended.
     """
     # Load the dataset
     df = pd.read_csv(input_csv)
@@ -26,46 +236,20 @@ def cluster_polygons(input_csv, output_csv):
     scaler = StandardScaler()
     df_standardized = scaler.fit_transform(df_for_clustering)
 
-    # Determine the optimal number of clusters using the Elbow Method
-    inertia = []
-    for i in range(1, 11):
-        kmeans = KMeans(n_clusters=i, random_state=0)
-        kmeans.fit(df_standardized)
-        inertia.append(kmeans.inertia_)
-
-    # Plot the Elbow Method result
-    plt.figure(figsize=(10, 6))
-    plt.plot(range(1, 11), inertia, marker='o')
-    plt.title('Elbow Method')
-    plt.xlabel('Number of clusters')
-    plt.ylabel('Inertia')
-    plt.show()
+    # Determine the optimal number of clusters using the Elbow Method, and the DBSCAN parameters
+    output_prefix = os.path.splitext(output_csv)[0]
+    report = select_model(df_standardized, k_values, dbscan_eps, dbscan_min_samples, workers, silhouette_sample,
+                          report_prefix=f"{output_prefix}_model_selection", memory_bytes=memory_bytes)
 
     # Apply K-Means clustering with the chosen number of clusters
-    optimal_clusters = 2  # Update this based on the Elbow Method result
-
-    # Number of iterations for K-Means
-    iterations = 100
+    optimal_clusters = n_clusters or report["k"]
 
-    # Create a matrix to store the results of each iteration
-    cluster_matrix = np.zeros((len(df_standardized), optimal_clusters))
-
-    # Repeat K-Means clustering and store the results
-    for i in range(iterations):
-        kmeans = KMeans(n_clusters=optimal_clusters, random_state=i)
-        kmeans.fit(df_standardized)
-        labels = kmeans.labels_
-
-        # Increment the cluster count in the matrix
-        for j in range(len(labels)):
-            cluster_matrix[j, labels[j]] += 1
-
-    # Calculate the average cluster assignment
-    average_cluster = np.round(cluster_matrix / iterations)
-
-    # Assign the final cluster label
-    final_clusters = np.argmax(average_cluster, axis=1)
+    # Repeat K-Means clustering and keep the label most restarts agree on, with the share of restarts agreeing
+    final_clusters, stability, _ = consensus_kmeans(df_standardized, optimal_clusters, iterations, workers)
     df['Final_Cluster'] = final_clusters
+    df['Final_Cluster_Stability'] = stability
+    print(f"Consensus K-Means stability: mean {stability.mean():.3f}, "
+          f"{np.count_nonzero(stability < 0.9)} polygons below 0.9")
 
     # Agglomerative Hierarchical Clustering
     agg_clustering = AgglomerativeClustering(n_clusters=optimal_clusters)
@@ -73,49 +257,38 @@ def cluster_polygons(input_csv, output_csv):
     df['Agglomerative_Cluster'] = agg_labels
 
     # DBSCAN Clustering
-    dbscan = DBSCAN(eps=0.5, min_samples=5)
+    dbscan = DBSCAN(**(report["dbscan"] or {"eps": 0.5, "min_samples": 5}))
     dbscan_labels = dbscan.fit_predict(df_standardized)
     df['DBSCAN_Cluster'] = dbscan_labels
 
-    # Evaluate clustering performance using Silhouette Score
-    kmeans_silhouette = silhouette_score(df_standardized, final_clusters)
-    agg_silhouette = silhouette_score(df_standardized, agg_labels)
-    dbscan_silhouette = silhouette_score(df_standardized, dbscan_labels)
-
-    print(
-        f"Silhouette Scores: K-Means: {kmeans_silhouette}, Agglomerative: {agg_silhouette}, DBSCAN: {dbscan_silhouette}")
+    # Evaluate clustering performance using Silhouette Score (sampled or chunked, within the memory budget)
+    labelings = {"K-Means": final_clusters, "Agglomerative": agg_labels, "DBSCAN": dbscan_labels}
+    metrics = {name: cluster_metrics.evaluate_clustering(df_standardized, labels, silhouette_sample, memory_bytes)
+               for name, labels in labelings.items()}
+    print("Silhouette Scores: " + ", ".join(f"{name}: {cluster_metrics.format_silhouette(scores)}"
+                                           for name, scores in metrics.items()))
 
     # Adjusted Rand Index
-    ari_kmeans_agg = adjusted_rand_score(final_clusters, agg_labels)
-    ari_kmeans_dbscan = adjusted_rand_score(final_clusters, dbscan_labels)
+    ari = cluster_metrics.compare_clusterings(labelings)
+    print(f"Adjusted Rand Index: K-Means vs Agglomerative: {ari[('K-Means', 'Agglomerative')]}, "
+          f"K-Means vs DBSCAN: {ari[('K-Means', 'DBSCAN')]}")
 
-    print(f"Adjusted Rand Index: K-Means vs Agglomerative: {ari_kmeans_agg}, K-Means vs DBSCAN: {ari_kmeans_dbscan}")
+    with open(f"{output_prefix}_metrics.json", "w") as metrics_file:
+        json.dump({"metrics": metrics, "adjusted_rand_index": {f"{first} vs {second}": value
+                                                               for (first, second), value in ari.items()}},
+                  metrics_file, indent=2)
 
     # PCA for Visualization
     pca = PCA(n_components=2)
     df_pca = pca.fit_transform(df_standardized)
     df_pca = pd.DataFrame(df_pca, columns=['PC1', 'PC2'])
 
-    # Visualize K-Means Clustering
-    df_pca['Cluster'] = df['Final_Cluster']
-    plt.figure(figsize=(10, 6))
-    sns.scatterplot(data=df_pca, x='PC1', y='PC2', hue='Cluster', palette='Set1', legend='full')
-    plt.title('PCA - K-Means Clustering')
-    plt.show()
-
-    # Visualize Agglomerative Clustering
-    df_pca['Cluster'] = df['Agglomerative_Cluster']
-    plt.figure(figsize=(10, 6))
-    sns.scatterplot(data=df_pca, x='PC1', y='PC2', hue='Cluster', palette='Set2', legend='full')
-    plt.title('PCA - Agglomerative Clustering')
-    plt.show()
-
-    # Visualize DBSCAN Clustering
-    df_pca['Cluster'] = df['DBSCAN_Cluster']
-    plt.figure(figsize=(10, 6))
-    sns.scatterplot(data=df_pca, x='PC1', y='PC2', hue='Cluster', palette='Set3', legend='full')
-    plt.title('PCA - DBSCAN Clustering')
-    plt.show()
+    # Visualize the clusterings
+    for column, title, palette, name in [('Final_Cluster', 'PCA - K-Means Clustering', 'Set1', 'kmeans'),
+                                         ('Agglomerative_Cluster', 'PCA - Agglomerative Clustering', 'Set2',
+                                          'agglomerative'),
+                                         ('DBSCAN_Cluster', 'PCA - DBSCAN Clustering', 'Set3', 'dbscan')]:
+        save_pca_plot(df_pca, df[column].values, title, palette, f"{output_prefix}_pca_{name}.png")
 
     # Save the clustered DataFrame to a CSV file
     df.to_csv(output_csv, index=False)
@@ -127,5 +300,13 @@ if __name__ == '__main__':
 
     cluster_polygons(
         input_csv=config.input_grouped_skipna_csv,
-        output_csv=config.output_clustered_csv
+        output_csv=config.output_clustered_csv,
+        iterations=config.consensus_iterations,
+        workers=config.clustering_workers,
+        n_clusters=config.cluster_n_clusters,
+        k_values=config.cluster_k_values,
+        dbscan_eps=config.dbscan_eps_values,
+        dbscan_min_samples=config.dbscan_min_samples_values,
+        silhouette_sample=config.silhouette_sample_size,
+        memory_bytes=config.cluster_memory_bytes
     )
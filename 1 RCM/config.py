@@ -1,6 +1,20 @@
 # Configuration file with all configurable variables (files and their absolute path, editable)
 import os
 
+# Raster/vector backend (see backends.py): None runs the ArcGIS geoprocessing tools (ArcpyBackend for the cross-section
+# generation and raster extraction), "arcpy" runs the in-process workflow on geodatabases, "opensource" runs it on GeoTIFF rasters and GeoPackage layers without arcpy.
+# With a backend, feature classes are given as full paths ("<file>.gdb/<name>" or "<file>.gpkg/<name>").
+backend = None
+
+# Manifest of the stage runner of main.py: stages (and polygons of the cross-section generation) whose parameters,
+# input contents and code are unchanged since their last run are skipped (None reruns every stage)
+stage_manifest = r"D:/Cross_sections/pipeline_manifest.json"
+force_stages = []  # Names of stages rerun even when up to date, e.g. ["clustering"]
+
+# Raster tile cache shared by the mask extraction and point sampling (see raster_cache.py)
+raster_tile_size = 512  # Tile edge in cells
+raster_cache_bytes = 512 * 2 ** 20  # Memory budget for decoded tiles (bytes)
+
 # Define paths and parameters for CrossSection_BatchGeneration.py
 workspace = r"D:/sample_workspace.gdb"
 scratch_workspace = r"D:/sample_scratch_workspace.gdb"
@@ -8,6 +22,10 @@ input_raster = r"D:/Sample_NTL"
 feature_class = "sample_polygons"
 output_gdb = r"D:/sample_output01.gdb"
 toolbox_path = r"c:/program files/arcgis/pro/Resources/ArcToolbox/toolboxes/Data Management Tools.tbx"
+boundary_point_distance = 100  # Spacing of the polygon boundary points (meters)
+cross_section_buckets = (90, 180)  # BearingRoundup buckets kept besides the longest line (None keeps every bucket)
+generation_workers = 1  # Worker processes for the per-polygon cross-section generation
+generation_error_report = r"D:/Cross_sections/generation_errors.csv"  # CSV listing the polygons that failed
 
 # Parameters for merging feature classes
 merge_input_gdb = r"D:/sample_output01.gdb"
@@ -25,10 +43,35 @@ workspace_script2 = r"D:/sample_output03.gdb"
 csv_workspace = r"D:/sample_output03.gdb"
 csv_output_folder = r"D:/Cross_sections/batch_CSV"
 csv_desired_fields = ["OBJECTID", "RASTERVALU"]
+# Single columnar store of the cross-section points (see cross_section_store.py), written by
+# CrossSection_BatchExtractRaster.py instead of two point feature classes and one CSV per cross-section, and read by
+# CrossSection_curvefitting.py (None keeps the point feature classes of workspace_script2 and the CSV files of
+# csv_output_folder)
+cross_section_store = r"D:/Cross_sections/cross_section_store"
+write_point_feature_classes = False  # Also write the point feature classes of workspace_script2 with a store
+cross_section_store_batch_rows = 1_000_000  # Points per part of the store
 
 # Define paths and parameters for CrossSection_curvefitting.py
 fit_results_folder = r"D:/Cross_sections/batch_CSV"
 fit_results_csv = os.path.join(fit_results_folder, "fit_results.csv")
+batched_curve_fitting = True  # Fit the cross-sections of a chunk at once (fit_data_batch) instead of file by file
+curve_fitting_workers = 1  # Number of worker processes fitting the chunks (1 runs in the main process)
+curve_fitting_chunk_size = 256  # Number of CSV files per chunk
+fit_results_flush_rows = None  # Write fit_results_csv every N rows (None writes it once at the end)
+
+# Streaming pipeline of main.py (see stream_polygon_averages): the sampled cross-sections are fitted and averaged per
+# polygon in memory, without the point feature classes and CSV files between the stages
+streaming_pipeline = False
+streaming_max_pending = None  # Chunks in flight between the sampling and the fitting workers (2 * curve_fitting_workers if None)
+streaming_keep_fit_results = False  # Also write fit_results_csv (the cross-section store is written if cross_section_store is set)
+
+# Fit plots rendered after the curve fitting (see plot_fits): "none", "every" (every Nth fit), "worst" (K largest
+# residuals) or "all"; the plots are written as contact sheets of plot_panels cross-sections
+plot_policy = "all"
+plot_every = 100
+plot_worst = 50
+plot_workers = 1
+plot_panels = 16
 
 # Define paths and parameters for average_curve_parameters.py
 input_fit_results_csv = fit_results_csv
@@ -38,8 +81,18 @@ output_grouped_skipna_csv = os.path.join(fit_results_folder, "grouped_fit_result
 # Define paths and parameters for clustering.py
 input_grouped_skipna_csv = output_grouped_skipna_csv
 output_clustered_csv = os.path.join(fit_results_folder, "clustered_grouped_fit_results_skipna.csv")
+consensus_iterations = 100  # K-Means restarts of the consensus clustering
+clustering_workers = 1  # Worker processes running the model selection sweep and the K-Means restarts
+cluster_n_clusters = None  # Number of K-Means clusters (None chooses it at the knee of the inertia curve)
+cluster_k_values = list(range(1, 11))  # Numbers of clusters tried by the model selection
+dbscan_eps_values = [0.3, 0.5, 0.8]  # DBSCAN eps values tried (the best silhouette is used)
+dbscan_min_samples_values = [5, 10]  # DBSCAN min_samples values tried
+silhouette_sample_size = 10000  # Polygons sampled (stratified by cluster) for the silhouette scores (None: exact)
+cluster_memory_bytes = 256 * 2 ** 20  # Memory budget of the pairwise distance blocks of the silhouette (bytes)
 
 # Define paths and parameters for cluster_remaining.py (classification of remaining polygons)
 polygon_layer = r"D:/sample_scratch_workspace.gdb/sample_polygons_clustered"
 cluster_field = "Cluster"
-temp_layer = r"D:/sample_scratch_workspace.gdb/temp_layer"
\ No newline at end of file
+# Persisted adjacency index of polygon_layer (see adjacency_index.py), rebuilt only when the polygon geometries change
+# (None builds the adjacency graph on every run)
+adjacency_index = r"D:/Cross_sections/polygon_adjacency"
\ No newline at end of file
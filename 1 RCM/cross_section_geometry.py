@@ -0,0 +1,328 @@
+import numpy as np
+
+# Geometries are plain NumPy arrays: a line or ring is an (n, 2) array of (x, y) vertices and a polygon is a list of
+# rings. Raster windows carry a GDAL-style geotransform (x_origin, cell_width, 0, y_origin, 0, -cell_height).
+
+
+# Convert map coordinates to raster row/column indices
+def world_to_pixel(transform, x, y):
+    x_origin, cell_width, _, y_origin, _, cell_height = transform
+    columns = np.floor((np.asarray(x, dtype=np.float64) - x_origin) / cell_width).astype(np.int64)
+    rows = np.floor((np.asarray(y, dtype=np.float64) - y_origin) / cell_height).astype(np.int64)
+    return rows, columns
+
+# Map coordinates of the centres of every cell in a raster window
+def pixel_centers(transform, shape):
+    x_origin, cell_width, _, y_origin, _, cell_height = transform
+    rows, columns = np.indices(shape)
+    return x_origin + (columns + 0.5) * cell_width, y_origin + (rows + 0.5) * cell_height
+
+# Bounding box (xmin, ymin, xmax, ymax) of a raster cell
+def pixel_box(transform, row, column):
+    x_origin, cell_width, _, y_origin, _, cell_height = transform
+    x_edges = (x_origin + column * cell_width, x_origin + (column + 1) * cell_width)
+    y_edges = (y_origin + row * cell_height, y_origin + (row + 1) * cell_height)
+    return min(x_edges), min(y_edges), max(x_edges), max(y_edges)
+
+# Bounding box (xmin, ymin, xmax, ymax) of a polygon or a list of lines
+def bounds(rings):
+    vertices = np.concatenate([np.asarray(ring, dtype=np.float64) for ring in rings])
+    return vertices[:, 0].min(), vertices[:, 1].min(), vertices[:, 0].max(), vertices[:, 1].max()
+
+# Test which points fall inside a polygon (even-odd rule over all rings, so holes are excluded)
+def points_in_polygon(x, y, rings):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    inside = np.zeros(x.shape, dtype=bool)
+
+    for ring in rings:
+        ring = np.asarray(ring, dtype=np.float64)
+        for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+            if y1 == y2:
+                continue
+            crosses = (y1 > y) != (y2 > y)
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= crosses & (x < x_cross)
+
+    return inside
+
+# Generate points every `distance` map units along a line, starting at its first vertex
+def points_along_line(coords, distance, closed=False):
+    """
+    Counterpart of GeneratePointsAlongLines with Point_Placement="DISTANCE".
+
+    Parameters:
+    coords (array-like): (n, 2) vertices of the line.
+    distance (float): Spacing between the points, in map units.
+    closed (bool): True for polygon rings, where the end point repeats the start point and is not emitted again.
+
+    Returns:
+    numpy.ndarray: (m, 2) array of points.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    segment_lengths = np.hypot(*np.diff(coords, axis=0).T)
+    cumulative = np.concatenate([[0.0], np.cumsum(segment_lengths)])
+    length = cumulative[-1]
+
+    count = int(np.floor(length / distance + 1e-9)) + 1
+    stations = np.arange(count) * distance
+    if closed and count > 1 and np.isclose(stations[-1], length):
+        stations = stations[:-1]
+
+    x = np.interp(stations, cumulative, coords[:, 0])
+    y = np.interp(stations, cumulative, coords[:, 1])
+    return np.column_stack([x, y])
+
+# Generate points every `distance` map units along many lines at once
+def points_along_lines(lines, distance):
+    """
+    Vectorized points_along_line for open lines: the segments of all lines are laid end to end and every station is
+    located with one searchsorted, instead of a loop over the lines.
+
+    Parameters:
+    lines (list): Lines as (n, 2) vertex arrays.
+    distance (float): Spacing between the points, in map units.
+
+    Returns:
+    tuple: (points, line_index, point_index), an (m, 2) array of points, the index of the line of each point and
+    the 1-based position of each point along its line.
+    """
+    vertex_counts = np.array([len(line) for line in lines], dtype=np.int64)
+    vertices = np.concatenate([np.asarray(line, dtype=np.float64) for line in lines])
+
+    # Segments of all lines, dropping the ones that would join the end of a line to the start of the next
+    last_vertex = np.cumsum(vertex_counts) - 1
+    segment_starts = np.setdiff1d(np.arange(len(vertices) - 1), last_vertex)
+    segment_line = np.repeat(np.arange(len(lines)), vertex_counts - 1)
+    segment_lengths = np.hypot(*(vertices[segment_starts + 1] - vertices[segment_starts]).T)
+    segment_ends_along = np.cumsum(segment_lengths)
+
+    line_lengths = np.bincount(segment_line, weights=segment_lengths, minlength=len(lines))
+    line_offsets = np.concatenate([[0.0], np.cumsum(line_lengths)[:-1]])
+    first_segment = np.concatenate([[0], np.cumsum(vertex_counts - 1)[:-1]])
+    last_segment = first_segment + vertex_counts - 2
+
+    # Stations k * distance along each line, in the coordinate of the laid-out segments
+    point_counts = np.floor(line_lengths / distance + 1e-9).astype(np.int64) + 1
+    line_index = np.repeat(np.arange(len(lines)), point_counts)
+    point_index = np.arange(point_counts.sum()) - np.repeat(np.cumsum(point_counts) - point_counts, point_counts)
+    stations = line_offsets[line_index] + point_index * distance
+
+    segment = np.searchsorted(segment_ends_along, stations, side='left')
+    segment = np.clip(segment, first_segment[line_index], last_segment[line_index])
+    along = stations - (segment_ends_along[segment] - segment_lengths[segment])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(segment_lengths[segment] > 0, along / segment_lengths[segment], 0.0)
+    ratio = np.clip(ratio, 0.0, 1.0)[:, None]
+
+    start = vertices[segment_starts[segment]]
+    end = vertices[segment_starts[segment] + 1]
+    return start + ratio * (end - start), line_index, point_index + 1
+
+# Boundary points of a polygon, as PolygonToLine followed by GeneratePointsAlongLines
+def boundary_points(rings, distance):
+    return np.concatenate([points_along_line(ring, distance, closed=True) for ring in rings])
+
+# Observer/target index pairs connecting every boundary point to every other point, as ConstructSightLines does with
+# the same observers and targets
+def sight_lines(points):
+    return np.nonzero(~np.eye(len(points), dtype=bool))
+
+# Number of delta buckets of candidate_sight_line_pairs: bucket k holds the targets with delta in (pi / 2^(k + 1),
+# pi / 2^k], the last one every smaller delta
+DELTA_BUCKETS = 16
+
+# Observer/target index pairs whose sight line can pass through at least one of the boxes
+def candidate_sight_line_pairs(points, boxes):
+    """
+    Prune the all-pairs sight lines with an angular sort around the boxes. Every box lies within the circle of
+    radius r around the centre c of their common bounding box, so a line from P_i to P_j can only cross a box if
+    the angle of P_j around c is within delta_i + delta_j of the angle opposite P_i, where delta = asin(r / |P - c|)
+    (pi for points inside the circle).
+
+    The targets are bucketed by delta, halving from one bucket to the next, and sorted by angle within each bucket.
+    For each observer and bucket, the window of half width delta_i + (largest delta of the bucket) is found by binary
+    search, and the pairs of the window are then filtered with the exact delta_i + delta_j bound. A few points close
+    to the boxes therefore only widen the windows into their own bucket, and the work stays O(n log n) plus the
+    number of candidates.
+
+    Parameters:
+    points (numpy.ndarray): (n, 2) boundary points.
+    boxes (list): (xmin, ymin, xmax, ymax) boxes, e.g. the maximum NTL pixels.
+
+    Returns:
+    tuple: (observers, targets) index arrays in the same order as sight_lines, a superset of the pairs whose line
+    crosses a box.
+    """
+    count = len(points)
+    boxes = np.asarray(boxes, dtype=np.float64)
+    xmin, ymin = boxes[:, 0].min(), boxes[:, 1].min()
+    xmax, ymax = boxes[:, 2].max(), boxes[:, 3].max()
+    center = np.array([(xmin + xmax) / 2, (ymin + ymax) / 2])
+    radius = np.hypot(xmax - xmin, ymax - ymin) / 2
+
+    offsets = points - center
+    distances = np.hypot(offsets[:, 0], offsets[:, 1])
+    angles = np.arctan2(offsets[:, 1], offsets[:, 0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deltas = np.where(distances > radius, np.arcsin(np.clip(radius / distances, 0, 1)), np.pi)
+    with np.errstate(divide='ignore'):
+        delta_buckets = np.clip(np.floor(-np.log2(deltas / np.pi)), 0, DELTA_BUCKETS - 1).astype(np.int64)
+    opposite = angles + np.pi
+
+    all_observers, all_targets = [], []
+    for bucket in np.unique(delta_buckets):
+        members = np.flatnonzero(delta_buckets == bucket)
+        half_widths = deltas + deltas[members].max() + 1e-9
+
+        # Angles of the bucket sorted and repeated over three turns, so every window is a contiguous slice
+        order = members[np.argsort(angles[members], kind='stable')]
+        sorted_angles = angles[order]
+        extended_angles = np.concatenate([sorted_angles - 2 * np.pi, sorted_angles, sorted_angles + 2 * np.pi])
+        extended_order = np.tile(order, 3)
+
+        starts = np.searchsorted(extended_angles, opposite - half_widths, side='left')
+        stops = np.searchsorted(extended_angles, opposite + half_widths, side='right')
+
+        # Windows of half width pi or more cover every target of the bucket
+        full = half_widths >= np.pi
+        starts[full] = len(members)
+        stops[full] = 2 * len(members)
+
+        sizes = stops - starts
+        observers = np.repeat(np.arange(count), sizes)
+        positions = np.repeat(starts - np.concatenate([[0], np.cumsum(sizes)[:-1]]), sizes) + np.arange(sizes.sum())
+        targets = extended_order[positions]
+
+        # Exact bound of each pair
+        difference = np.abs((angles[targets] - opposite[observers] + np.pi) % (2 * np.pi) - np.pi)
+        keep = (observers != targets) & (difference <= deltas[observers] + deltas[targets] + 1e-9)
+        all_observers.append(observers[keep])
+        all_targets.append(targets[keep])
+
+    observers, targets = np.concatenate(all_observers), np.concatenate(all_targets)
+    pair_order = np.argsort(observers * count + targets, kind='stable')
+    return observers[pair_order], targets[pair_order]
+
+# Test which segments intersect (or touch) an axis-aligned box, using Liang-Barsky clipping
+def segments_intersect_box(starts, ends, box):
+    xmin, ymin, xmax, ymax = box
+    dx = ends[:, 0] - starts[:, 0]
+    dy = ends[:, 1] - starts[:, 1]
+
+    t_enter = np.zeros(len(starts))
+    t_exit = np.ones(len(starts))
+    valid = np.ones(len(starts), dtype=bool)
+
+    for p, q in ((-dx, starts[:, 0] - xmin), (dx, xmax - starts[:, 0]),
+                 (-dy, starts[:, 1] - ymin), (dy, ymax - starts[:, 1])):
+        parallel = p == 0
+        valid &= ~(parallel & (q < 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = q / p
+        t_enter = np.where(~parallel & (p < 0), np.maximum(t_enter, ratio), t_enter)
+        t_exit = np.where(~parallel & (p > 0), np.minimum(t_exit, ratio), t_exit)
+
+    return valid & (t_enter <= t_exit)
+
+# Bearing of each line in degrees clockwise from north (0-360), as CalculateGeometryAttributes LINE_BEARING
+def line_bearings(starts, ends):
+    return np.degrees(np.arctan2(ends[:, 0] - starts[:, 0], ends[:, 1] - starts[:, 1])) % 360
+
+# Round a bearing to its 5 degree bucket, the same rule as the BearingRoundup field calculation
+def roundup(value):
+    return int((value + 4.5) // 5 * 5)
+
+# Vectorized roundup
+def roundup_bearings(bearings):
+    return ((np.asarray(bearings, dtype=np.float64) + 4.5) // 5 * 5).astype(np.int64)
+
+# Select the cross-sections the way the geoprocessing chain does (filter, sort by length and delete identical buckets)
+def select_cross_sections(lengths, buckets, keep_buckets=(90, 180)):
+    """
+    Keep the lines whose BearingRoundup is in keep_buckets (or every bucket if keep_buckets is None) plus the
+    overall longest line, sort them by descending length and keep the first line of each bucket.
+
+    Parameters:
+    lengths (numpy.ndarray): Length of each candidate line.
+    buckets (numpy.ndarray): BearingRoundup of each candidate line.
+    keep_buckets (tuple or None): Buckets to keep besides the longest line.
+
+    Returns:
+    tuple: (indices, ranks), the selected candidate indices in descending length order and their 1-based rank in
+    that order. Ranks are contiguous (unlike the OBJECTIDs left by DeleteIdentical), so NLC_ID * 10000 + rank
+    cannot run into the next polygon's IDs.
+    """
+    if len(lengths) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    selected = lengths == lengths.max()
+    if keep_buckets is None:
+        selected[:] = True
+    else:
+        selected |= np.isin(buckets, keep_buckets)
+
+    candidates = np.nonzero(selected)[0]
+    candidates = candidates[np.argsort(-lengths[candidates], kind='stable')]
+
+    _, first = np.unique(buckets[candidates], return_index=True)
+    selected = candidates[np.sort(first)]
+    return selected, np.arange(1, len(selected) + 1)
+
+# Generate the cross-sections of one polygon in memory, replacing the per-polygon geoprocessing chain
+def generate_cross_sections(rings, values, transform, NLC_ID, distance=100, keep_buckets=(90, 180), prune=True,
+                            stats=None):
+    """
+    Take boundary points every `distance` map units, connect them into sight lines, keep the lines that cross a
+    maximum NTL pixel, bucket them by BearingRoundup and keep the longest line per selected bucket. Nothing is
+    written to disk.
+
+    Parameters:
+    rings (list): Polygon rings as (n, 2) vertex arrays.
+    values (numpy.ndarray): Raster window extracted by the polygon mask (NaN outside the polygon).
+    transform (tuple): Geotransform of the raster window.
+    NLC_ID (int): ID of the polygon.
+    distance (float): Spacing of the boundary points in map units.
+    keep_buckets (tuple or None): BearingRoundup buckets kept besides the longest line (None keeps every bucket).
+    prune (bool): Only evaluate the sight lines from candidate_sight_line_pairs instead of all pairs.
+    stats (collections.Counter): Optional counter incremented with the 'evaluated' and 'pruned' sight lines.
+
+    Returns:
+    tuple: (lines, columns), a (k, 2, 2) array of line end points and a dict with the Bearing, BearingRoundup,
+    Shape_Length and CrosSecID (NLC_ID * 10000 + rank) of each line.
+    """
+    lines = np.empty((0, 2, 2))
+    columns = {"Bearing": np.empty(0), "BearingRoundup": np.empty(0, dtype=np.int64),
+               "Shape_Length": np.empty(0), "CrosSecID": np.empty(0, dtype=np.int64)}
+    if values.size == 0 or not np.isfinite(values).any():
+        return lines, columns
+
+    # Sight lines between the boundary points that cross a maximum NTL pixel
+    points = boundary_points(rings, distance)
+    boxes = [pixel_box(transform, row, column) for row, column in np.argwhere(values == np.nanmax(values))]
+    if prune:
+        observers, targets = candidate_sight_line_pairs(points, boxes)
+    else:
+        observers, targets = sight_lines(points)
+    if stats is not None:
+        stats['evaluated'] += len(observers)
+        stats['pruned'] += len(points) * (len(points) - 1) - len(observers)
+
+    starts, ends = points[observers], points[targets]
+    crosses = np.zeros(len(starts), dtype=bool)
+    for box in boxes:
+        crosses |= segments_intersect_box(starts, ends, box)
+    starts, ends = starts[crosses], ends[crosses]
+    if len(starts) == 0:
+        return lines, columns
+
+    # Longest line of the selected bearing buckets
+    lengths = np.hypot(ends[:, 0] - starts[:, 0], ends[:, 1] - starts[:, 1])
+    bearings = line_bearings(starts, ends)
+    buckets = roundup_bearings(bearings)
+    selected, ranks = select_cross_sections(lengths, buckets, keep_buckets)
+
+    lines = np.stack([starts[selected], ends[selected]], axis=1)
+    columns = {"Bearing": bearings[selected], "BearingRoundup": buckets[selected],
+               "Shape_Length": lengths[selected], "CrosSecID": int(NLC_ID) * 10000 + ranks}
+    return lines, columns
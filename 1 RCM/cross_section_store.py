@@ -0,0 +1,172 @@
+import json
+import os
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is only needed for the Parquet parts; without it the parts are written as .npy columns
+    pa = pq = None
+
+# Manifest of a store directory, listing its format, columns and parts
+MANIFEST = "store.json"
+
+# Columns of the cross-section store: one row per point, keyed by (CrosSecID, OBJECTID)
+STORE_COLUMNS = ["CrosSecID", "OBJECTID", "RASTERVALU", "BuildingFA"]
+COLUMN_TYPES = {"CrosSecID": np.int64, "OBJECTID": np.int64, "RASTERVALU": np.float64, "BuildingFA": np.float64}
+
+# Default number of rows buffered before a part is written
+DEFAULT_BATCH_ROWS = 1_000_000
+
+
+# Check whether a path is a cross-section store directory
+def is_store(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+class CrossSectionStoreWriter:
+    """
+    Writes cross-section points to a store directory in bulk: rows are buffered and written as parts of about
+    batch_rows rows, each sorted by CrosSecID, as Parquet files (pyarrow) or as one memory-mappable .npy file per
+    column. Each write() call must hold complete cross-sections, so a cross-section never spans two parts.
+    """
+
+    def __init__(self, path, batch_rows=DEFAULT_BATCH_ROWS, file_format=None):
+        if file_format is None:
+            file_format = "parquet" if pa is not None else "npy"
+        if file_format == "parquet" and pa is None:
+            raise ImportError("Writing a Parquet cross-section store requires pyarrow.")
+        if file_format not in ("parquet", "npy"):
+            raise ValueError(f"Unknown store format '{file_format}', expected 'parquet' or 'npy'.")
+
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.batch_rows = batch_rows
+        self.file_format = file_format
+        self.buffer = {column: [] for column in STORE_COLUMNS}
+        self.buffered_rows = 0
+        self.parts = []
+        self.rows = 0
+        self.sections = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+
+    def write(self, columns):
+        """Buffer rows given as a dict of arrays (missing columns, e.g. BuildingFA, are filled with NaN)."""
+        rows = len(columns["CrosSecID"])
+        columns = {column: np.asarray(columns[column], dtype=COLUMN_TYPES[column]) if column in columns
+                   else np.full(rows, np.nan) for column in STORE_COLUMNS}
+
+        # Split large inputs between cross-sections, so the parts stay close to batch_rows rows
+        cuts = []
+        if rows > self.batch_rows:
+            ids = columns["CrosSecID"]
+            boundaries = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+            cuts = np.searchsorted(boundaries, np.arange(self.batch_rows, rows, self.batch_rows))
+            cuts = np.unique(boundaries[cuts[cuts < len(boundaries)]])
+
+        for start, stop in zip(np.concatenate([[0], cuts]).astype(int), np.concatenate([cuts, [rows]]).astype(int)):
+            for column, values in columns.items():
+                self.buffer[column].append(values[start:stop])
+            self.buffered_rows += int(stop - start)
+            if self.buffered_rows >= self.batch_rows:
+                self.flush()
+
+    def flush(self):
+        if self.buffered_rows == 0:
+            return
+        columns = {column: np.concatenate(values) for column, values in self.buffer.items()}
+        order = np.argsort(columns["CrosSecID"], kind='stable')
+        columns = {column: values[order] for column, values in columns.items()}
+
+        name = f"part-{len(self.parts):05d}"
+        if self.file_format == "parquet":
+            name += ".parquet"
+            pq.write_table(pa.table(columns), os.path.join(self.path, name))
+        else:
+            os.makedirs(os.path.join(self.path, name), exist_ok=True)
+            for column, values in columns.items():
+                np.save(os.path.join(self.path, name, f"{column}.npy"), values)
+
+        self.parts.append(name)
+        self.rows += self.buffered_rows
+        self.sections += len(np.unique(columns["CrosSecID"]))
+        self.buffer = {column: [] for column in STORE_COLUMNS}
+        self.buffered_rows = 0
+
+    def close(self):
+        self.flush()
+        manifest = {"format": self.file_format, "columns": STORE_COLUMNS, "parts": self.parts, "rows": self.rows,
+                    "sections": self.sections}
+        with open(os.path.join(self.path, MANIFEST), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        print(f"Cross-section store written to '{self.path}': {self.sections} cross-sections, {self.rows} points, "
+              f"{len(self.parts)} part(s).")
+
+
+class CrossSectionStore:
+    """
+    Reads a store written by CrossSectionStoreWriter. Parts are memory-mapped (.npy) or read as Arrow columns, and
+    the cross-sections are returned as views into them, grouped by CrosSecID, without copying.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.path = path
+        self.file_format = manifest["format"]
+        self.columns = manifest["columns"]
+        self.parts = manifest["parts"]
+        self.rows = manifest["rows"]
+        self.sections = manifest["sections"]
+        self.index = None
+
+    def read_part(self, part, columns=None):
+        """Return a dict mapping each column to the NumPy array of one part."""
+        columns = columns or self.columns
+        part_path = os.path.join(self.path, self.parts[part])
+        if self.file_format == "parquet":
+            if pq is None:
+                raise ImportError("Reading a Parquet cross-section store requires pyarrow.")
+            table = pq.read_table(part_path, columns=columns, memory_map=True)
+            return {column: table.column(column).to_numpy() for column in columns}
+        return {column: np.load(os.path.join(part_path, f"{column}.npy"), mmap_mode='r') for column in columns}
+
+    def section_bounds(self, part):
+        """Return (cross-section ids, start rows, stop rows) of the cross-sections of one part."""
+        ids = np.asarray(self.read_part(part, ["CrosSecID"])["CrosSecID"])
+        starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]])) if len(ids) else np.empty(0, int)
+        stops = np.append(starts[1:], len(ids))
+        return ids[starts], starts, stops
+
+    def iter_sections(self, columns=None, part=None, first=0, last=None):
+        """
+        Yield (CrosSecID, dict of column views) for each cross-section, in part and CrosSecID order.
+
+        Parameters:
+        columns (list): Columns to return (all columns if None).
+        part (int): Only read this part (all parts if None).
+        first (int): Index of the first cross-section of the part to return.
+        last (int): Index after the last cross-section of the part to return (the end of the part if None).
+        """
+        for part_index in (range(len(self.parts)) if part is None else [part]):
+            data = self.read_part(part_index, columns)
+            ids, starts, stops = self.section_bounds(part_index)
+            for i in range(first, len(ids) if last is None else min(last, len(ids))):
+                yield int(ids[i]), {column: values[starts[i]:stops[i]] for column, values in data.items()}
+
+    def section(self, cross_section_id, columns=None):
+        """Return the column views of one cross-section (the index of the store is built on first use)."""
+        if self.index is None:
+            self.index = {}
+            for part in range(len(self.parts)):
+                ids, starts, stops = self.section_bounds(part)
+                self.index.update(zip(ids.tolist(), zip([part] * len(ids), starts.tolist(), stops.tolist())))
+        part, start, stop = self.index[cross_section_id]
+        return {column: values[start:stop] for column, values in self.read_part(part, columns).items()}
@@ -1,16 +1,39 @@
-import arcpy
 import csv
 import os
+import re
+import numpy as np
 import config  # Import the configuration module
+import backends
+from cross_section_store import CrossSectionStoreWriter, DEFAULT_BATCH_ROWS
+
+try:
+    import arcpy
+except ImportError:
+    # arcpy is only needed without a backend from backends.py
+    arcpy = None
 
 # Exports the attributes of point values on each cross-section to CSV files.
-def export_to_csv(workspace, output_folder, desired_fields):
+def export_to_csv(workspace, output_folder, desired_fields, backend=None):
     """
     Parameters:
     workspace (str): Path to the geodatabase containing the feature classes.
     output_folder (str): Path to the folder where the CSV files will be saved.
     desired_fields (list): List of fields to export.
+    backend (str or backends.Backend): Optional backend used instead of arcpy cursors.
     """
+    # Read the feature classes through a backend if one is configured
+    backend = backends.get_backend(backend)
+    if backend is not None:
+        for feature_class in backend.list_feature_classes(workspace):
+            print(feature_class)
+            columns = backend.read_table(f"{workspace}/{feature_class}", desired_fields)
+            with open(os.path.join(output_folder, f"{feature_class}.csv"), "w", newline="") as csv_file:
+                csv_writer = csv.writer(csv_file)
+                csv_writer.writerow(desired_fields)
+                csv_writer.writerows(zip(*(columns[field] for field in desired_fields)))
+        print("CSV export completed.")
+        return
+
     # Set workspace
     arcpy.env.workspace = workspace
 
@@ -38,10 +61,79 @@ def export_to_csv(workspace, output_folder, desired_fields):
 
     print("CSV export completed.")
 
+# Point feature classes written by CrossSection_BatchExtractRaster.py: the raster label and the CrosSecID
+POINT_FEATURE_CLASS = re.compile(r"(NTL|BuildingFA)Ext_.*?(\d+)$")
+
+# Reads the OBJECTID and RASTERVALU fields of a point feature class, sorted by OBJECTID
+def read_point_values(feature_class_path, backend=None):
+    fields = ["OBJECTID", "RASTERVALU"]
+    if backend is not None:
+        columns = backend.read_table(feature_class_path, fields)
+        object_ids, values = np.asarray(columns["OBJECTID"]), np.asarray(columns["RASTERVALU"], dtype=float)
+    else:
+        with arcpy.da.SearchCursor(feature_class_path, fields) as cursor:
+            rows = [(object_id, np.nan if value is None else value) for object_id, value in cursor]
+        object_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        values = np.array([row[1] for row in rows], dtype=float)
+    order = np.argsort(object_ids, kind='stable')
+    return object_ids[order], values[order]
+
+# Exports the point values of every cross-section to a single cross-section store instead of one CSV per feature class.
+def export_to_store(workspace, store_path, backend=None, batch_rows=DEFAULT_BATCH_ROWS):
+    """
+    The NTL and BuildingFA point feature classes of each cross-section are merged into one set of rows keyed by
+    (CrosSecID, OBJECTID), and written to the store in batches of about batch_rows rows (see cross_section_store.py).
+
+    Parameters:
+    workspace (str): Path to the geodatabase containing the point feature classes.
+    store_path (str): Path to the cross-section store directory.
+    backend (str or backends.Backend): Optional backend used instead of arcpy cursors.
+    batch_rows (int): Number of rows per part of the store.
+    """
+    backend = backends.get_backend(backend)
+    if backend is not None:
+        feature_classes = backend.list_feature_classes(workspace)
+    else:
+        arcpy.env.workspace = workspace
+        feature_classes = arcpy.ListFeatureClasses()
+
+    # Group the NTL and BuildingFA feature classes of each cross-section
+    cross_sections = {}
+    for feature_class in feature_classes:
+        match = POINT_FEATURE_CLASS.search(feature_class)
+        if match is None:
+            print(f"Skipping {feature_class}: not a cross-section point feature class.")
+            continue
+        cross_sections.setdefault(int(match.group(2)), {})[match.group(1)] = feature_class
+
+    with CrossSectionStoreWriter(store_path, batch_rows) as writer:
+        for cross_section_id, labels in sorted(cross_sections.items()):
+            if "NTL" not in labels:
+                print(f"Skipping CrosSecID {cross_section_id}: no NTL point feature class.")
+                continue
+            object_ids, values = read_point_values(f"{workspace}/{labels['NTL']}", backend)
+            floor_area = np.full(len(object_ids), np.nan)
+            if "BuildingFA" in labels:
+                fa_object_ids, fa_values = read_point_values(f"{workspace}/{labels['BuildingFA']}", backend)
+                # Match the floor area points to the NTL points by OBJECTID
+                _, ntl_index, fa_index = np.intersect1d(object_ids, fa_object_ids, return_indices=True)
+                floor_area[ntl_index] = fa_values[fa_index]
+            writer.write({"CrosSecID": np.full(len(object_ids), cross_section_id), "OBJECTID": object_ids,
+                          "RASTERVALU": values, "BuildingFA": floor_area})
+
 
 if __name__ == '__main__':
-    export_to_csv(
-        workspace=config.csv_workspace,
-        output_folder=config.csv_output_folder,
-        desired_fields=config.csv_desired_fields
-    )
+    if config.cross_section_store:
+        export_to_store(
+            workspace=config.csv_workspace,
+            store_path=config.cross_section_store,
+            backend=config.backend,
+            batch_rows=config.cross_section_store_batch_rows
+        )
+    else:
+        export_to_csv(
+            workspace=config.csv_workspace,
+            output_folder=config.csv_output_folder,
+            desired_fields=config.csv_desired_fields,
+            backend=config.backend
+        )
@@ -1,4 +1,3 @@
-import arcpy
 import CrossSection_BatchGeneration
 import CrossSection_BatchExtractRaster
 import config
@@ -7,18 +6,40 @@ import CrossSection_curvefitting
 import average_curve_parameters
 import clustering
 import cluster_remaining
+import os
+import sys
+import adjacency_index
+import backends
+import cross_section_geometry
+import cross_section_store
+import raster_cache
+import stage_cache
+
+try:
+    import arcpy
+except ImportError:
+    # arcpy is only needed without a backend from backends.py
+    arcpy = None
 
 # Merges all feature classes in the input geodatabase into a single feature class.
-def merge_feature_classes(input_gdb, output_gdb, output_feature_class_name):
+def merge_feature_classes(input_gdb, output_gdb, output_feature_class_name, backend=None):
     """
     Parameters:
     input_gdb (str): Path to the input geodatabase containing individual feature classes.
     output_gdb (str): Path to the output geodatabase where the merged feature class will be stored.
     output_feature_class_name (str): Name of the merged feature class.
+    backend (str or backends.Backend): Optional backend used instead of arcpy.
 
     Returns:
     str: Path to the merged feature class.
     """
+    backend = backends.get_backend(backend)
+    if backend is not None:
+        output_feature_class = f"{output_gdb}/{output_feature_class_name}"
+        inputs = [f"{input_gdb}/{feature_class}" for feature_class in backend.list_feature_classes(input_gdb)]
+        backend.merge(inputs, output_feature_class)
+        return output_feature_class
+
     arcpy.env.workspace = input_gdb
     feature_classes = arcpy.ListFeatureClasses()
     output_feature_class = f"{output_gdb}/{output_feature_class_name}"
@@ -26,67 +47,284 @@ def merge_feature_classes(input_gdb, output_gdb, output_feature_class_name):
     arcpy.Merge_management(inputs=feature_classes, output=output_feature_class)
     return output_feature_class
 
+# Streams the sampled cross-sections through the curve fitting into the polygon averages, without intermediate files.
+def stream_polygon_averages(input_feature_class, raster_ntl, raster_building_fa, output_file_path,
+                            output_file_path_skipna, backend=None, distance=100, batched=True, workers=1,
+                            chunk_size=256, max_pending=None, fit_results_csv=None, flush_rows=None, store_path=None,
+                            store_batch_rows=cross_section_store.DEFAULT_BATCH_ROWS):
+    """
+    Streaming alternative to BatchExtractRaster -> export_to_csv -> curve_fitting -> process_and_save_csv. The
+    cross-sections are sampled chunk by chunk (iter_cross_section_profiles), fitted as they come (fit_stream) and
+    added to the per-polygon averages (PolygonAverages). At most max_pending chunks are in flight, so the memory
+    used depends on the chunk size and not on the number of cross-sections. The point feature classes and CSV files
+    are not written; the fit results and the cross-section store only when their paths are given.
+
+    Parameters:
+    input_feature_class (str): Merged cross-section feature class with a CrosSecID field.
+    raster_ntl (str): Path to the NTL raster.
+    raster_building_fa (str): Path to the building floor area raster.
+    output_file_path (str): Path to save the grouped average fit results CSV file.
+    output_file_path_skipna (str): Path to save the grouped average fit results CSV file, skipping NaN values.
+    backend (str or backends.Backend): Backend used for reading, ArcpyBackend if None.
+    distance (float): Spacing of the points in map units.
+    batched (bool): Fit each chunk at once with fit_data_batch.
+    workers (int): Number of worker processes fitting the chunks (1 fits them in this process).
+    chunk_size (int): Number of cross-sections per chunk.
+    max_pending (int): Maximum number of chunks in flight (2 * workers if None).
+    fit_results_csv (str): Optional path of the fit results CSV (or .parquet) file.
+    flush_rows (int): Write the fit results every flush_rows rows (every chunk if None).
+    store_path (str): Optional cross-section store directory the sampled points are written to.
+    store_batch_rows (int): Number of rows per part of the store.
+
+    Returns:
+    list: Cross-sections that failed, with their error message and traceback.
+    """
+    profiles = CrossSection_BatchExtractRaster.iter_cross_section_profiles(
+        input_feature_class, raster_ntl, raster_building_fa, backend=backend, distance=distance,
+        chunk_size=chunk_size, store_path=store_path, store_batch_rows=store_batch_rows)
+    writer = CrossSection_curvefitting.FitResultsWriter(fit_results_csv, flush_rows or 1) if fit_results_csv else None
+    averages = average_curve_parameters.PolygonAverages()
+
+    errors, cross_sections = [], 0
+    for results, chunk_errors in CrossSection_curvefitting.fit_stream(profiles, batched, workers, max_pending):
+        averages.add(results.to_frame())
+        if writer is not None:
+            writer.extend(results)
+        errors.extend(chunk_errors)
+        cross_sections += len(results)
+    if writer is not None:
+        writer.close()
+        print(f"Fit results have been saved to '{fit_results_csv}'.")
+
+    for error in errors:
+        print(f"An error occurred for {error['File']}: {error['error']}")
+    print(f"Streamed {cross_sections} cross-sections.")
+    averages.save(output_file_path, output_file_path_skipna)
+    return errors
+
 
 if __name__ == '__main__':
-    # Run CrossSection_BatchGeneration.py
-    CrossSection_BatchGeneration.BatchGeneration(
-        config.workspace,
-        config.scratch_workspace,
-        config.input_raster,
-        config.feature_class,
-        config.output_gdb,
-        config.toolbox_path
+    # Create the configured backend once for all stages (None keeps the geoprocessing tools)
+    backend = backends.get_backend(config.backend, tile_size=config.raster_tile_size,
+                                   cache_bytes=config.raster_cache_bytes)
+
+    # Stages whose parameters, inputs and code are unchanged since their last run are skipped
+    runner = stage_cache.StageRunner(config.stage_manifest, force=config.force_stages)
+    geometry_modules = [backends, raster_cache, cross_section_geometry]
+
+    # Run CrossSection_BatchGeneration.py (polygon by polygon, so a stopped run resumes where it stopped)
+    polygons = config.feature_class if os.path.dirname(config.feature_class) \
+        else f"{config.workspace}/{config.feature_class}"
+    runner.run(
+        "BatchGeneration",
+        CrossSection_BatchGeneration.BatchGeneration,
+        dict(
+            workspace=config.workspace,
+            scratch_workspace=config.scratch_workspace,
+            input_raster=config.input_raster,
+            feature_class=config.feature_class,
+            output_gdb=config.output_gdb,
+            toolbox_path=config.toolbox_path,
+            backend=backend,
+            distance=config.boundary_point_distance,
+            keep_buckets=config.cross_section_buckets,
+            workers=config.generation_workers,
+            error_report=config.generation_error_report
+        ),
+        inputs=[config.input_raster, polygons],
+        outputs=[config.output_gdb],
+        modules=[CrossSection_BatchGeneration] + geometry_modules,
+        unit_input=polygons
     )
 
     # Merge feature classes from the output of CrossSection_BatchGeneration.py
-    merged_feature_class = merge_feature_classes(
-        input_gdb=config.merge_input_gdb,
-        output_gdb=config.merge_output_gdb,
-        output_feature_class_name=config.merge_output_feature_class_name
+    merged_feature_class = runner.run(
+        "merge",
+        merge_feature_classes,
+        dict(
+            input_gdb=config.merge_input_gdb,
+            output_gdb=config.merge_output_gdb,
+            output_feature_class_name=config.merge_output_feature_class_name,
+            backend=backend
+        ),
+        inputs=[config.merge_input_gdb],
+        outputs=[f"{config.merge_output_gdb}/{config.merge_output_feature_class_name}"],
+        modules=[sys.modules[__name__], backends],
+        keep_result=True
     )
 
     # Update the configuration for CrossSection_BatchExtractRaster.py
     config.input_feature_class_merged = merged_feature_class
+    store_outputs = [config.cross_section_store] if config.cross_section_store else []
+    cross_sections = config.cross_section_store or os.path.join(config.csv_output_folder, "*.csv")
 
-    # Run CrossSection_BatchExtractRaster.py
-    CrossSection_BatchExtractRaster.BatchExtractRaster(
-        input_feature_class=config.input_feature_class_merged,
-        group_by_fields=config.group_by_fields,
-        raster_ntl=config.raster_ntl,
-        raster_building_fa=config.raster_building_fa,
-        workspace=config.workspace_script2
-    )
+    if config.streaming_pipeline:
+        # Sample, fit and average the cross-sections in memory
+        keep_fit_results = config.streaming_keep_fit_results
+        runner.run(
+            "stream_polygon_averages",
+            stream_polygon_averages,
+            dict(
+                input_feature_class=config.input_feature_class_merged,
+                raster_ntl=config.raster_ntl,
+                raster_building_fa=config.raster_building_fa,
+                output_file_path=config.output_grouped_csv,
+                output_file_path_skipna=config.output_grouped_skipna_csv,
+                backend=backend,
+                batched=config.batched_curve_fitting,
+                workers=config.curve_fitting_workers,
+                chunk_size=config.curve_fitting_chunk_size,
+                max_pending=config.streaming_max_pending,
+                fit_results_csv=config.fit_results_csv if keep_fit_results else None,
+                flush_rows=config.fit_results_flush_rows,
+                store_path=config.cross_section_store,
+                store_batch_rows=config.cross_section_store_batch_rows
+            ),
+            inputs=[config.input_feature_class_merged, config.raster_ntl, config.raster_building_fa],
+            outputs=[config.output_grouped_csv, config.output_grouped_skipna_csv] + store_outputs +
+                    ([config.fit_results_csv] if keep_fit_results else []),
+            modules=[sys.modules[__name__], CrossSection_BatchExtractRaster, CrossSection_curvefitting,
+                     average_curve_parameters, cross_section_store] + geometry_modules
+        )
 
-    # Run export.py
-    export.export_to_csv(
-        workspace=config.csv_workspace,
-        output_folder=config.csv_output_folder,
-        desired_fields=config.csv_desired_fields
-    )
+        # The fit plots need both the fit results and the cross-section store
+        if keep_fit_results and config.cross_section_store:
+            runner.run(
+                "plot_fits",
+                CrossSection_curvefitting.plot_fits,
+                dict(
+                    csv_folder=config.cross_section_store,
+                    fit_results_csv=config.fit_results_csv,
+                    fit_results_folder=config.fit_results_folder,
+                    policy=config.plot_policy,
+                    every=config.plot_every,
+                    worst=config.plot_worst,
+                    workers=config.plot_workers,
+                    panels=config.plot_panels
+                ),
+                inputs=[config.fit_results_csv, config.cross_section_store],
+                modules=[CrossSection_curvefitting, cross_section_store]
+            )
+    else:
+        # Run CrossSection_BatchExtractRaster.py
+        runner.run(
+            "BatchExtractRaster",
+            CrossSection_BatchExtractRaster.BatchExtractRaster,
+            dict(
+                input_feature_class=config.input_feature_class_merged,
+                group_by_fields=config.group_by_fields,
+                raster_ntl=config.raster_ntl,
+                raster_building_fa=config.raster_building_fa,
+                workspace=config.workspace_script2,
+                backend=backend,
+                store_path=config.cross_section_store,
+                store_batch_rows=config.cross_section_store_batch_rows,
+                write_points=config.write_point_feature_classes
+            ),
+            inputs=[config.input_feature_class_merged, config.raster_ntl, config.raster_building_fa],
+            outputs=([config.workspace_script2] if config.write_point_feature_classes or not store_outputs else []) +
+                    store_outputs,
+            modules=[CrossSection_BatchExtractRaster, cross_section_store] + geometry_modules
+        )
 
-    # Run CrossSection_curvefitting.py
-    CrossSection_curvefitting.curve_fitting(
-        csv_folder=config.csv_output_folder,
-        fit_results_folder=config.fit_results_folder,
-        fit_results_csv=config.fit_results_csv
-    )
+        # Run export.py (the cross-section store, if configured, is written by BatchExtractRaster)
+        if not config.cross_section_store:
+            runner.run(
+                "export",
+                export.export_to_csv,
+                dict(
+                    workspace=config.csv_workspace,
+                    output_folder=config.csv_output_folder,
+                    desired_fields=config.csv_desired_fields,
+                    backend=backend
+                ),
+                inputs=[config.csv_workspace],
+                outputs=[config.csv_output_folder],
+                modules=[export, backends]
+            )
 
-    # Run average_curve_parameters.py
-    average_curve_parameters.process_and_save_csv(
-        input_file_path=config.input_fit_results_csv,
-        output_file_path=config.output_grouped_csv,
-        output_file_path_skipna=config.output_grouped_skipna_csv
-    )
+        # Run CrossSection_curvefitting.py
+        runner.run(
+            "curve_fitting",
+            CrossSection_curvefitting.curve_fitting,
+            dict(
+                csv_folder=config.cross_section_store or config.csv_output_folder,
+                fit_results_folder=config.fit_results_folder,
+                fit_results_csv=config.fit_results_csv,
+                batched=config.batched_curve_fitting,
+                workers=config.curve_fitting_workers,
+                chunk_size=config.curve_fitting_chunk_size,
+                flush_rows=config.fit_results_flush_rows
+            ),
+            inputs=[cross_sections],
+            outputs=[config.fit_results_csv],
+            modules=[CrossSection_curvefitting, cross_section_store]
+        )
+
+        # Render the fit plots selected by the plot policy
+        runner.run(
+            "plot_fits",
+            CrossSection_curvefitting.plot_fits,
+            dict(
+                csv_folder=config.cross_section_store or config.csv_output_folder,
+                fit_results_csv=config.fit_results_csv,
+                fit_results_folder=config.fit_results_folder,
+                policy=config.plot_policy,
+                every=config.plot_every,
+                worst=config.plot_worst,
+                workers=config.plot_workers,
+                panels=config.plot_panels
+            ),
+            inputs=[config.fit_results_csv, cross_sections],
+            modules=[CrossSection_curvefitting, cross_section_store]
+        )
+
+        # Run average_curve_parameters.py
+        runner.run(
+            "average_curve_parameters",
+            average_curve_parameters.process_and_save_csv,
+            dict(
+                input_file_path=config.input_fit_results_csv,
+                output_file_path=config.output_grouped_csv,
+                output_file_path_skipna=config.output_grouped_skipna_csv
+            ),
+            inputs=[config.input_fit_results_csv],
+            outputs=[config.output_grouped_csv, config.output_grouped_skipna_csv],
+            modules=[average_curve_parameters]
+        )
 
     # Run clustering.py
-    clustering.cluster_polygons(
-        input_csv=config.input_grouped_skipna_csv,
-        output_csv=config.output_clustered_csv
+    runner.run(
+        "clustering",
+        clustering.cluster_polygons,
+        dict(
+            input_csv=config.input_grouped_skipna_csv,
+            output_csv=config.output_clustered_csv,
+            iterations=config.consensus_iterations,
+            workers=config.clustering_workers,
+            n_clusters=config.cluster_n_clusters,
+            k_values=config.cluster_k_values,
+            dbscan_eps=config.dbscan_eps_values,
+            dbscan_min_samples=config.dbscan_min_samples_values,
+            silhouette_sample=config.silhouette_sample_size,
+            memory_bytes=config.cluster_memory_bytes
+        ),
+        inputs=[config.input_grouped_skipna_csv],
+        outputs=[config.output_clustered_csv],
+        modules=[clustering]
     )
 
-    # Run cluster_remaining.py
-    cluster_remaining.classify_remaining_polygons(
-        polygon_layer=config.polygon_layer,
-        cluster_field=config.cluster_field,
-        temp_layer=config.temp_layer
-    )
\ No newline at end of file
+    # Run cluster_remaining.py (the polygon layer is updated in place)
+    runner.run(
+        "cluster_remaining",
+        cluster_remaining.classify_remaining_polygons,
+        dict(
+            polygon_layer=config.polygon_layer,
+            cluster_field=config.cluster_field,
+            backend=backend,
+            adjacency_index=config.adjacency_index
+        ),
+        inputs=[config.polygon_layer],
+        outputs=[config.polygon_layer],
+        modules=[cluster_remaining, adjacency_index, backends]
+    )
@@ -0,0 +1,187 @@
+# Copied as is to "2 HRSM/2.1 Data preprocessing/raster_cache.py": each project folder is run as its own set of
+# scripts, without a package shared between them, so keep both copies identical (see tests/test_raster_cache.py).
+import os
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import arcpy
+except ImportError:
+    # arcpy is only needed by ArcpyRasterSource
+    arcpy = None
+
+try:
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:
+    # rasterio is only needed by RasterioRasterSource
+    rasterio = Window = None
+
+# Default tile edge (cells) and cache budget (bytes)
+DEFAULT_TILE_SIZE = 512
+DEFAULT_CACHE_BYTES = 512 * 2 ** 20
+
+
+class ArcpyRasterSource:
+    """Reads blocks of an ArcGIS raster with RasterToNumPyArray."""
+
+    def __init__(self, path):
+        if arcpy is None:
+            raise ImportError("ArcpyRasterSource requires arcpy (ArcGIS Pro).")
+        self.path = path
+        raster = arcpy.Raster(path)
+        self.cell_width, self.cell_height = raster.meanCellWidth, raster.meanCellHeight
+        self.x_origin, self.y_origin = raster.extent.XMin, raster.extent.YMax
+        self.transform = (self.x_origin, self.cell_width, 0.0, self.y_origin, 0.0, -self.cell_height)
+        self.shape = (raster.height, raster.width)
+        self.crs = raster.spatialReference
+        self.nodata = raster.noDataValue
+
+    def read_block(self, row_start, row_stop, column_start, column_stop):
+        lower_left = arcpy.Point(self.x_origin + column_start * self.cell_width,
+                                 self.y_origin - row_stop * self.cell_height)
+        array = arcpy.RasterToNumPyArray(self.path, lower_left, column_stop - column_start,
+                                         row_stop - row_start).astype(np.float64)
+        if self.nodata is not None:
+            array[array == self.nodata] = np.nan
+        return array
+
+    def close(self):
+        # RasterToNumPyArray opens the raster for each block, nothing is kept open
+        pass
+
+
+class RasterioRasterSource:
+    """
+    Reads blocks of a GeoTIFF (or any GDAL raster) with windowed rasterio reads. The dataset is opened once per
+    process and kept open between blocks; it is reopened in a forked or unpickled copy, since GDAL handles cannot be
+    shared between processes.
+    """
+
+    def __init__(self, path):
+        if rasterio is None:
+            raise ImportError("RasterioRasterSource requires rasterio.")
+        self.path = path
+        self.dataset, self.pid = None, None
+        source = self.open()
+        self.transform = source.transform.to_gdal()
+        self.shape = (source.height, source.width)
+        self.crs = source.crs
+
+    def open(self):
+        if self.dataset is None or self.pid != os.getpid():
+            self.dataset, self.pid = rasterio.open(self.path), os.getpid()
+        return self.dataset
+
+    def close(self):
+        if self.dataset is not None and self.pid == os.getpid():
+            self.dataset.close()
+        self.dataset, self.pid = None, None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["dataset"], state["pid"] = None, None
+        return state
+
+    def read_block(self, row_start, row_stop, column_start, column_stop):
+        window = Window(column_start, row_start, column_stop - column_start, row_stop - row_start)
+        return self.open().read(1, window=window, masked=True).astype(np.float64).filled(np.nan)
+
+
+class TileCache:
+    """
+    LRU cache of decoded raster tiles with a byte budget, shared by every raster of a backend.
+
+    The least recently used tiles are evicted as soon as the cached tiles exceed max_bytes (the tile being loaded is
+    always kept), so peak memory stays bounded whatever the raster size.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+        self.misses += 1
+        tile = load()
+        self.tiles[key] = tile
+        self.cached_bytes += tile.nbytes
+        while self.cached_bytes > self.max_bytes and len(self.tiles) > 1:
+            _, evicted = self.tiles.popitem(last=False)
+            self.cached_bytes -= evicted.nbytes
+            self.evictions += 1
+        return tile
+
+    @property
+    def stats(self):
+        requests = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "cached_tiles": len(self.tiles), "cached_bytes": self.cached_bytes}
+
+
+class CachedRaster:
+    """
+    Windowed access to a raster through fixed-size tiles kept in a TileCache. Only the tiles touched by a window or
+    by the sampled points are decoded, and NoData is returned as NaN.
+    """
+
+    def __init__(self, source, cache, tile_size=DEFAULT_TILE_SIZE):
+        self.source = source
+        self.cache = cache
+        self.tile_size = tile_size
+        self.transform = source.transform
+        self.shape = source.shape
+
+    def tile(self, tile_row, tile_column):
+        row_start, column_start = tile_row * self.tile_size, tile_column * self.tile_size
+        row_stop = min(row_start + self.tile_size, self.shape[0])
+        column_stop = min(column_start + self.tile_size, self.shape[1])
+        return self.cache.get((self.source.path, tile_row, tile_column),
+                              lambda: self.source.read_block(row_start, row_stop, column_start, column_stop))
+
+    def read_window(self, row_start, row_stop, column_start, column_stop):
+        window = np.full((max(row_stop - row_start, 0), max(column_stop - column_start, 0)), np.nan)
+        if window.size == 0:
+            return window
+
+        size = self.tile_size
+        for tile_row in range(row_start // size, (row_stop - 1) // size + 1):
+            for tile_column in range(column_start // size, (column_stop - 1) // size + 1):
+                tile = self.tile(tile_row, tile_column)
+                top, left = tile_row * size, tile_column * size
+                r0, r1 = max(row_start, top), min(row_stop, top + tile.shape[0])
+                c0, c1 = max(column_start, left), min(column_stop, left + tile.shape[1])
+                window[r0 - row_start:r1 - row_start, c0 - column_start:c1 - column_start] = \
+                    tile[r0 - top:r1 - top, c0 - left:c1 - left]
+        return window
+
+    def sample(self, rows, columns):
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        values = np.full(rows.shape, np.nan)
+        inside = np.flatnonzero((rows >= 0) & (rows < self.shape[0]) & (columns >= 0) & (columns < self.shape[1]))
+        if len(inside) == 0:
+            return values
+
+        # Gather tile by tile, so each tile is fetched once per call
+        tile_rows, tile_columns = rows[inside] // self.tile_size, columns[inside] // self.tile_size
+        tile_keys = tile_rows * (self.shape[1] // self.tile_size + 1) + tile_columns
+        order = np.argsort(tile_keys, kind='stable')
+        boundaries = np.flatnonzero(np.diff(tile_keys[order])) + 1
+        for group in np.split(order, boundaries):
+            tile_row, tile_column = tile_rows[group[0]], tile_columns[group[0]]
+            tile = self.tile(tile_row, tile_column)
+            points = inside[group]
+            values[points] = tile[rows[points] - tile_row * self.tile_size,
+                                  columns[points] - tile_column * self.tile_size]
+        return values
@@ -0,0 +1,227 @@
+import fnmatch
+import glob
+import hashlib
+import inspect
+import json
+import os
+import re
+import time
+
+# Feature classes and layers are identified by their geodatabase or GeoPackage ("<file>.gdb/<name>")
+DATASET_CONTAINER = re.compile(r"^(.*?\.(?:gdb|gpkg))(?:[/\\].*)?$", re.IGNORECASE)
+
+# Block size used to hash the files
+HASH_BLOCK_BYTES = 2 ** 20
+
+# Files left out of the directory and pattern digests: lock files that ArcGIS creates and removes in a geodatabase
+# while it is open (e.g. "_gdb.<host>.<pid>.sr.lock") and folder metadata of the operating system
+NON_CONTENT_FILES = ("*.lock", "Thumbs.db", "desktop.ini", ".DS_Store")
+
+
+def is_content_file(path):
+    name = os.path.basename(path)
+    return not any(fnmatch.fnmatch(name, pattern) for pattern in NON_CONTENT_FILES)
+
+
+# Serializes the parameters of a stage: arrays (e.g. polygon rings) by the hash of their data, backends and other
+# objects by their name or type
+def parameter_value(value):
+    if hasattr(value, "tobytes"):
+        return hashlib.sha256(value.tobytes()).hexdigest()
+    return getattr(value, "name", type(value).__name__)
+
+
+def hash_values(*values):
+    text = json.dumps(values, sort_keys=True, default=parameter_value)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+# File system path of a feature class (its geodatabase or GeoPackage) or of any other path
+def dataset_path(path):
+    match = DATASET_CONTAINER.match(path)
+    if match and not os.path.exists(path):
+        return match.group(1)
+    return path
+
+
+def path_exists(path):
+    path = dataset_path(path)
+    return bool(glob.glob(path)) if glob.has_magic(path) else os.path.exists(path)
+
+
+class StageRunner:
+    """
+    Runs the stages of the pipeline and skips the ones whose fingerprint is unchanged since their last run.
+
+    The fingerprint of a stage hashes its parameters, the content of its inputs (files, directories, glob patterns
+    or feature classes, through their geodatabase or GeoPackage) and the source code of its modules. A manifest
+    (JSON) records the fingerprint and outputs of each completed stage, and the file digests keyed by size and
+    modification time, so unchanged files are not hashed again. Files declared as outputs of a stage are left out of
+    the directories and patterns hashed as inputs, so a stage writing into the folder of an earlier stage does not
+    invalidate it, and so are lock files and other NON_CONTENT_FILES, so opening a geodatabase does not either.
+    """
+
+    def __init__(self, manifest_path, force=()):
+        self.manifest_path = manifest_path
+        self.force = set(force)
+        self.manifest = {"stages": {}, "digests": {}}
+        if manifest_path and os.path.isfile(manifest_path):
+            with open(manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+
+    def save(self):
+        if not self.manifest_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        temporary_path = f"{self.manifest_path}.tmp"
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=2)
+        os.replace(temporary_path, self.manifest_path)
+
+    def output_files(self):
+        """Absolute paths of the output files of every recorded stage."""
+        return {os.path.abspath(path) for stage in self.manifest["stages"].values() for path in stage["outputs"]
+                if os.path.isfile(path)}
+
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.manifest["digests"].get(path)
+        if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as input_file:
+            for block in iter(lambda: input_file.read(HASH_BLOCK_BYTES), b""):
+                digest.update(block)
+        self.manifest["digests"][path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def files_digest(self, paths):
+        excluded = self.output_files()
+        return hash_values(sorted((path, self.file_digest(path)) for path in paths
+                                  if os.path.isfile(path) and is_content_file(path)
+                                  and os.path.abspath(path) not in excluded))
+
+    def path_digest(self, path):
+        """Content digest of a file, directory, glob pattern or feature class ("missing" if it does not exist)."""
+        path = dataset_path(path)
+        if glob.has_magic(path):
+            return self.files_digest(glob.glob(path))
+        if os.path.isdir(path):
+            return self.files_digest(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        if os.path.isfile(path):
+            return self.file_digest(path)
+        return "missing"
+
+    def fingerprint(self, params, inputs, modules):
+        code = [self.file_digest(inspect.getsourcefile(module)) for module in modules]
+        return hash_values(params, {path: self.path_digest(path) for path in inputs}, code)
+
+    def run(self, name, function, params, inputs=(), outputs=(), modules=(), unit_input=None, keep_result=False):
+        """
+        Run function(**params) unless the stage is up to date, i.e. its fingerprint matches the manifest and its
+        outputs exist.
+
+        Parameters:
+        name (str): Name of the stage in the manifest.
+        function (callable): Function of the stage.
+        params (dict): Keyword arguments of the function, part of the fingerprint.
+        inputs (list): Paths (files, directories, glob patterns or feature classes) read by the stage.
+        outputs (list): Paths written by the stage.
+        modules (list): Modules whose source code is part of the fingerprint.
+        unit_input (str): Input split into units by the function (e.g. the polygons of BatchGeneration). It is left
+                          out of the fingerprint of the units, and the function gets a UnitCache as unit_cache.
+        keep_result (bool): Record the (JSON) return value, so it is returned when the stage is skipped.
+
+        Returns:
+        The return value of the function, or the recorded one (None unless keep_result) if the stage was skipped.
+        """
+        stage = self.manifest["stages"].get(name)
+        outputs_exist = all(path_exists(path) for path in outputs)
+        fingerprint = self.fingerprint(params, inputs, modules)
+        if stage and name not in self.force and stage["fingerprint"] == fingerprint and outputs_exist:
+            print(f"Stage '{name}' is up to date, skipped.")
+            return stage.get("result")
+
+        print(f"Running stage '{name}'.")
+        start = time.perf_counter()
+        kwargs = dict(params)
+        if unit_input is not None:
+            context = self.fingerprint(params, [path for path in inputs if path != unit_input], modules)
+            # Units are only reused while the outputs they were written to exist
+            kwargs["unit_cache"] = UnitCache(self.units_path(name), context, reset=not outputs_exist or
+                                             name in self.force)
+        result = function(**kwargs)
+
+        self.manifest["stages"][name] = {
+            "fingerprint": None,
+            "outputs": list(outputs),
+            "seconds": round(time.perf_counter() - start, 3),
+            "completed": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "result": result if keep_result else None,
+        }
+        # The fingerprint is taken again after the run (with the outputs recorded), so stages updating their own
+        # inputs or writing into an input folder are not rerun
+        self.manifest["stages"][name]["fingerprint"] = self.fingerprint(params, inputs, modules)
+        self.save()
+        return result
+
+    def units_path(self, name):
+        if not self.manifest_path:
+            return None
+        return f"{os.path.splitext(self.manifest_path)[0]}_{name}_units.jsonl"
+
+
+class UnitCache:
+    """
+    Journal of the units (e.g. polygons) completed by a stage, appended as each unit is done, so a stage stopped
+    halfway only recomputes the remaining or changed units when it is run again. Units removed from the input are
+    forgotten with a null fingerprint entry.
+    """
+
+    def __init__(self, path, context, reset=False):
+        self.path = path
+        self.context = context
+        self.completed = {}
+        if path and os.path.isfile(path) and not reset:
+            with open(path) as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut by a crash
+                        continue
+                    if entry["fingerprint"] is None:
+                        self.completed.pop(str(entry["unit"]), None)
+                    else:
+                        self.completed[str(entry["unit"])] = entry["fingerprint"]
+        elif path and reset and os.path.isfile(path):
+            os.remove(path)
+        self.skipped = 0
+
+    def fingerprint(self, *values):
+        """Fingerprint of a unit from the values it depends on (e.g. its id and geometry), within the stage context."""
+        return hash_values(self.context, *values)
+
+    def done(self, unit, fingerprint):
+        if self.completed.get(str(unit)) == fingerprint:
+            self.skipped += 1
+            return True
+        return False
+
+    def record(self, unit, fingerprint):
+        self.completed[str(unit)] = fingerprint
+        self.append(unit, fingerprint)
+
+    def forget(self, unit):
+        """Drop a unit that is no longer part of the input (its outputs are removed by the stage)."""
+        if self.completed.pop(str(unit), None) is not None:
+            self.append(unit, None)
+
+    def units(self):
+        return set(self.completed)
+
+    def append(self, unit, fingerprint):
+        if self.path:
+            with open(self.path, "a") as journal:
+                journal.write(json.dumps({"unit": str(unit), "fingerprint": fingerprint}) + "\n")
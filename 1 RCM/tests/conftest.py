@@ -0,0 +1,38 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The scripts are run from the project folder and import each other (and config.py) as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Synthetic NTL and floor area GeoTIFFs (100 m cells) with three NLC polygons in a GeoPackage
+@pytest.fixture
+def synthetic_inputs(tmp_path):
+    rasterio = pytest.importorskip("rasterio")
+    fiona = pytest.importorskip("fiona")
+    from rasterio.transform import from_origin
+
+    rng = np.random.default_rng(1)
+    ntl = rng.random((60, 80)).astype(np.float32) * 10
+    ntl[20, 30], ntl[40, 55] = 100, 90
+    ntl[5, 5] = -1  # NoData
+    crs = "EPSG:3857"
+    paths = {"ntl": str(tmp_path / "ntl.tif"), "fa": str(tmp_path / "fa.tif"),
+             "polygons": str(tmp_path / "inputs.gpkg") + "/polygons"}
+    for name, values in (("ntl", ntl), ("fa", np.where(ntl < 0, ntl, ntl * 3))):
+        with rasterio.open(paths[name], "w", driver="GTiff", height=60, width=80, count=1, dtype="float32",
+                           transform=from_origin(0, 6000, 100, 100), crs=crs, nodata=-1) as sink:
+            sink.write(values, 1)
+
+    polygons = [(1, [(1000, 2000), (4500, 2000), (4500, 5000), (1000, 5000), (1000, 2000)]),
+                (2, [(4500, 2000), (7500, 2000), (7200, 4800), (4500, 5000), (4500, 2000)]),
+                (3, [(1000, 500), (4500, 500), (4500, 2000), (1000, 2000), (1000, 500)])]
+    schema = {"geometry": "Polygon", "properties": {"NLC_ID": "int", "Cluster": "int"}}
+    with fiona.open(str(tmp_path / "inputs.gpkg"), "w", driver="GPKG", layer="polygons", schema=schema,
+                    crs=crs) as sink:
+        for NLC_ID, ring in polygons:
+            sink.write({"geometry": {"type": "Polygon", "coordinates": [ring]},
+                        "properties": {"NLC_ID": NLC_ID, "Cluster": None if NLC_ID == 3 else NLC_ID}})
+    return paths
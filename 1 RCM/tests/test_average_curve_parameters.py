@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import average_curve_parameters as acp
+from CrossSection_curvefitting import FIT_OK, FIT_NOT_CONVERGED
+
+
+# Fit results of the cross-sections of three polygons, named by CrosSecID or by CSV file name stem
+def fit_results():
+    rng = np.random.default_rng(5)
+    rows = []
+    for NLC_ID in (7, 12, 123):
+        for rank in range(1, 16):
+            cross_section_id = NLC_ID * 10000 + rank
+            file = str(cross_section_id) if rank % 2 else \
+                f"SelectedCrossSectionPointsNTLExt_SAMPLENAME___0000{cross_section_id}"
+            rows.append({"File": file, "Mu": rng.random(), "Sigma": rng.random(), "Pi": rng.random(),
+                         "Peak": rng.random(), "Span": rng.random(), "Status": FIT_OK, "NLC_ID": NLC_ID})
+    rows[3]["Status"] = FIT_NOT_CONVERGED
+    return pd.DataFrame(rows)
+
+
+def expected_averages(df):
+    fitted = df[df["Status"] == FIT_OK]
+    return fitted.groupby("NLC_ID")[["Mu", "Sigma", "Pi", "Peak", "Span"]].mean()
+
+
+def test_averages_are_grouped_by_polygon(tmp_path):
+    df = fit_results()
+    input_path = tmp_path / "fit_results.csv"
+    df.drop(columns="NLC_ID").to_csv(input_path, index=False)
+
+    acp.process_and_save_csv(str(input_path), str(tmp_path / "grouped.csv"), str(tmp_path / "grouped_skipna.csv"))
+    grouped = pd.read_csv(tmp_path / "grouped.csv").set_index("File")
+    expected = expected_averages(df)
+    assert grouped.index.tolist() == [7, 12, 123]
+    np.testing.assert_allclose(grouped[expected.columns].to_numpy(), expected.to_numpy())
+
+
+def test_streaming_averages_match():
+    df = fit_results()
+    averages = acp.PolygonAverages()
+    shuffled = df.drop(columns="NLC_ID").sample(frac=1, random_state=0)
+    for start in range(0, len(shuffled), 12):
+        averages.add(shuffled.iloc[start:start + 12])
+    mean = averages.mean()
+    expected = expected_averages(df)
+    assert mean.index.tolist() == [7, 12, 123]
+    np.testing.assert_allclose(mean[expected.columns].to_numpy(), expected.to_numpy())
+
+
+def test_files_without_cross_section_id_are_left_out():
+    files = pd.Series(["123450001", "notes", "X_00001230002"])
+    np.testing.assert_array_equal(acp.polygon_ids(files).to_numpy(), [12345, np.nan, 123])
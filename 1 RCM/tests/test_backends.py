@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import backends
+import CrossSection_BatchExtractRaster
+import CrossSection_BatchGeneration
+
+
+# Cross-sections of every polygon, and the points sampled along them, with one backend
+def cross_section_tables(backend, polygons, ntl, fa, workers=1):
+    results, errors = CrossSection_BatchGeneration.BatchGeneration(None, None, ntl, polygons, None, None,
+                                                                   backend=backend, workers=workers)
+    assert errors == []
+    lines = [line for NLC_ID in sorted(results) for line in results[NLC_ID][0]]
+    ids = np.concatenate([results[NLC_ID][1]["CrosSecID"] for NLC_ID in sorted(results)])
+    table = CrossSection_BatchExtractRaster.sample_cross_sections(backends.get_backend(backend), lines, ids, ntl, fa)
+    return results, table
+
+
+def assert_same_tables(first, second):
+    (first_results, first_table), (second_results, second_table) = first, second
+    assert sorted(first_results) == sorted(second_results)
+    for NLC_ID, (lines, columns) in first_results.items():
+        other_lines, other_columns = second_results[NLC_ID]
+        assert len(lines) == len(other_lines)
+        for line, other_line in zip(lines, other_lines):
+            np.testing.assert_allclose(line, other_line)
+        for field, values in columns.items():
+            np.testing.assert_allclose(np.asarray(values, dtype=float), np.asarray(other_columns[field], dtype=float),
+                                       err_msg=field)
+    assert sorted(first_table) == sorted(second_table)
+    for column, values in first_table.items():
+        np.testing.assert_allclose(values, second_table[column], equal_nan=True, err_msg=column)
+
+
+def test_opensource_tables_match_raster_cells(synthetic_inputs):
+    rasterio = pytest.importorskip("rasterio")
+    results, table = cross_section_tables("opensource", synthetic_inputs["polygons"], synthetic_inputs["ntl"],
+                                          synthetic_inputs["fa"])
+    assert sorted(results) == [1, 2, 3]
+    assert len(table["CrosSecID"]) > 0
+
+    # Each sampled value is the cell under the point, with NoData as NaN
+    with rasterio.open(synthetic_inputs["ntl"]) as source:
+        cells = source.read(1, masked=True).astype(float).filled(np.nan)
+        rows, columns = rasterio.transform.rowcol(source.transform, table["x"], table["y"])
+    np.testing.assert_array_equal(table["NTL"], cells[np.asarray(rows), np.asarray(columns)])
+
+
+def test_opensource_tables_do_not_depend_on_workers(synthetic_inputs):
+    inputs = synthetic_inputs["polygons"], synthetic_inputs["ntl"], synthetic_inputs["fa"]
+    assert_same_tables(cross_section_tables("opensource", *inputs), cross_section_tables("opensource", *inputs, 2))
+
+
+def test_backends_produce_same_tables(synthetic_inputs, tmp_path):
+    arcpy = pytest.importorskip("arcpy")
+    # Same polygons in a file geodatabase; both backends read the same GeoTIFF rasters
+    arcpy.management.CreateFileGDB(str(tmp_path), "inputs.gdb")
+    geodatabase_polygons = str(tmp_path / "inputs.gdb" / "polygons")
+    arcpy.management.CopyFeatures(synthetic_inputs["polygons"].replace("/polygons", "/main.polygons"),
+                                  geodatabase_polygons)
+
+    opensource = cross_section_tables("opensource", synthetic_inputs["polygons"], synthetic_inputs["ntl"],
+                                      synthetic_inputs["fa"])
+    arcgis = cross_section_tables("arcpy", geodatabase_polygons, synthetic_inputs["ntl"], synthetic_inputs["fa"])
+    assert_same_tables(opensource, arcgis)
+
+
+# Stand-in for arcpy recording the search cursors opened by ArcpyBackend, for the checks that need no geodatabase
+class RecordingArcpy:
+    def __init__(self, oid_field, rows):
+        self.cursors = []
+        self.env = SimpleNamespace()
+        self.da = SimpleNamespace(SearchCursor=self.search_cursor)
+        self.Describe = lambda dataset: SimpleNamespace(OIDFieldName=oid_field)
+        self.rows = rows
+
+    @contextmanager
+    def search_cursor(self, dataset, fields, sql_clause=(None, None)):
+        self.cursors.append((fields, sql_clause))
+        yield iter(self.rows)
+
+
+@pytest.mark.parametrize("id_field", ["OID@", "OBJECTID", "fid"])
+def test_arcpy_checksum_orders_by_the_oid_field_name(monkeypatch, id_field):
+    recording = RecordingArcpy("OBJECTID_1", [(1, b"\x01"), (2, b"\x02")])
+    monkeypatch.setattr(backends, "arcpy", recording)
+    backend = backends.ArcpyBackend()
+    checksum = backend.geometry_checksum("inputs.gdb/polygons", id_field)
+    assert recording.cursors == [(["OID@", "SHAPE@WKB"], (None, "ORDER BY OBJECTID_1"))]
+    assert checksum == backend.geometry_checksum("inputs.gdb/polygons", "OID@")
+
+    backend.geometry_checksum("inputs.gdb/polygons", "NLC_ID")
+    assert recording.cursors[-1] == (["NLC_ID", "SHAPE@WKB"], (None, "ORDER BY NLC_ID"))
+
+
+def test_arcpy_checksum_by_oid(synthetic_inputs, tmp_path):
+    arcpy = pytest.importorskip("arcpy")
+    arcpy.management.CreateFileGDB(str(tmp_path), "inputs.gdb")
+    geodatabase_polygons = str(tmp_path / "inputs.gdb" / "polygons")
+    arcpy.management.CopyFeatures(synthetic_inputs["polygons"].replace("/polygons", "/main.polygons"),
+                                  geodatabase_polygons)
+    backend = backends.ArcpyBackend()
+    checksum = backend.geometry_checksum(geodatabase_polygons, "OID@")
+    assert checksum == backend.geometry_checksum(geodatabase_polygons, "OBJECTID")
+    backend.update_field(geodatabase_polygons, "OID@", "Cluster", {3: 7})
+    assert backend.geometry_checksum(geodatabase_polygons, "OID@") == checksum
+
+
+def test_opensource_checksum_by_oid(synthetic_inputs):
+    backend = backends.get_backend("opensource")
+    checksum = backend.geometry_checksum(synthetic_inputs["polygons"], "OID@")
+    assert checksum == backend.geometry_checksum(synthetic_inputs["polygons"], "fid")
+    # Attribute updates keep the checksum
+    backend.update_field(synthetic_inputs["polygons"], "OID@", "Cluster", {3: 7})
+    assert backend.geometry_checksum(synthetic_inputs["polygons"], "OID@") == checksum
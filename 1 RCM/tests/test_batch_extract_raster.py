@@ -0,0 +1,47 @@
+import os
+import numpy as np
+import backends
+import CrossSection_BatchExtractRaster
+import CrossSection_BatchGeneration
+from cross_section_store import CrossSectionStore
+
+
+# Merged cross-section lines of the synthetic polygons, as written by the merge stage
+def merged_cross_sections(synthetic_inputs, tmp_path):
+    results, _ = CrossSection_BatchGeneration.BatchGeneration(None, None, synthetic_inputs["ntl"],
+                                                              synthetic_inputs["polygons"], None, None,
+                                                              backend="opensource")
+    lines = [line for NLC_ID in sorted(results) for line in results[NLC_ID][0]]
+    ids = np.concatenate([results[NLC_ID][1]["CrosSecID"] for NLC_ID in sorted(results)])
+    merged = f"{tmp_path}/merged.gpkg/cross_sections"
+    backends.get_backend("opensource").write_features(merged, "LineString", lines, {"CrosSecID": ids})
+    return merged
+
+
+def test_store_replaces_the_point_feature_classes(synthetic_inputs, tmp_path):
+    merged = merged_cross_sections(synthetic_inputs, tmp_path)
+    points_workspace, store_path = f"{tmp_path}/points.gpkg", f"{tmp_path}/store"
+
+    table = CrossSection_BatchExtractRaster.BatchExtractRaster(
+        merged, None, synthetic_inputs["ntl"], synthetic_inputs["fa"], points_workspace, backend="opensource",
+        store_path=store_path)
+    assert not os.path.exists(points_workspace)
+
+    store = CrossSectionStore(store_path)
+    sections = dict(store.iter_sections(["OBJECTID", "RASTERVALU", "BuildingFA"]))
+    assert sorted(sections) == sorted(set(table["CrosSecID"].tolist()))
+    for cross_section_id, columns in sections.items():
+        rows = table["CrosSecID"] == cross_section_id
+        np.testing.assert_array_equal(columns["OBJECTID"], table["point_index"][rows])
+        np.testing.assert_array_equal(columns["RASTERVALU"], table["NTL"][rows])
+        np.testing.assert_array_equal(columns["BuildingFA"], table["BuildingFA"][rows])
+
+
+def test_point_feature_classes_without_store(synthetic_inputs, tmp_path):
+    merged = merged_cross_sections(synthetic_inputs, tmp_path)
+    points_workspace = f"{tmp_path}/points.gpkg"
+
+    table = CrossSection_BatchExtractRaster.BatchExtractRaster(
+        merged, None, synthetic_inputs["ntl"], synthetic_inputs["fa"], points_workspace, backend="opensource")
+    layers = backends.get_backend("opensource").list_feature_classes(points_workspace)
+    assert len(layers) == 2 * len(set(table["CrosSecID"].tolist()))
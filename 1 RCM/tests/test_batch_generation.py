@@ -0,0 +1,46 @@
+import pytest
+import CrossSection_BatchGeneration
+from stage_cache import UnitCache
+
+
+def test_stale_error_report_is_removed(synthetic_inputs, tmp_path):
+    error_report = tmp_path / "generation_errors.csv"
+    error_report.write_text("NLC_ID,error,traceback\n1,old failure,\n")
+
+    results, errors = CrossSection_BatchGeneration.BatchGeneration(
+        None, None, synthetic_inputs["ntl"], synthetic_inputs["polygons"], None, None, backend="opensource",
+        error_report=str(error_report))
+    assert results and errors == []
+    assert not error_report.exists()
+
+
+def test_changed_and_deleted_polygons_leave_no_stale_outputs(synthetic_inputs, tmp_path):
+    fiona = pytest.importorskip("fiona")
+    output_gdb = str(tmp_path / "cross_sections.gpkg")
+    journal = str(tmp_path / "units.jsonl")
+
+    def run():
+        unit_cache = UnitCache(journal, "context")
+        CrossSection_BatchGeneration.BatchGeneration(
+            None, None, synthetic_inputs["ntl"], synthetic_inputs["polygons"], output_gdb, None,
+            backend="opensource", unit_cache=unit_cache)
+        return unit_cache
+
+    run()
+    assert set(fiona.listlayers(output_gdb)) == {"Sorted_polygons_1", "Sorted_polygons_2", "Sorted_polygons_3"}
+
+    # Polygon 1 moves off the raster (no cross-sections any more) and polygon 3 is deleted
+    gpkg, layer = synthetic_inputs["polygons"].rsplit("/", 1)
+    with fiona.open(gpkg, layer=layer) as source:
+        schema, crs, features = source.schema, source.crs, list(source)
+    moved = [(20000, 20000), (21000, 20000), (21000, 21000), (20000, 21000), (20000, 20000)]
+    records = [{"geometry": {"type": "Polygon", "coordinates": [moved]} if feature["properties"]["NLC_ID"] == 1
+                else feature["geometry"], "properties": dict(feature["properties"])}
+               for feature in features if feature["properties"]["NLC_ID"] != 3]
+    with fiona.open(gpkg, "w", driver="GPKG", layer=layer, schema=schema, crs=crs) as sink:
+        sink.writerecords(records)
+
+    unit_cache = run()
+    assert unit_cache.skipped == 1
+    assert fiona.listlayers(output_gdb) == ["Sorted_polygons_2"]
+    assert UnitCache(journal, "context").units() == {"1", "2"}
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from sklearn.datasets import make_blobs
+from sklearn.metrics import silhouette_samples, silhouette_score
+import cluster_metrics
+
+
+# Blobs with a share of points relabelled as DBSCAN noise (-1) and a singleton cluster
+def labelled_blobs(n=600, seed=0):
+    data, labels = make_blobs(n_samples=n, centers=4, cluster_std=1.5, random_state=seed)
+    rng = np.random.default_rng(seed)
+    labels[rng.choice(n, n // 10, replace=False)] = -1
+    labels[0] = 9
+    return data, labels
+
+
+@pytest.mark.parametrize("memory_bytes", [16 * 600 * 7, 16 * 600 * 64, cluster_metrics.DEFAULT_MEMORY_BYTES])
+def test_chunked_silhouette_matches_sklearn(memory_bytes):
+    data, labels = labelled_blobs()
+    # The smaller budgets split the 600 rows into blocks of 7 and 64 rows
+    values = cluster_metrics.silhouette_values(data, labels, memory_bytes=memory_bytes)
+    np.testing.assert_allclose(values, silhouette_samples(data, labels), atol=1e-10)
+
+    scores = cluster_metrics.silhouette(data, labels, memory_bytes=memory_bytes)
+    assert scores["silhouette"] == pytest.approx(silhouette_score(data, labels), abs=1e-10)
+    assert scores["ci_low"] == scores["ci_high"] == scores["silhouette"]
+    assert scores["sample_size"] == len(data)
+
+
+def test_sampled_rows_are_scored_against_all_points():
+    data, labels = labelled_blobs()
+    rows = np.random.default_rng(3).choice(len(data), 50, replace=False)
+    values = cluster_metrics.silhouette_values(data, labels, rows, memory_bytes=16 * 600 * 5)
+    np.testing.assert_allclose(values, silhouette_samples(data, labels)[rows], atol=1e-10)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_sampled_silhouette_estimates_the_exact_one(seed):
+    data, labels = labelled_blobs(n=2000, seed=seed)
+    exact = silhouette_score(data, labels)
+    scores = cluster_metrics.silhouette(data, labels, sample_size=400, memory_bytes=16 * 2000 * 50,
+                                        random_state=seed)
+    assert 400 <= scores["sample_size"] < 2000
+    assert scores["ci_low"] <= exact <= scores["ci_high"]
+    # At least as close to the exact silhouette as sklearn's estimate from a sample of the same size
+    sklearn_estimate = silhouette_score(data, labels, sample_size=400, random_state=seed)
+    assert abs(scores["silhouette"] - exact) <= max(abs(sklearn_estimate - exact), 0.02)
@@ -0,0 +1,27 @@
+import sqlite3
+from contextlib import closing
+import pytest
+import cluster_remaining
+
+
+def layer_rows(path):
+    with closing(sqlite3.connect(path)) as connection:
+        return connection.execute('SELECT fid, NLC_ID, Cluster FROM polygons ORDER BY fid').fetchall()
+
+
+def test_classify_remaining_polygons(synthetic_inputs):
+    pytest.importorskip("shapely")
+    cluster_remaining.classify_remaining_polygons(synthetic_inputs["polygons"], "Cluster", backend="opensource")
+    # Polygon 3 shares an edge with polygon 1 and a vertex with polygon 2: the tie goes to the smallest class
+    assert layer_rows(synthetic_inputs["polygons"][:-len("/polygons")]) == [(1, 1, 1), (2, 2, 2), (3, 3, 1)]
+
+
+def test_update_keeps_the_feature_ids(synthetic_inputs):
+    pytest.importorskip("shapely")
+    path = synthetic_inputs["polygons"][:-len("/polygons")]
+    # Leave a gap in the fids, which a rewrite of the layer would renumber
+    with closing(sqlite3.connect(path)) as connection, connection:
+        connection.execute('DELETE FROM polygons WHERE fid = 1')
+
+    cluster_remaining.classify_remaining_polygons(synthetic_inputs["polygons"], "Cluster", backend="opensource")
+    assert layer_rows(path) == [(2, 2, 2), (3, 3, 2)]
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from sklearn.datasets import make_blobs
+from sklearn.preprocessing import StandardScaler
+import clustering
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_permuted_labels_align_to_the_reference(seed):
+    rng = np.random.default_rng(seed)
+    reference = rng.integers(0, 4, 200)
+    permutation = rng.permutation(4)
+    assert np.array_equal(clustering.align_labels(permutation[reference], reference, 4), reference)
+
+    # With a few points moved to another cluster, the matching still maximizes the agreement
+    labels = permutation[reference]
+    moved = rng.choice(200, 10, replace=False)
+    labels[moved] = (labels[moved] + 1) % 4
+    aligned = clustering.align_labels(labels, reference, 4)
+    assert np.mean(aligned == reference) >= 0.95
+    assert np.array_equal(aligned[np.setdiff1d(np.arange(200), moved)],
+                          reference[np.setdiff1d(np.arange(200), moved)])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_consensus_is_stable_on_separated_blobs(workers):
+    data, truth = make_blobs(n_samples=300, centers=[(-10, -10), (0, 10), (10, -10)], cluster_std=0.5,
+                             random_state=0)
+    data = StandardScaler().fit_transform(data)
+    labels, stability, votes = clustering.consensus_kmeans(data, 3, iterations=8, workers=workers)
+    assert np.all(stability == 1.0)
+    assert np.array_equal(votes.sum(axis=1), np.full(len(data), 8))
+    # One consensus cluster per blob
+    assert np.array_equal(clustering.align_labels(labels, truth, 3), truth)
+
+
+def test_knee_point_of_an_elbow_curve():
+    k = list(range(1, 11))
+    inertia = [100, 40, 15, 12, 10, 9, 8, 7, 6, 5]
+    assert clustering.knee_point(k, inertia) == 3
+    # Scaling either axis does not move the knee
+    assert clustering.knee_point(k, [1000 * value for value in inertia]) == 3
+
+
+def test_knee_point_of_a_flat_or_short_curve():
+    assert clustering.knee_point([1, 2, 3, 4], [5.0, 5.0, 5.0, 5.0]) == 1
+    assert clustering.knee_point([2, 3], [10.0, 4.0]) == 2
+
+
+# Replaces the fitting and scoring of the candidates with fixed scores: inertia by k, silhouette by DBSCAN eps
+def fixed_scores(monkeypatch, inertia, silhouettes):
+    def score_candidate(data, method, params, silhouette_sample, memory_bytes):
+        if method == "kmeans":
+            return {"method": method, **params, "inertia": inertia[params["k"]], "silhouette": None}
+        return {"method": method, **params, "silhouette": silhouettes[params["eps"]]}
+    monkeypatch.setattr(clustering, "score_candidate", score_candidate)
+
+
+def test_select_model_keeps_two_clusters_on_a_flat_curve(monkeypatch):
+    fixed_scores(monkeypatch, {k: 7.0 for k in range(1, 6)}, {0.5: None})
+    report = clustering.select_model(np.zeros((20, 2)), k_values=range(1, 6))
+    assert report["k"] == 2
+
+
+def test_select_model_ranks_dbscan_by_silhouette(monkeypatch):
+    inertia = {k: 100.0 / k for k in range(1, 6)}
+    data = np.zeros((20, 2))
+
+    # A real silhouette of 0.0 beats negative ones and candidates without a silhouette
+    fixed_scores(monkeypatch, inertia, {0.1: None, 0.2: -0.4, 0.3: 0.0, 0.4: -0.1})
+    report = clustering.select_model(data, k_values=range(1, 6), dbscan_eps=(0.1, 0.2, 0.3, 0.4))
+    assert report["dbscan"] == {"eps": 0.3, "min_samples": 5}
+
+    fixed_scores(monkeypatch, inertia, {0.1: None, 0.2: -0.4})
+    report = clustering.select_model(data, k_values=range(1, 6), dbscan_eps=(0.1, 0.2))
+    assert report["dbscan"]["eps"] == 0.2
+
+    # Without any silhouette, the first candidate is kept
+    fixed_scores(monkeypatch, inertia, {0.1: None, 0.2: None})
+    report = clustering.select_model(data, k_values=range(1, 6), dbscan_eps=(0.1, 0.2))
+    assert report["dbscan"]["eps"] == 0.1
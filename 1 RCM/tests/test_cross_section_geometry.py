@@ -0,0 +1,64 @@
+from collections import Counter
+import numpy as np
+import pytest
+import cross_section_geometry as geometry
+
+
+# Star-shaped random polygon around (cx, cy)
+def random_ring(rng, cx=0.0, cy=0.0, vertices=12, radius=1000.0):
+    angles = np.sort(rng.uniform(0, 2 * np.pi, vertices))
+    radii = radius * rng.uniform(0.4, 1.0, vertices)
+    return np.column_stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)])
+
+
+# Pairs of boundary points whose sight line crosses a box, by testing every pair
+def brute_force_pairs(points, boxes):
+    observers, targets = geometry.sight_lines(points)
+    crosses = np.zeros(len(observers), dtype=bool)
+    for box in boxes:
+        crosses |= geometry.segments_intersect_box(points[observers], points[targets], box)
+    return set(zip(observers[crosses].tolist(), targets[crosses].tolist()))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_candidate_pairs_contain_every_crossing_pair(seed):
+    rng = np.random.default_rng(seed)
+    points = geometry.boundary_points([random_ring(rng)], 60)
+    boxes = [(x, y, x + 100, y + 100) for x, y in rng.uniform(-400, 300, (rng.integers(1, 4), 2))]
+
+    observers, targets = geometry.candidate_sight_line_pairs(points, boxes)
+    order = observers * len(points) + targets
+    assert np.all(np.diff(order) > 0)
+    assert np.all(observers != targets)
+    assert brute_force_pairs(points, boxes) <= set(zip(observers.tolist(), targets.tolist()))
+
+
+def test_point_near_the_boxes_does_not_widen_every_window():
+    rng = np.random.default_rng(0)
+    points = geometry.boundary_points([random_ring(rng, radius=20000)], 100)
+    # One boundary point next to a small central box (delta close to pi)
+    points = np.vstack([points, [[60.0, 60.0]]])
+    boxes = [(0.0, 0.0, 100.0, 100.0)]
+
+    observers, targets = geometry.candidate_sight_line_pairs(points, boxes)
+    assert brute_force_pairs(points, boxes) <= set(zip(observers.tolist(), targets.tolist()))
+    assert len(observers) < 0.1 * len(points) * (len(points) - 1)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_pruned_cross_sections_match_all_pairs(seed):
+    rng = np.random.default_rng(seed)
+    rings = [random_ring(rng, 500, -500)]
+    transform = (-500.0, 100.0, 0.0, 500.0, 0.0, -100.0)
+    values = rng.random((10, 10))
+    values[rng.integers(0, 10, 2), rng.integers(0, 10, 2)] = 2.0
+
+    stats = Counter()
+    pruned = geometry.generate_cross_sections(rings, values, transform, 7, distance=50, keep_buckets=None,
+                                              stats=stats)
+    full = geometry.generate_cross_sections(rings, values, transform, 7, distance=50, keep_buckets=None,
+                                            prune=False)
+    np.testing.assert_array_equal(pruned[0], full[0])
+    for field in full[1]:
+        np.testing.assert_array_equal(pruned[1][field], full[1][field])
+    assert stats['pruned'] > 0
@@ -0,0 +1,73 @@
+import warnings
+import numpy as np
+import pytest
+import CrossSection_curvefitting as cf
+
+
+# Fitted (pi, mu, |sigma|): the model only depends on sigma squared, so fits can differ in the sign of sigma
+def unsigned(params):
+    return np.append(np.asarray(params, dtype=float)[:2], abs(params[2]))
+
+
+# Noisy normal profiles of different lengths, with a few NoData points
+def gaussian_sections(count, seed=0):
+    rng = np.random.default_rng(seed)
+    sections = []
+    for _ in range(count):
+        x = np.arange(1, rng.integers(12, 40) + 1, dtype=float)
+        y = cf.normal_distribution(x, rng.uniform(5, 80), rng.uniform(0.3, 0.7) * x[-1], rng.uniform(1.5, 6))
+        y += rng.normal(0, 0.3, len(x))
+        y[rng.random(len(x)) < 0.1] = np.nan
+        sections.append((x, y))
+    return sections
+
+
+# Profile whose normal matrix overflows, so the damping overflows before any step is accepted
+def overflowing_section():
+    x = np.arange(1, 21, dtype=float)
+    return x, cf.normal_distribution(x, 1e200, 9, 3)
+
+
+def test_batch_matches_fit_data():
+    sections = gaussian_sections(60)
+    params, converged = cf.fit_data_batch(sections)
+    assert converged.all()
+    for (x, y), batch_params in zip(sections, params):
+        np.testing.assert_allclose(unsigned(batch_params), unsigned(cf.fit_data(x, y)), rtol=1e-5)
+
+
+def test_damping_overflow_is_not_converged():
+    sections = gaussian_sections(3) + [overflowing_section()]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        params, converged = cf.fit_data_batch(sections)
+    assert converged.tolist() == [True, True, True, False]
+    assert np.isnan(params[3]).all()
+
+
+@pytest.mark.parametrize("batched", [True, False])
+def test_fit_sections_status_codes(batched):
+    x = np.arange(1, 16, dtype=float)
+    good = gaussian_sections(2, seed=1)
+    sections = good + [(x, np.full(len(x), np.nan)),
+                       (x, np.where(x < 3, 5.0, np.nan)),
+                       None]
+    files = ["ok_1", "ok_2", "no_data", "two_points", "unreadable"]
+    if batched:
+        sections.append(overflowing_section())
+        files.append("overflow")
+
+    results, errors = cf.fit_sections(files, sections, batched=batched)
+    frame = results.to_frame()
+    expected = [cf.FIT_OK, cf.FIT_OK, cf.FIT_NO_DATA, cf.FIT_INSUFFICIENT_POINTS, cf.FIT_ERROR]
+    if batched:
+        expected.append(cf.FIT_NOT_CONVERGED)
+    assert frame["File"].tolist() == files
+    assert frame["Status"].tolist() == expected
+    assert errors == []
+
+    fitted = frame[frame["Status"] == cf.FIT_OK]
+    for (x_good, y_good), (_, row) in zip(good, fitted.iterrows()):
+        np.testing.assert_allclose(unsigned([row["Pi"], row["Mu"], row["Sigma"]]),
+                                   unsigned(cf.fit_data(x_good, y_good)), rtol=1e-5)
+    assert frame.loc[frame["Status"] != cf.FIT_OK, ["Mu", "Sigma", "Pi"]].isna().all().all()
@@ -0,0 +1,37 @@
+import os
+import pickle
+import numpy as np
+import pytest
+import raster_cache
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_copy_of_the_preprocessing_folder_is_identical():
+    copy = os.path.join(os.path.dirname(PROJECT), "2 HRSM", "2.1 Data preprocessing", "raster_cache.py")
+    with open(os.path.join(PROJECT, "raster_cache.py"), "rb") as original, open(copy, "rb") as copied:
+        assert original.read().replace(b"\r\n", b"\n") == copied.read().replace(b"\r\n", b"\n")
+
+
+def test_rasterio_source_keeps_one_dataset_open(synthetic_inputs, monkeypatch):
+    rasterio = pytest.importorskip("rasterio")
+    opened = []
+    real_open = rasterio.open
+    monkeypatch.setattr(raster_cache.rasterio, "open", lambda path: opened.append(path) or real_open(path))
+
+    source = raster_cache.RasterioRasterSource(synthetic_inputs["ntl"])
+    cached_raster = raster_cache.CachedRaster(source, raster_cache.TileCache(0), tile_size=16)
+    window = cached_raster.read_window(0, 60, 0, 80)
+    assert len(opened) == 1
+
+    with real_open(synthetic_inputs["ntl"]) as dataset:
+        expected = dataset.read(1, masked=True).astype(np.float64).filled(np.nan)
+    np.testing.assert_array_equal(window, expected)
+
+    # A copy sent to another process opens its own dataset
+    copy = pickle.loads(pickle.dumps(source))
+    assert copy.dataset is None
+    np.testing.assert_array_equal(copy.read_block(0, 16, 0, 16), expected[:16, :16])
+    assert len(opened) == 2
+    source.close()
+    copy.close()
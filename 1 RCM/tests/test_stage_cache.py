@@ -0,0 +1,25 @@
+from stage_cache import StageRunner
+
+
+def test_lock_files_do_not_change_the_digest(tmp_path):
+    gdb = tmp_path / "inputs.gdb"
+    gdb.mkdir()
+    (gdb / "a00000001.gdbtable").write_bytes(b"table")
+    runner = StageRunner(str(tmp_path / "manifest.json"))
+    digest = runner.path_digest(str(gdb / "polygons"))
+
+    # ArcGIS creates lock files while the geodatabase is open
+    (gdb / "_gdb.host.1234.5678.sr.lock").write_bytes(b"")
+    (gdb / "a00000001.host.1234.5678.rd.lock").write_bytes(b"")
+    assert runner.path_digest(str(gdb / "polygons")) == digest
+
+    (gdb / "a00000001.gdbtable").write_bytes(b"table changed")
+    assert runner.path_digest(str(gdb / "polygons")) != digest
+
+
+def test_lock_files_are_left_out_of_patterns(tmp_path):
+    (tmp_path / "fit_results.csv").write_text("File\n1\n")
+    runner = StageRunner(None)
+    digest = runner.path_digest(str(tmp_path / "*"))
+    (tmp_path / "fit_results.csv.lock").write_text("")
+    assert runner.path_digest(str(tmp_path / "*")) == digest
@@ -12,9 +12,19 @@ raster1 = "Sample_NTL"
 # Reference building stock raster layer
 raster2 = "Sample_WSF3D_V02_BuildingFloorArea_all_64b"
 
+# Zonal statistics written to the fishnet as <prefix>_<statistic> fields: prefix -> (raster, statistics), where the
+# statistics are any of MEAN, SUM, COUNT, MIN, MAX and STD (every raster is read once whatever is requested)
+zonal_statistics = {
+    "NTL": (raster1, ["MEAN"]),
+    "Floor": (raster2, ["SUM"])
+}
+
 # Intermediate output: fishnet with extracted raster values/edge detection filter calculation
 output_layer_1 = "Fishnet_extract_NTL_Floor"
 output_layer_2 = "Fishnet_kernel_filter"
 
 # User can specify the path and name of the exported CSV file here
-csv_output_path = "D:/Sample_fishnet_Suburban_Training.csv"
\ No newline at end of file
+csv_output_path = "D:/Sample_fishnet_Suburban_Training.csv"
+
+# Optional columnar copy of the kernel filter features (.parquet/.feather/.csv, NPZ fallback); set to None to skip
+feature_table_output_path = "D:/Sample_fishnet_Suburban_Training.parquet"
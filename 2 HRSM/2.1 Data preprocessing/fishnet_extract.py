@@ -1,6 +1,31 @@
-import arcpy
-from arcpy.sa import ZonalStatisticsAsTable
-from config import workspace, scratch_workspace, original_fishnet_layer, raster1, raster2, output_layer_1
+from functools import lru_cache
+import numpy as np
+import raster_cache
+from config import workspace, scratch_workspace, original_fishnet_layer, zonal_statistics, output_layer_1
+
+try:
+    import arcpy
+except ImportError:
+    # arcpy is only needed for the geodatabase workflow in main(); calculate_zonal_statistics() runs without it
+    arcpy = None
+
+try:
+    from rasterio.crs import CRS
+except ImportError:
+    # rasterio is only needed to compare the coordinate systems of GeoTIFF rasters without arcpy
+    CRS = None
+
+# Statistics computed for every raster by calculate_zonal_statistics
+ZONAL_STATISTICS = ['MEAN', 'SUM', 'COUNT', 'MIN', 'MAX', 'STD']
+
+# Fields written to the fishnet by main(): "<prefix>_<statistic>" for every raster and statistic of
+# config.zonal_statistics (e.g. NTL_MEAN, Floor_SUM)
+ZONAL_FIELDS = [f"{prefix}_{statistic}" for prefix, (_, statistics) in zonal_statistics.items()
+                for statistic in statistics]
+
+# Longest letter/digit parts of a PageName that still fit the int64 rowID/columnID
+MAX_PAGE_LETTERS = 13
+MAX_PAGE_DIGITS = 18
 
 # Copy input layer to output layer
 def copy_features(input_layer, output_layer):
@@ -17,12 +42,303 @@ def delete_field_if_exists(dataset, field_name):
         arcpy.DeleteField_management(dataset, field_name)
 
 # Calculate line numbers from PAGE letters
+@lru_cache(maxsize=None)
 def calculate_row(letters):
     row = 0
     for i, letter in enumerate(reversed(letters)):
         row += (26 ** i) * (ord(letter.upper()) - ord('A') + 1)
     return row
 
+# Parse a whole PageName column into rowID/columnID arrays
+def parse_page_names(page_names):
+    """
+    Bulk counterpart of calculate_row and the digit extraction: a PageName is letters followed by digits (e.g. "AB12"
+    gives rowID 28 and columnID 12, letters are case-insensitive). The names are parsed as a code-point matrix, with
+    the base-26 letters and the decimal digits accumulated column by column over the whole array.
+
+    Parameters:
+    page_names (array-like): PageName values.
+
+    Returns:
+    tuple: (row_ids, column_ids, malformed), int64 arrays of rowID and columnID and a boolean array flagging the names
+    that are not letters followed by digits (None, empty, "12", "A", "A1B", ...), whose rowID/columnID are 0.
+    """
+    names = np.asarray(page_names, dtype=object).astype(str)
+    # One code point per column, with a trailing zero column so every name ends with padding
+    width = names.dtype.itemsize // 4
+    codes = np.zeros((len(names), width + 1), dtype=np.uint32)
+    codes[:, :width] = names.view(np.uint32).reshape(len(names), width)
+
+    lower = codes | 0x20
+    is_letter = (lower >= ord('a')) & (lower <= ord('z'))
+    is_digit = (codes >= ord('0')) & (codes <= ord('9'))
+    letter_count = np.argmin(is_letter, axis=1)
+    length = np.argmax(codes == 0, axis=1)
+
+    positions = np.arange(width + 1)
+    in_digits = (positions >= letter_count[:, None]) & (positions < length[:, None])
+    digit_count = length - letter_count
+    malformed = (letter_count == 0) | (digit_count == 0) | ~(is_digit | ~in_digits).all(axis=1)
+    malformed |= (letter_count > MAX_PAGE_LETTERS) | (digit_count > MAX_PAGE_DIGITS)
+
+    row_ids = np.zeros(len(names), dtype=np.int64)
+    column_ids = np.zeros(len(names), dtype=np.int64)
+    for position in range(width):
+        in_letters = position < letter_count
+        row_ids = np.where(in_letters, row_ids * 26 + (lower[:, position].astype(np.int64) - ord('a') + 1), row_ids)
+        column_ids = np.where(in_digits[:, position],
+                              column_ids * 10 + (codes[:, position].astype(np.int64) - ord('0')), column_ids)
+
+    row_ids[malformed] = 0
+    column_ids[malformed] = 0
+    return row_ids, column_ids, malformed
+
+# Read the zone polygons of a layer as lists of (n, 2) ring arrays
+def read_zones(layer, zone_field):
+    zone_ids, polygons = [], []
+    with arcpy.da.SearchCursor(layer, [zone_field, "SHAPE@"]) as cursor:
+        for zone_id, shape_geometry in cursor:
+            rings = []
+            for part in shape_geometry:
+                ring = []
+                for point in part:
+                    # Rings of a part are separated by None
+                    if point is None:
+                        rings.append(np.array(ring))
+                        ring = []
+                    else:
+                        ring.append((point.X, point.Y))
+                if ring:
+                    rings.append(np.array(ring))
+            zone_ids.append(zone_id)
+            polygons.append(rings)
+    return zone_ids, polygons
+
+# Open a raster for windowed reads, through arcpy when available and rasterio otherwise
+def open_raster_source(raster):
+    if arcpy is not None:
+        return raster_cache.ArcpyRasterSource(raster)
+    return raster_cache.RasterioRasterSource(raster)
+
+# Test which points fall inside a polygon (even-odd rule over all rings, so holes are excluded)
+def points_in_polygon(x, y, rings):
+    inside = np.zeros(x.shape, dtype=bool)
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+            if y1 == y2:
+                continue
+            crosses = (y1 > y) != (y2 > y)
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= crosses & (x < x_cross)
+    return inside
+
+# Cell window of each zone polygon on the grid of a raster
+def zone_windows(polygons, transform, raster_shape):
+    """
+    Parameters:
+    polygons (list): Zone polygons, each a list of (n, 2) ring arrays.
+    transform (tuple): GDAL-style geotransform (x origin, cell width, 0, y origin, 0, -cell height) of the raster.
+    raster_shape (tuple): (rows, columns) of the raster.
+
+    Returns:
+    numpy.ndarray: (n, 4) int64 array of (row_start, row_stop, column_start, column_stop) per polygon, clipped to the
+    raster (empty windows for polygons outside it).
+    """
+    x_origin, cell_width, _, y_origin, _, cell_height = transform
+    polygon_bounds = np.array([[min(ring[:, 0].min() for ring in rings), min(ring[:, 1].min() for ring in rings),
+                                max(ring[:, 0].max() for ring in rings), max(ring[:, 1].max() for ring in rings)]
+                               for rings in polygons]).reshape(-1, 4)
+    column_bounds = (polygon_bounds[:, [0, 2]] - x_origin) / cell_width
+    row_bounds = (polygon_bounds[:, [1, 3]] - y_origin) / cell_height
+    windows = np.column_stack([np.floor(row_bounds.min(axis=1)), np.ceil(row_bounds.max(axis=1)),
+                               np.floor(column_bounds.min(axis=1)), np.ceil(column_bounds.max(axis=1))])
+    windows = np.clip(windows, 0, [raster_shape[0], raster_shape[0], raster_shape[1], raster_shape[1]])
+    return windows.astype(np.int64).reshape(-1, 4)
+
+# Tile-aligned blocks of a raster touched by the zone windows, with the zones overlapping each block
+def block_zones(windows, raster_shape, tile_size):
+    """
+    Yields:
+    tuple: (block, zones), the (row_start, row_stop, column_start, column_stop) of a block and the indices of the
+    zones whose window overlaps it in increasing order. Blocks without zones are skipped.
+    """
+    zones = np.flatnonzero((windows[:, 1] > windows[:, 0]) & (windows[:, 3] > windows[:, 2]))
+    r0, r1, c0, c1 = (windows[zones, k] for k in range(4))
+    first_row, first_column = r0 // tile_size, c0 // tile_size
+    block_rows, block_columns = (r1 - 1) // tile_size - first_row + 1, (c1 - 1) // tile_size - first_column + 1
+
+    # One (zone, block) pair per block of each zone window (a single block for most fishnet cells)
+    counts = block_rows * block_columns
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_zones = np.repeat(zones, counts)
+    pair_rows = np.repeat(first_row, counts) + offsets // np.repeat(block_columns, counts)
+    pair_columns = np.repeat(first_column, counts) + offsets % np.repeat(block_columns, counts)
+
+    keys = pair_rows * (raster_shape[1] // tile_size + 1) + pair_columns
+    order = np.argsort(keys, kind='stable')
+    boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+    for group in np.split(order, boundaries):
+        if len(group) == 0:
+            continue
+        block_row, block_column = pair_rows[group[0]] * tile_size, pair_columns[group[0]] * tile_size
+        block = (block_row, min(block_row + tile_size, raster_shape[0]),
+                 block_column, min(block_column + tile_size, raster_shape[1]))
+        yield block, pair_zones[group]
+
+# Rasterize the zone polygons overlapping a block to a label array of the block
+def rasterize_block(polygons, zones, windows, transform, block):
+    """
+    A cell belongs to the zone whose polygon contains its centre, as when ZonalStatisticsAsTable converts the zones
+    to the value raster's cells (the last of overlapping zones wins). Only the block is allocated, so memory does not
+    grow with the extent of the zones.
+
+    Parameters:
+    polygons (list): Zone polygons, each a list of (n, 2) ring arrays.
+    zones (numpy.ndarray): Indices of the zones overlapping the block (see block_zones).
+    windows (numpy.ndarray): Cell window of every zone (see zone_windows).
+    transform (tuple): GDAL-style geotransform of the raster.
+    block (tuple): (row_start, row_stop, column_start, column_stop) of the block.
+
+    Returns:
+    numpy.ndarray: Zone index of each cell of the block (-1 outside the zones).
+    """
+    x_origin, cell_width, _, y_origin, _, cell_height = transform
+    row_start, row_stop, column_start, column_stop = block
+    labels = np.full((row_stop - row_start, column_stop - column_start), -1, dtype=np.int32)
+
+    for zone in zones:
+        r0, r1 = max(windows[zone, 0], row_start), min(windows[zone, 1], row_stop)
+        c0, c1 = max(windows[zone, 2], column_start), min(windows[zone, 3], column_stop)
+        if r1 <= r0 or c1 <= c0:
+            continue
+        rows, columns = np.mgrid[r0:r1, c0:c1]
+        inside = points_in_polygon(x_origin + (columns + 0.5) * cell_width, y_origin + (rows + 0.5) * cell_height,
+                                   polygons[zone])
+        labels[r0 - row_start:r1 - row_start, c0 - column_start:c1 - column_start][inside] = zone
+
+    return labels
+
+# Compare two coordinate systems, given as arcpy SpatialReference objects or anything rasterio's CRS accepts
+def same_crs(first, second):
+    if hasattr(first, "exportToString"):
+        if first.factoryCode and second.factoryCode:
+            return first.factoryCode == second.factoryCode
+        return first.exportToString() == second.exportToString()
+    return CRS.from_user_input(first) == CRS.from_user_input(second)
+
+# Running per-zone count, sum, sum of squares, minimum and maximum of a raster
+class ZonalAccumulator:
+    """
+    Accumulates the statistics of each zone block by block with bincount reductions, so a raster is read once
+    whatever statistics are requested. NoData (NaN) cells are skipped, as with the "DATA" option of
+    ZonalStatisticsAsTable.
+    """
+
+    def __init__(self, zone_count):
+        self.count = np.zeros(zone_count, dtype=np.int64)
+        self.total = np.zeros(zone_count)
+        self.squares = np.zeros(zone_count)
+        self.minimum = np.full(zone_count, np.inf)
+        self.maximum = np.full(zone_count, -np.inf)
+
+    def add(self, labels, values):
+        labels, values = labels.ravel(), values.ravel()
+        valid = (labels >= 0) & ~np.isnan(values)
+        labels, values = labels[valid], values[valid]
+        zone_count = len(self.count)
+
+        self.count += np.bincount(labels, minlength=zone_count)
+        self.total += np.bincount(labels, weights=values, minlength=zone_count)
+        self.squares += np.bincount(labels, weights=values * values, minlength=zone_count)
+        np.minimum.at(self.minimum, labels, values)
+        np.maximum.at(self.maximum, labels, values)
+
+    def statistics(self):
+        """Return a dict mapping each of ZONAL_STATISTICS to its per-zone values (NaN for zones without data)."""
+        has_data = self.count > 0
+        count = np.where(has_data, self.count, 1)
+        mean = self.total / count
+        variance = np.maximum(self.squares / count - mean * mean, 0)
+        return {
+            'MEAN': np.where(has_data, mean, np.nan),
+            'SUM': np.where(has_data, self.total, np.nan),
+            'COUNT': self.count.copy(),
+            'MIN': np.where(has_data, self.minimum, np.nan),
+            'MAX': np.where(has_data, self.maximum, np.nan),
+            'STD': np.where(has_data, np.sqrt(variance), np.nan)
+        }
+
+# Zonal statistics of several rasters over the same zones, in one streaming pass per raster grid
+def calculate_zonal_statistics(zone_ids, polygons, rasters, zone_field="PageName",
+                               tile_size=raster_cache.DEFAULT_TILE_SIZE, zone_crs=None):
+    """
+    Replaces one ZonalStatisticsAsTable call and one JoinField per raster and statistic. The rasters are streamed
+    tile by tile (rasters sharing a grid together), the zones overlapping each tile are rasterized for that tile only
+    and every raster is fed to a ZonalAccumulator, so every statistic of ZONAL_STATISTICS comes out of a single read
+    of the raster and memory stays bounded by the tile size.
+
+    Parameters:
+    zone_ids (list): Zone key of each polygon (e.g. PageName).
+    polygons (list): Zone polygons, each a list of (n, 2) ring arrays.
+    rasters (dict): Field prefix -> raster path, e.g. {"NTL": "Sample_NTL"}.
+    zone_field (str): Name of the key column in the returned table.
+    tile_size (int): Edge of the tiles read at a time, in cells.
+    zone_crs: Coordinate system of the polygons (arcpy SpatialReference, WKT, EPSG code, ...). Every raster must be
+              in it, otherwise a ValueError is raised; None skips the check.
+
+    Returns:
+    dict: Table keyed by zone_field, with a "<prefix>_<statistic>" column for every raster and statistic.
+    """
+    # Open every raster and group them by grid, so the zones are rasterized once per block of each grid
+    grids = {}
+    for prefix, raster in rasters.items():
+        source = open_raster_source(raster)
+        if zone_crs is not None and (source.crs is None or not same_crs(zone_crs, source.crs)):
+            source.close()
+            raise ValueError(f"Raster '{raster}' is not in the coordinate system of the zones; project the raster or "
+                             f"the fishnet first.")
+        grids.setdefault((tuple(source.transform), tuple(source.shape)), []).append((prefix, source))
+
+    accumulators = {}
+    for (transform, raster_shape), grid_rasters in grids.items():
+        # Each tile is read once, so the caches only need to hold the current one
+        cached_rasters = [raster_cache.CachedRaster(source, raster_cache.TileCache(0), tile_size)
+                          for _, source in grid_rasters]
+        for prefix, _ in grid_rasters:
+            accumulators[prefix] = ZonalAccumulator(len(zone_ids))
+
+        windows = zone_windows(polygons, transform, raster_shape)
+        for block, zones in block_zones(windows, raster_shape, tile_size):
+            labels = rasterize_block(polygons, zones, windows, transform, block)
+            for (prefix, _), cached_raster in zip(grid_rasters, cached_rasters):
+                accumulators[prefix].add(labels, cached_raster.read_window(*block))
+
+        for _, source in grid_rasters:
+            source.close()
+
+    table = {zone_field: np.asarray(zone_ids)}
+    for prefix in rasters:
+        for statistic, values in accumulators[prefix].statistics().items():
+            table[f"{prefix}_{statistic}"] = values
+    return table
+
+# Write zonal statistics columns to the layer by zone key (zones without data are left NULL)
+def write_zonal_fields(layer, zone_field, table, fields):
+    zone_index = {zone_id: i for i, zone_id in enumerate(table[zone_field])}
+    for field in fields:
+        if not field_exists(layer, field):
+            arcpy.AddField_management(layer, field, "LONG" if field.endswith("_COUNT") else "DOUBLE")
+
+    with arcpy.da.UpdateCursor(layer, [zone_field] + fields) as cursor:
+        for row in cursor:
+            i = zone_index.get(row[0])
+            if i is None:
+                continue
+            for j, field in enumerate(fields, start=1):
+                value = table[field][i]
+                row[j] = None if np.isnan(value) else value.item()
+            cursor.updateRow(row)
+
 # The main function that executes the entire workflow
 def main():
     # Enable the overwrite existing dataset option
@@ -37,18 +353,15 @@ def main():
     copy_features(original_fishnet_layer, copied_fishnet_layer)
     fishnet_layer = copied_fishnet_layer
 
-    # Define the intermediate output table
-    out_table1 = "zonal_mean_table"
-    out_table2 = "zonal_sum_table"
-
-    # Perform zonal statistics and generate statistics table
-    ZonalStatisticsAsTable(fishnet_layer, "PageName", raster1, out_table1, "DATA", "MEAN")
-    ZonalStatisticsAsTable(fishnet_layer, "PageName", raster2, out_table2, "DATA", "SUM")
+    # Rasterize the PageName zones once and compute the statistics of every raster in one pass per raster
+    zone_ids, polygons = read_zones(fishnet_layer, "PageName")
+    rasters = {prefix: raster for prefix, (raster, _) in zonal_statistics.items()}
+    table = calculate_zonal_statistics(zone_ids, polygons, rasters,
+                                       zone_crs=arcpy.Describe(fishnet_layer).spatialReference)
     print("Zonal Statistics completed.")
 
-    # Join the statistics table to the Fishnet layer using PageName key
-    arcpy.JoinField_management(fishnet_layer, "PageName", out_table1, "PageName", ["MEAN"])
-    arcpy.JoinField_management(fishnet_layer, "PageName", out_table2, "PageName", ["SUM"])
+    # Write the requested statistics to the Fishnet layer using PageName key (e.g. NTL_MEAN, Floor_SUM)
+    write_zonal_fields(fishnet_layer, "PageName", table, ZONAL_FIELDS)
     print("Fields joined.")
 
     # Add new field of columnID/rowID if field does not exist
@@ -59,31 +372,29 @@ def main():
         arcpy.AddField_management(fishnet_layer, "rowID", "LONG")
         print("Added 'rowID' field.")
 
-    # Use UpdateCursor to calculate the value of rowID and columnID
+    # Parse all PageNames at once; malformed names get NULL rowID/columnID instead of 0
+    row_ids, column_ids, malformed = parse_page_names(zone_ids)
+    if malformed.any():
+        examples = ", ".join(repr(zone_ids[i]) for i in np.flatnonzero(malformed)[:5])
+        print(f"Warning: {malformed.sum()} malformed PageName value(s), rowID/columnID left NULL (e.g. {examples}).")
+    page_index = {page_name: i for i, page_name in enumerate(zone_ids)}
+
+    # Use UpdateCursor to write the value of rowID and columnID
     with arcpy.da.UpdateCursor(fishnet_layer, ["PageName", "rowID", "columnID"]) as cursor:
         for row in cursor:
-            page_name = row[0]
-            letters = ''.join(filter(str.isalpha, page_name))
-            numbers = ''.join(filter(str.isdigit, page_name))
-
-            row[1] = calculate_row(letters)  # Calculate rowID
-            row[2] = int(numbers) if numbers else 0  # Extract and convert columnID
-
+            i = page_index[row[0]]
+            if malformed[i]:
+                row[1], row[2] = None, None
+            else:
+                row[1], row[2] = int(row_ids[i]), int(column_ids[i])
             cursor.updateRow(row)
     print("Updated cursor.")
 
-    # Change field name and alias
-    arcpy.AlterField_management(fishnet_layer, "MEAN", "NTL_MEAN", "NTL_MEAN")
-    arcpy.AlterField_management(fishnet_layer, "SUM", "Floor_SUM", "Floor_SUM")
-    print("Fields altered.")
-
     # Export the integrated fishnet layer
     arcpy.CopyFeatures_management(fishnet_layer, output_layer_1)
     print(f"Output layer created: {output_layer_1}")
 
     # Cleaning up intermediates
-    arcpy.Delete_management(out_table1)
-    arcpy.Delete_management(out_table2)
     arcpy.Delete_management(fishnet_layer)
     print("Intermediate outputs deleted.")
 
@@ -1,6 +1,48 @@
-import arcpy
+import os
 import math
-from config import workspace, output_layer_1, output_layer_2, csv_output_path
+import numpy as np
+from config import workspace, output_layer_1, output_layer_2, csv_output_path, feature_table_output_path
+from fishnet_extract import ZONAL_FIELDS
+
+try:
+    import arcpy
+except ImportError:
+    # arcpy is only needed for the geodatabase workflow in main(); kernel_filter_table() runs without it
+    arcpy = None
+
+# Kernel filter fields derived from NTL_MEAN
+KERNEL_FIELDS = [
+    'NTL_MEAN_Convolution_3x3',
+    'NTL_MEAN_Convolution_5x5',
+    'Edge_Strength_Sobel',
+    'Edge_Strength_Prewitt',
+    'Edge_Strength_Laplacian'
+]
+
+# Zonal statistics field the kernel filters are calculated from
+KERNEL_INPUT_FIELD = 'NTL_MEAN'
+
+# Fishnet fields carried into the columnar feature table: the grid keys and the zonal statistics fields written by
+# fishnet_extract (config.zonal_statistics)
+FISHNET_FIELDS = ['PageName', 'rowID', 'columnID'] + ZONAL_FIELDS
+
+# Kernel weights as (row offset, column offset, weight) tuples, shared by the per-cell and grid calculations
+SOBEL_KERNEL_X = [(-1, -1, -1), (-1, 0, -2), (-1, 1, -1),
+                  (0, -1, 0), (0, 0, 0), (0, 1, 0),
+                  (1, -1, 1), (1, 0, 2), (1, 1, 1)]
+SOBEL_KERNEL_Y = [(-1, -1, 1), (-1, 0, 0), (-1, 1, -1),
+                  (0, -1, 2), (0, 0, 0), (0, 1, -2),
+                  (1, -1, 1), (1, 0, 0), (1, 1, -1)]
+PREWITT_KERNEL_X = [(-1, -1, -1), (-1, 0, -1), (-1, 1, -1),
+                    (0, -1, 0), (0, 0, 0), (0, 1, 0),
+                    (1, -1, 1), (1, 0, 1), (1, 1, 1)]
+PREWITT_KERNEL_Y = [(-1, -1, 1), (-1, 0, 1), (-1, 1, 1),
+                    (0, -1, 0), (0, 0, 0), (0, 1, 0),
+                    (1, -1, -1), (1, 0, -1), (1, 1, -1)]
+LAPLACIAN_KERNEL = [(-1, 0, 1), (1, 0, 1), (0, -1, 1), (0, 1, 1), (0, 0, -4)]
+
+# Padding of the dense grid, large enough for the 5x5 convolution window
+GRID_PADDING = 2
 
 # Copy input layer to output layer
 def copy_features(input_layer, output_layer):
@@ -31,19 +73,12 @@ def calculate_sobel(row_id, column_id, data_dict):
     Gx = 0
     Gy = 0
 
-    sobel_kernel_x = [(-1, -1, -1), (-1, 0, -2), (-1, 1, -1),
-                      (0, -1, 0), (0, 0, 0), (0, 1, 0),
-                      (1, -1, 1), (1, 0, 2), (1, 1, 1)]
-    sobel_kernel_y = [(-1, -1, 1), (-1, 0, 0), (-1, 1, -1),
-                      (0, -1, 2), (0, 0, 0), (0, 1, -2),
-                      (1, -1, 1), (1, 0, 0), (1, 1, -1)]
-
-    for dx, dy, value in sobel_kernel_x:
+    for dx, dy, value in SOBEL_KERNEL_X:
         neighbor_row = row_id + dx
         neighbor_column = column_id + dy
         Gx += data_dict.get((neighbor_row, neighbor_column), 0) * value
 
-    for dx, dy, value in sobel_kernel_y:
+    for dx, dy, value in SOBEL_KERNEL_Y:
         neighbor_row = row_id + dx
         neighbor_column = column_id + dy
         Gy += data_dict.get((neighbor_row, neighbor_column), 0) * value
@@ -55,19 +90,12 @@ def calculate_prewitt(row_id, column_id, data_dict):
     Gx = 0
     Gy = 0
 
-    prewitt_kernel_x = [(-1, -1, -1), (-1, 0, -1), (-1, 1, -1),
-                        (0, -1, 0), (0, 0, 0), (0, 1, 0),
-                        (1, -1, 1), (1, 0, 1), (1, 1, 1)]
-    prewitt_kernel_y = [(-1, -1, 1), (-1, 0, 1), (-1, 1, 1),
-                        (0, -1, 0), (0, 0, 0), (0, 1, 0),
-                        (1, -1, -1), (1, 0, -1), (1, 1, -1)]
-
-    for dx, dy, value in prewitt_kernel_x:
+    for dx, dy, value in PREWITT_KERNEL_X:
         neighbor_row = row_id + dx
         neighbor_column = column_id + dy
         Gx += data_dict.get((neighbor_row, neighbor_column), 0) * value
 
-    for dx, dy, value in prewitt_kernel_y:
+    for dx, dy, value in PREWITT_KERNEL_Y:
         neighbor_row = row_id + dx
         neighbor_column = column_id + dy
         Gy += data_dict.get((neighbor_row, neighbor_column), 0) * value
@@ -87,8 +115,200 @@ def calculate_laplacian(row_id, column_id, data_dict):
 
     return abs(laplacian_sum)
 
+# Box kernel for the size x size convolution
+def box_kernel(size):
+    offsets = range(-(size // 2), (size // 2) + 1)
+    return [(i, j, 1) for i in offsets for j in offsets]
+
+# Grid keys of the fishnet cells, with the cells whose rowID or columnID is NULL (malformed PageName) masked out
+def cell_ids(row_ids, column_ids):
+    """
+    Parameters:
+    row_ids (array-like): rowID of each record, None or NaN where NULL.
+    column_ids (array-like): columnID of each record, None or NaN where NULL.
+
+    Returns:
+    tuple: (row_ids, column_ids, valid), int64 id arrays (0 where NULL) and a boolean array of the records with both
+    ids.
+    """
+    ids = []
+    for values in (row_ids, column_ids):
+        values = np.asarray(values)
+        if values.dtype == object:
+            values = np.array([np.nan if value is None else value for value in values.tolist()], dtype=np.float64)
+        ids.append(values)
+    valid = np.ones(len(ids[0]), dtype=bool)
+    for values in ids:
+        if values.dtype.kind == 'f':
+            valid &= ~np.isnan(values)
+    return tuple(np.where(valid, values, 0).astype(np.int64) for values in ids) + (valid,)
+
+# Scatter (rowID, columnID, value) records into a zero-padded dense grid
+def build_dense_grid(row_ids, column_ids, values, pad=GRID_PADDING):
+    """
+    Build a dense 2-D grid of the fishnet values. Cells that are missing from the records, or whose value is NULL,
+    are 0, which matches the data_dict.get(..., 0) lookups of the per-cell calculations.
+
+    Parameters:
+    row_ids (array-like): rowID of each record.
+    column_ids (array-like): columnID of each record.
+    values (array-like): Value of each record (e.g. NTL_MEAN).
+    pad (int): Number of zero cells added around the occupied extent.
+
+    Returns:
+    tuple: (grid, row_origin, column_origin), where grid[0, 0] holds the cell (row_origin - pad, column_origin - pad).
+    """
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    column_ids = np.asarray(column_ids, dtype=np.int64)
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+
+    row_origin = int(row_ids.min())
+    column_origin = int(column_ids.min())
+    shape = (int(row_ids.max()) - row_origin + 1 + 2 * pad, int(column_ids.max()) - column_origin + 1 + 2 * pad)
+
+    grid = np.zeros(shape, dtype=np.float64)
+    grid[row_ids - row_origin + pad, column_ids - column_origin + pad] = values
+    return grid, row_origin, column_origin
+
+# Correlate the padded grid with a kernel of (row offset, column offset, weight) tuples
+def correlate_grid(grid, kernel, pad=GRID_PADDING):
+    rows, columns = grid.shape
+    result = np.zeros((rows - 2 * pad, columns - 2 * pad), dtype=np.float64)
+    for dx, dy, value in kernel:
+        if value:
+            result += value * grid[pad + dx:rows - pad + dx, pad + dy:columns - pad + dy]
+    return result
+
+# Calculate the convolution and edge operators for every cell of the fishnet at once
+def calculate_kernel_grids(row_ids, column_ids, values):
+    """
+    Vectorized counterpart of calculate_convolution, calculate_sobel, calculate_prewitt and calculate_laplacian.
+    Cells with a NULL rowID or columnID are left out of the grid.
+
+    Parameters:
+    row_ids (array-like): rowID of each fishnet cell.
+    column_ids (array-like): columnID of each fishnet cell.
+    values (array-like): NTL_MEAN of each fishnet cell.
+
+    Returns:
+    tuple: (grids, row_origin, column_origin), where grids maps each kernel filter field to a 2-D array and the value
+    of cell (rowID, columnID) is grids[field][rowID - row_origin, columnID - column_origin].
+    """
+    row_ids, column_ids, valid = cell_ids(row_ids, column_ids)
+    if not valid.any():
+        raise ValueError("No fishnet cell has both a rowID and a columnID.")
+    grid, row_origin, column_origin = build_dense_grid(row_ids[valid], column_ids[valid],
+                                                       np.asarray(values, dtype=np.float64)[valid])
+
+    grids = {
+        'NTL_MEAN_Convolution_3x3': correlate_grid(grid, box_kernel(3)) / 9,
+        'NTL_MEAN_Convolution_5x5': correlate_grid(grid, box_kernel(5)) / 25,
+        'Edge_Strength_Sobel': np.hypot(correlate_grid(grid, SOBEL_KERNEL_X), correlate_grid(grid, SOBEL_KERNEL_Y)),
+        'Edge_Strength_Prewitt': np.hypot(correlate_grid(grid, PREWITT_KERNEL_X),
+                                          correlate_grid(grid, PREWITT_KERNEL_Y)),
+        'Edge_Strength_Laplacian': np.abs(correlate_grid(grid, LAPLACIAN_KERNEL)),
+    }
+    return grids, row_origin, column_origin
+
+# Look up the kernel filter fields of each (rowID, columnID) record (NaN where an id is NULL)
+def kernel_values(grids, row_origin, column_origin, row_ids, column_ids):
+    row_ids, column_ids, valid = cell_ids(row_ids, column_ids)
+    features = {}
+    for field, grid in grids.items():
+        features[field] = np.full(len(row_ids), np.nan)
+        features[field][valid] = grid[row_ids[valid] - row_origin, column_ids[valid] - column_origin]
+    return features
+
+# Calculate the kernel filter fields for each (rowID, columnID) record
+def calculate_kernel_features(row_ids, column_ids, values):
+    grids, row_origin, column_origin = calculate_kernel_grids(row_ids, column_ids, values)
+    return kernel_values(grids, row_origin, column_origin, row_ids, column_ids)
+
+# Read fishnet fields into column arrays in a single SearchCursor pass
+def read_fishnet_columns(layer, fields):
+    records = [row for row in arcpy.da.SearchCursor(layer, fields)]
+    return {field: np.array([record[k] for record in records]) for k, field in enumerate(fields)}
+
+# Write all kernel filter fields back to the layer in a single UpdateCursor pass (left NULL where an id is NULL)
+def write_kernel_fields(layer, grids, row_origin, column_origin):
+    with arcpy.da.UpdateCursor(layer, ['rowID', 'columnID'] + KERNEL_FIELDS) as cursor:
+        for row in cursor:
+            if row[0] is None or row[1] is None:
+                row[2:] = [None] * len(KERNEL_FIELDS)
+            else:
+                i, j = row[0] - row_origin, row[1] - column_origin
+                for k, field in enumerate(KERNEL_FIELDS):
+                    row[k + 2] = float(grids[field][i, j])
+            cursor.updateRow(row)
+
+# Write feature columns to a columnar file without going through a GIS layer
+def write_feature_table(columns, output_path):
+    """
+    Write the feature columns to Parquet, Feather or CSV according to the file extension. If pandas (or pyarrow for
+    Parquet/Feather) is not available, or the extension is not recognised, the columns are saved to an NPZ archive
+    next to the requested path instead.
+
+    Parameters:
+    columns (dict): Mapping of column name to 1-D array, all of the same length.
+    output_path (str): Path of the output file.
+
+    Returns:
+    str: Path of the file that was written.
+    """
+    base, extension = os.path.splitext(output_path)
+    extension = extension.lower()
+
+    if extension in ('.parquet', '.feather', '.csv'):
+        try:
+            import pandas as pd
+            df = pd.DataFrame(columns)
+            if extension == '.parquet':
+                df.to_parquet(output_path, index=False)
+            elif extension == '.feather':
+                df.to_feather(output_path)
+            else:
+                df.to_csv(output_path, index=False)
+            return output_path
+        except ImportError as e:
+            print(f"Cannot write {extension} ({e}), falling back to NPZ.")
+
+    output_path = base + '.npz'
+    np.savez(output_path, **columns)
+    return output_path
+
+# Calculate the kernel filter fields of a fishnet table and write them to a columnar file, without arcpy
+def kernel_filter_table(input_path, output_path):
+    """
+    Parameters:
+    input_path (str): CSV, Parquet or Feather table with at least rowID, columnID and NTL_MEAN columns.
+    output_path (str): Path of the output feature table (see write_feature_table).
+
+    Returns:
+    str: Path of the file that was written.
+    """
+    import pandas as pd
+
+    extension = os.path.splitext(input_path)[1].lower()
+    if extension == '.parquet':
+        df = pd.read_parquet(input_path)
+    elif extension == '.feather':
+        df = pd.read_feather(input_path)
+    else:
+        df = pd.read_csv(input_path)
+
+    columns = {column: df[column].to_numpy() for column in df.columns}
+    columns.update(calculate_kernel_features(columns['rowID'], columns['columnID'], columns[KERNEL_INPUT_FIELD]))
+
+    output_path = write_feature_table(columns, output_path)
+    print(f"Feature table written to {output_path}")
+    return output_path
+
 # The main function that executes the entire workflow.
 def main():
+    if KERNEL_INPUT_FIELD not in FISHNET_FIELDS:
+        raise ValueError(f"The kernel filters need the {KERNEL_INPUT_FIELD} field, which config.zonal_statistics "
+                         f"does not produce (fields: {ZONAL_FIELDS}).")
+
     # Enable the overwrite existing dataset option
     arcpy.env.overwriteOutput = True
     arcpy.env.workspace = workspace
@@ -97,50 +317,23 @@ def main():
     copy_features(output_layer_1, output_layer_2)
 
     # Add kernel filter fields
-    fields_to_add = [
-        ('NTL_MEAN_Convolution_3x3', 'FLOAT'),
-        ('NTL_MEAN_Convolution_5x5', 'FLOAT'),
-        ('Edge_Strength_Sobel', 'FLOAT'),
-        ('Edge_Strength_Prewitt', 'FLOAT'),
-        ('Edge_Strength_Laplacian', 'FLOAT')
-    ]
-    add_fields(output_layer_2, fields_to_add)
-
-    # Create data dictionary
-    data_dict = {}
-    with arcpy.da.SearchCursor(output_layer_1, ['rowID', 'columnID', 'NTL_MEAN']) as cursor:
-        for row in cursor:
-            data_dict[(row[0], row[1])] = row[2]
-
-    # Calculate convolution and update fields
-    with arcpy.da.UpdateCursor(output_layer_2,
-                               ['rowID', 'columnID', 'NTL_MEAN_Convolution_3x3', 'NTL_MEAN_Convolution_5x5']) as cursor:
-        for row in cursor:
-            row[2] = calculate_convolution(row[0], row[1], data_dict, 3)  # 3x3 卷积
-            row[3] = calculate_convolution(row[0], row[1], data_dict, 5)  # 5x5 卷积
-            cursor.updateRow(row)
-    print("3x3 and 5x5 Convolution calculations completed.")
+    add_fields(output_layer_2, [(field, 'FLOAT') for field in KERNEL_FIELDS])
 
-    # Calculate Sobel Operator and update fields
-    with arcpy.da.UpdateCursor(output_layer_2, ['rowID', 'columnID', 'Edge_Strength_Sobel']) as cursor:
-        for row in cursor:
-            row[2] = calculate_sobel(row[0], row[1], data_dict)
-            cursor.updateRow(row)
-    print("Sobel edge strength calculation completed.")
+    # Read the fishnet cells once and calculate every kernel filter field in memory
+    columns = read_fishnet_columns(output_layer_1, FISHNET_FIELDS)
+    grids, row_origin, column_origin = calculate_kernel_grids(columns['rowID'], columns['columnID'],
+                                                              columns[KERNEL_INPUT_FIELD])
+    print("Convolution, Sobel, Prewitt and Laplacian calculations completed.")
 
-    # Calculate Prewitt Operator and update fields
-    with arcpy.da.UpdateCursor(output_layer_2, ['rowID', 'columnID', 'Edge_Strength_Prewitt']) as cursor:
-        for row in cursor:
-            row[2] = calculate_prewitt(row[0], row[1], data_dict)
-            cursor.updateRow(row)
-    print("Prewitt edge strength calculation completed.")
+    # Write the kernel filter fields back in one pass
+    write_kernel_fields(output_layer_2, grids, row_origin, column_origin)
+    print("Kernel filter fields updated.")
 
-    # Calculate Laplacian Operator and update fields
-    with arcpy.da.UpdateCursor(output_layer_2, ['rowID', 'columnID', 'Edge_Strength_Laplacian']) as cursor:
-        for row in cursor:
-            row[2] = calculate_laplacian(row[0], row[1], data_dict)
-            cursor.updateRow(row)
-    print("Laplacian edge strength calculation completed.")
+    # Optionally write the same features to a columnar file
+    if feature_table_output_path:
+        columns.update(kernel_values(grids, row_origin, column_origin, columns['rowID'], columns['columnID']))
+        output_path = write_feature_table(columns, feature_table_output_path)
+        print(f"Feature table written to {output_path}")
 
     # Export to CSV
     arcpy.TableToTable_conversion(output_layer_2, csv_output_path.rsplit('/', 1)[0], csv_output_path.rsplit('/', 1)[1])
@@ -0,0 +1,66 @@
+"""
+Benchmark of fishnet_extract.parse_page_names against the per-row PageName parsing of the original UpdateCursor loop,
+on synthetic page names. Not collected by pytest; run from the project folder:
+
+    python tests/benchmark_page_names.py --names 5000000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fishnet_extract import calculate_row, parse_page_names
+
+
+# PageName of each (row, column): bijective base-26 letters followed by the column digits
+def synthetic_page_names(count, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(1, 26 ** 3, count)
+    columns = rng.integers(1, 100000, count)
+    names = []
+    for row, column in zip(rows.tolist(), columns.tolist()):
+        letters = ""
+        while row:
+            row, remainder = divmod(row - 1, 26)
+            letters = chr(65 + remainder) + letters
+        names.append(f"{letters}{column}")
+    return names, rows, columns
+
+
+# Per-name parsing of the original UpdateCursor loop
+def parse_page_names_loop(page_names):
+    row_ids, column_ids = [], []
+    for page_name in page_names:
+        letters = ''.join(filter(str.isalpha, page_name))
+        numbers = ''.join(filter(str.isdigit, page_name))
+        row_ids.append(calculate_row(letters))
+        column_ids.append(int(numbers) if numbers else 0)
+    return np.array(row_ids), np.array(column_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--names", type=int, default=5_000_000, help="Number of synthetic page names")
+    args = parser.parse_args()
+
+    names, rows, columns = synthetic_page_names(args.names)
+
+    start = time.perf_counter()
+    loop_rows, loop_columns = parse_page_names_loop(names)
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    row_ids, column_ids, malformed = parse_page_names(names)
+    bulk_seconds = time.perf_counter() - start
+
+    assert not malformed.any()
+    assert np.array_equal(row_ids, rows) and np.array_equal(column_ids, columns)
+    assert np.array_equal(row_ids, loop_rows) and np.array_equal(column_ids, loop_columns)
+    print(f"{args.names} page names: loop {loop_seconds:.2f} s, parse_page_names {bulk_seconds:.2f} s "
+          f"({loop_seconds / bulk_seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
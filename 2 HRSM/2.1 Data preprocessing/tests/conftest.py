@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts are run from the project folder and import each other (and config.py) as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
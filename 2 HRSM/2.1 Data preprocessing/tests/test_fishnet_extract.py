@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+import fishnet_extract as fe
+
+rasterio = pytest.importorskip("rasterio")
+from rasterio.transform import from_origin
+
+
+# Two GeoTIFFs on the same 100 m grid (EPSG:3857) with NoData cells
+@pytest.fixture
+def rasters(tmp_path):
+    rng = np.random.default_rng(3)
+    paths = {}
+    for prefix in ("NTL", "Floor"):
+        values = (rng.random((45, 70)) * 50).astype(np.float32)
+        values[rng.random(values.shape) < 0.05] = -1
+        paths[prefix] = str(tmp_path / f"{prefix}.tif")
+        with rasterio.open(paths[prefix], "w", driver="GTiff", height=45, width=70, count=1, dtype="float32",
+                           crs="EPSG:3857", transform=from_origin(0, 4500, 100, 100), nodata=-1) as sink:
+            sink.write(values, 1)
+    return paths
+
+
+# Fishnet of 350 m cells, partly outside the rasters, plus an L-shaped zone
+@pytest.fixture
+def zones():
+    zone_ids, polygons = [], []
+    for row in range(14):
+        for column in range(22):
+            x, y = -200 + column * 350, 4700 - row * 350
+            zone_ids.append(f"{chr(65 + row)}{column + 1}")
+            polygons.append([np.array([[x, y], [x + 350, y], [x + 350, y - 350], [x, y - 350], [x, y]], float)])
+    zone_ids.append("ZZ1")
+    polygons.append([np.array([[1000, 3000], [3000, 3000], [3000, 2500], [1500, 2500], [1500, 1000], [1000, 1000],
+                               [1000, 3000]], float)])
+    return zone_ids, polygons
+
+
+# Statistics of each zone from a label array over the whole raster
+def reference_statistics(zone_ids, polygons, path):
+    with rasterio.open(path) as source:
+        values = source.read(1, masked=True).astype(np.float64).filled(np.nan)
+        x_origin, cell_width, _, y_origin, _, cell_height = source.transform.to_gdal()
+    rows, columns = np.mgrid[0:values.shape[0], 0:values.shape[1]]
+    x, y = x_origin + (columns + 0.5) * cell_width, y_origin + (rows + 0.5) * cell_height
+    labels = np.full(values.shape, -1)
+    for zone, rings in enumerate(polygons):
+        labels[fe.points_in_polygon(x, y, rings)] = zone
+
+    table = {statistic: np.full(len(zone_ids), np.nan) for statistic in fe.ZONAL_STATISTICS}
+    table["COUNT"] = np.zeros(len(zone_ids), dtype=np.int64)
+    for zone in range(len(zone_ids)):
+        zone_values = values[(labels == zone) & ~np.isnan(values)]
+        if len(zone_values) == 0:
+            continue
+        table["MEAN"][zone], table["SUM"][zone], table["COUNT"][zone] = zone_values.mean(), zone_values.sum(), \
+            len(zone_values)
+        table["MIN"][zone], table["MAX"][zone], table["STD"][zone] = zone_values.min(), zone_values.max(), \
+            zone_values.std()
+    return table
+
+
+@pytest.mark.parametrize("tile_size", [8, 512])
+def test_zonal_statistics_match_whole_raster_labels(rasters, zones, tile_size):
+    zone_ids, polygons = zones
+    table = fe.calculate_zonal_statistics(zone_ids, polygons, rasters, tile_size=tile_size, zone_crs="EPSG:3857")
+    assert list(table["PageName"]) == zone_ids
+    for prefix, path in rasters.items():
+        expected = reference_statistics(zone_ids, polygons, path)
+        for statistic in fe.ZONAL_STATISTICS:
+            np.testing.assert_allclose(table[f"{prefix}_{statistic}"], expected[statistic], rtol=1e-9, atol=1e-6,
+                                       err_msg=f"{prefix}_{statistic}")
+
+
+def test_zonal_statistics_reject_other_coordinate_systems(rasters, zones):
+    zone_ids, polygons = zones
+    with pytest.raises(ValueError, match="coordinate system"):
+        fe.calculate_zonal_statistics(zone_ids, polygons, rasters, zone_crs="EPSG:4326")
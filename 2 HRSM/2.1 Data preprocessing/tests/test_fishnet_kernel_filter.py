@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+import fishnet_kernel_filter as kf
+
+
+# Sparse fishnet with holes, NULL values, negative ids and cells on the edges of the extent
+@pytest.fixture
+def sparse_fishnet():
+    rng = np.random.default_rng(42)
+    rows, columns = np.meshgrid(np.arange(-3, 9), np.arange(5, 20), indexing='ij')
+    keep = rng.random(rows.shape) < 0.6
+    row_ids, column_ids = rows[keep], columns[keep]
+    values = rng.gamma(2.0, 5.0, len(row_ids))
+    values[rng.random(len(values)) < 0.1] = np.nan
+    return row_ids, column_ids, values
+
+
+# Reference values from the per-cell calculations of the original nested loops
+def loop_reference(row_ids, column_ids, values):
+    data_dict = {(int(row), int(column)): 0 if np.isnan(value) else value
+                 for row, column, value in zip(row_ids, column_ids, values)}
+    reference = {field: [] for field in kf.KERNEL_FIELDS}
+    for row, column in zip(row_ids.tolist(), column_ids.tolist()):
+        reference['NTL_MEAN_Convolution_3x3'].append(kf.calculate_convolution(row, column, data_dict, 3))
+        reference['NTL_MEAN_Convolution_5x5'].append(kf.calculate_convolution(row, column, data_dict, 5))
+        reference['Edge_Strength_Sobel'].append(kf.calculate_sobel(row, column, data_dict))
+        reference['Edge_Strength_Prewitt'].append(kf.calculate_prewitt(row, column, data_dict))
+        reference['Edge_Strength_Laplacian'].append(kf.calculate_laplacian(row, column, data_dict))
+    return {field: np.array(values) for field, values in reference.items()}
+
+
+def test_kernel_features_match_loop_reference(sparse_fishnet):
+    features = kf.calculate_kernel_features(*sparse_fishnet)
+    reference = loop_reference(*sparse_fishnet)
+    assert set(features) == set(kf.KERNEL_FIELDS)
+    for field in kf.KERNEL_FIELDS:
+        np.testing.assert_allclose(features[field], reference[field], rtol=1e-12, atol=1e-9, err_msg=field)
+
+
+def test_single_cell_uses_zero_padding():
+    features = kf.calculate_kernel_features([4], [7], [9.0])
+    reference = loop_reference(np.array([4]), np.array([7]), np.array([9.0]))
+    for field in kf.KERNEL_FIELDS:
+        np.testing.assert_allclose(features[field], reference[field], err_msg=field)
+    assert features['Edge_Strength_Laplacian'][0] == 36.0
+
+
+def test_kernel_filter_table_writes_features(sparse_fishnet, tmp_path):
+    pd = pytest.importorskip("pandas")
+    row_ids, column_ids, values = sparse_fishnet
+    input_path = tmp_path / "fishnet.csv"
+    pd.DataFrame({'rowID': row_ids, 'columnID': column_ids, 'NTL_MEAN': values}).to_csv(input_path, index=False)
+
+    output_path = kf.kernel_filter_table(str(input_path), str(tmp_path / "features.csv"))
+    table = pd.read_csv(output_path)
+    reference = loop_reference(row_ids, column_ids, values)
+    for field in kf.KERNEL_FIELDS:
+        np.testing.assert_allclose(table[field].to_numpy(), reference[field], rtol=1e-12, atol=1e-9)
+
+
+# Fishnet named by PageName (letters for the row, digits for the column) with a few malformed names
+@pytest.fixture
+def named_fishnet():
+    fe = pytest.importorskip("fishnet_extract")
+    rng = np.random.default_rng(7)
+    names = [f"{chr(64 + row) if row <= 26 else 'A' + chr(38 + row)}{column}"
+             for row in range(1, 30) for column in range(1, 12) if rng.random() < 0.7]
+    names += ["12", "A1B", "", None]
+    values = rng.gamma(2.0, 5.0, len(names))
+
+    # Stage 1: malformed names get NULL rowID/columnID, as written by fishnet_extract.main
+    row_ids, column_ids, malformed = fe.parse_page_names(names)
+    row_ids = np.where(malformed, None, row_ids.astype(object))
+    column_ids = np.where(malformed, None, column_ids.astype(object))
+    return row_ids, column_ids, values, malformed
+
+
+def test_malformed_page_names_get_null_kernel_fields(named_fishnet):
+    row_ids, column_ids, values, malformed = named_fishnet
+    assert malformed.sum() == 4
+
+    features = kf.calculate_kernel_features(row_ids, column_ids, values)
+    reference = loop_reference(row_ids[~malformed].astype(np.int64), column_ids[~malformed].astype(np.int64),
+                               values[~malformed])
+    for field in kf.KERNEL_FIELDS:
+        assert np.isnan(features[field][malformed]).all()
+        np.testing.assert_allclose(features[field][~malformed], reference[field], rtol=1e-12, atol=1e-9)
+
+
+def test_kernel_filter_table_with_null_ids(named_fishnet, tmp_path):
+    pd = pytest.importorskip("pandas")
+    row_ids, column_ids, values, malformed = named_fishnet
+    input_path = tmp_path / "fishnet.csv"
+    pd.DataFrame({'rowID': row_ids, 'columnID': column_ids, 'NTL_MEAN': values}).to_csv(input_path, index=False)
+
+    table = pd.read_csv(kf.kernel_filter_table(str(input_path), str(tmp_path / "features.csv")))
+    features = kf.calculate_kernel_features(row_ids, column_ids, values)
+    for field in kf.KERNEL_FIELDS:
+        assert table[field][malformed].isna().all()
+        np.testing.assert_allclose(table[field].to_numpy(), features[field], rtol=1e-12, equal_nan=True)
@@ -4,7 +4,10 @@ from sklearn.tree import DecisionTreeRegressor
 from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
 from sklearn.neural_network import MLPRegressor
 from sklearn.svm import SVR
-from sklearn.model_selection import cross_val_score
+from sklearn.base import clone
+from sklearn.metrics import r2_score
+from sklearn.model_selection import KFold
+from joblib import Parallel, delayed
 import numpy as np
 import time
 import os
@@ -22,7 +25,250 @@ MODEL_CLASSES = {
     # Beware of importing before use
 }
 
-def perform_data_analysis(train_files, validation_files, output_directory, dependent_var, independent_vars, models_config):
+# Relative cost of a cross-validation fold of each model: the slowest models are scheduled first, so they do not end up
+# alone on one worker at the end of the grid (models not listed get DEFAULT_MODEL_COST)
+MODEL_COSTS = {
+    'SVR': 5,
+    'MLPRegressor': 4,
+    'RandomForestRegressor': 3,
+    'GradientBoostingRegressor': 3,
+    'DecisionTreeRegressor': 1,
+    'LinearRegression': 0,
+}
+DEFAULT_MODEL_COST = 2
+
+# Number of cross-validation folds
+CV_FOLDS = 5
+
+# Ways of predicting the validation files with the best model: refit it on the whole training file, or average the
+# predictions of the models fitted on the cross-validation folds (no extra training)
+PREDICTION_MODES = ('refit', 'ensemble')
+
+# Model selection: full cross-validation of every candidate, or successive halving on row subsamples first
+SEARCH_MODES = ('grid', 'halving')
+
+# Fits a clone of the model on the training part of one fold and scores it (R2) on the held-out part; the model given is
+# never fitted itself, so tasks sharing it can run in parallel
+def cross_validation_task(model, X, y, train_index, test_index, return_estimator=False):
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    fold_model = clone(model).fit(X[train_index], y[train_index])
+    score = r2_score(y[test_index], fold_model.predict(X[test_index]))
+    return (score, time.perf_counter() - start_wall, time.process_time() - start_cpu,
+            fold_model if return_estimator else None)
+
+class FoldEnsemble:
+    """Predicts the mean of the predictions of the models fitted on the cross-validation folds."""
+
+    def __init__(self, fold_models):
+        self.fold_models = fold_models
+
+    def predict(self, X):
+        X = np.asarray(X)
+        return np.mean([fold_model.predict(X) for fold_model in self.fold_models], axis=0)
+
+# Runs (key, X, y, train_index, test_index) cross-validation tasks, keyed by (file, model, variable, fold), on workers
+# processes (joblib/loky), one task per dispatch with the slowest models first; yields (task index, outcome) pairs as
+# the outcomes come back, so the caller decides which fold models to keep
+def iter_cross_validation_tasks(tasks, models, workers=1, return_estimator=False):
+    # Stable sort: the grid order is kept among tasks of the same cost
+    order = sorted(range(len(tasks)), key=lambda i: -MODEL_COSTS.get(tasks[i][0][1], DEFAULT_MODEL_COST))
+    print(f"\nCross-validating {len(tasks)} tasks on {workers} worker(s)")
+    outcomes = Parallel(n_jobs=workers, batch_size=1, pre_dispatch='all', return_as='generator')(
+        delayed(cross_validation_task)(models[tasks[i][0][1]], *tasks[i][1:], return_estimator) for i in order)
+    return zip(order, outcomes)
+
+# Per-task timings (DataFrame) of the outcomes of cross-validation tasks, with the time spent on each model printed
+def task_timings(tasks, outcomes):
+    timings = pd.DataFrame([{'File': key[0], 'Model': key[1], 'Variable': key[2], 'Fold': key[3], 'R2': score,
+                             'WallTime': wall_time, 'CPUTime': cpu_time}
+                            for (key, *_), (score, wall_time, cpu_time, _) in zip(tasks, outcomes)])
+    if len(timings):
+        by_model = timings.groupby('Model')[['WallTime', 'CPUTime']].sum()
+        for model_name, row in by_model.sort_values('WallTime', ascending=False).iterrows():
+            print(f"{model_name}: wall time {row['WallTime']:.2f}sec, CPU time {row['CPUTime']:.2f}sec")
+    return timings
+
+# Runs cross-validation tasks (see iter_cross_validation_tasks); returns the outcomes in task order and the timings
+def run_cross_validation_tasks(tasks, models, workers=1):
+    outcomes = [None] * len(tasks)
+    for i, outcome in iter_cross_validation_tasks(tasks, models, workers):
+        outcomes[i] = outcome
+    return outcomes, task_timings(tasks, outcomes)
+
+# Mean R2 used to rank the candidates, with NaN ranked last
+def selection_score(mean_score):
+    return np.nan_to_num(mean_score, nan=-np.inf)
+
+def cross_validation_grid(train_datasets, models, dependent_var, independent_vars, workers=1, timings_file=None,
+                          return_estimator=False, candidates=None):
+    """
+    Cross-validates every (file, model, variable, fold) combination as one flat pool of tasks, run on workers
+    processes (joblib/loky), slowest models first. The folds are the same as cross_val_score(model, X, y, cv=5).
+
+    Parameters:
+    train_datasets (list): Training DataFrames, one per file.
+    models (dict): Model instances by name.
+    dependent_var (str): Dependent variable.
+    independent_vars (list): Independent variables, each tested alone.
+    workers (int): Number of worker processes (1 runs the tasks in this process).
+    timings_file (str): Optional CSV file where the wall and CPU time of each task are logged.
+    return_estimator (bool): Keep the fitted fold models of the best candidate of each file (highest mean R2, the
+                             first in result order on ties). The outcomes are consumed as they come back and the fold
+                             models of a candidate are dropped as soon as a better one of the same file is complete.
+    candidates (list): Optional (model, variable) pairs to cross-validate for each file (all of them if None).
+
+    Returns:
+    list: For each file, a dict mapping "<model> with <variable>" to (mean R2, fold R2 scores, time of the
+    cross-validation, i.e. the sum of the wall times of its folds, fold models of the best candidate or None).
+    """
+    if candidates is None:
+        candidates = [[(model_name, var) for model_name in models for var in independent_vars]] * len(train_datasets)
+
+    tasks = []
+    for file_index, train_data in enumerate(train_datasets):
+        y = train_data[dependent_var].to_numpy()
+        folds = list(KFold(n_splits=CV_FOLDS).split(y))
+        for var in independent_vars:
+            X = train_data[[var]].to_numpy()
+            for model_name in models:
+                if (model_name, var) not in candidates[file_index]:
+                    continue
+                for fold, (train_index, test_index) in enumerate(folds):
+                    tasks.append(((file_index, model_name, var, fold), X, y, train_index, test_index))
+
+    # Position of each candidate in the results, to break ties as max() over the results does
+    result_order = {(model_name, var): position
+                    for position, (model_name, var) in enumerate((model_name, var) for model_name in models
+                                                                 for var in independent_vars)}
+    outcomes = [None] * len(tasks)
+    pending_models = {}  # (file, model, variable) -> {fold: (R2, fold model)} of the candidates not complete yet
+    best_models = {}  # file -> (selection score, -result position, (model, variable), fold models)
+    for i, (score, wall_time, cpu_time, fold_model) in iter_cross_validation_tasks(tasks, models, workers,
+                                                                                   return_estimator):
+        outcomes[i] = (score, wall_time, cpu_time, None)
+        if not return_estimator:
+            continue
+        (file_index, model_name, var, fold) = tasks[i][0]
+        folds = pending_models.setdefault((file_index, model_name, var), {})
+        folds[fold] = (score, fold_model)
+        if len(folds) < CV_FOLDS:
+            continue
+        del pending_models[(file_index, model_name, var)]
+        rank = (selection_score(np.mean([folds[k][0] for k in range(CV_FOLDS)])), -result_order[(model_name, var)])
+        if file_index not in best_models or rank > best_models[file_index][:2]:
+            best_models[file_index] = (*rank, (model_name, var), [folds[k][1] for k in range(CV_FOLDS)])
+
+    timings = task_timings(tasks, outcomes)
+    if timings_file is not None:
+        timings.to_csv(timings_file, index=False)
+    scores = {key: (score, wall_time) for (key, *_), (score, wall_time, _, _) in zip(tasks, outcomes)}
+
+    results = []
+    for file_index in range(len(train_datasets)):
+        file_results = {}
+        for model_name in models:
+            for var in independent_vars:
+                if (model_name, var) not in candidates[file_index]:
+                    continue
+                fold_scores = [scores[(file_index, model_name, var, fold)] for fold in range(CV_FOLDS)]
+                cv_scores = np.array([score for score, _ in fold_scores])
+                best = best_models.get(file_index)
+                fold_models = best[3] if best is not None and best[2] == (model_name, var) else None
+                file_results[f"{model_name} with {var}"] = (cv_scores.mean(), cv_scores,
+                                                            sum(wall_time for _, wall_time in fold_scores),
+                                                            fold_models)
+        results.append(file_results)
+    return results
+
+def successive_halving_search(train_datasets, models, dependent_var, independent_vars, workers=1, factor=3,
+                              min_rows=10000, folds=2, random_state=0, timings_file=None, history_file=None,
+                              return_estimator=False):
+    """
+    Successive halving over the (model, variable) candidates of each file: every round scores the remaining
+    candidates with a cheap cross-validation (folds folds of a row subsample, min_rows rows in the first round and
+    factor times more in each following round) and keeps the best 1 / factor of them (at least factor), until at most
+    factor candidates are left or the round's subsample was the whole file. Only those get the full cross-validation
+    of cross_validation_grid.
+
+    Parameters:
+    train_datasets (list): Training DataFrames, one per file.
+    models (dict): Model instances by name.
+    dependent_var (str): Dependent variable.
+    independent_vars (list): Independent variables, each tested alone.
+    workers (int): Number of worker processes (1 runs the tasks in this process).
+    factor (int): Elimination factor of each round.
+    min_rows (int): Rows of the subsample of the first round.
+    folds (int): Folds of the elimination rounds.
+    random_state (int): Seed of the row subsamples (each round's subsample contains the previous one).
+    timings_file (str): Optional CSV file where the wall and CPU time of each task of the full cross-validation are
+                        logged.
+    history_file (str): Optional CSV file where the score, budget (rows, folds, CPU time) and elimination of each
+                        candidate in each round are logged.
+    return_estimator (bool): Keep the fitted fold models of the best finalist of each file.
+
+    Returns:
+    list: Same as cross_validation_grid, with the finalists only.
+    """
+    if factor < 2:
+        raise ValueError(f"The halving factor must be at least 2, got {factor}.")
+    candidates = [[(model_name, var) for model_name in models for var in independent_vars] for _ in train_datasets]
+    rng = np.random.default_rng(random_state)
+    permutations = [rng.permutation(len(train_data)) for train_data in train_datasets]
+    history = []
+    # Files still in the elimination rounds
+    active = [len(file_candidates) > factor for file_candidates in candidates]
+
+    round_index = 0
+    while any(active):
+        rows = min_rows * factor ** round_index
+        tasks = []
+        for file_index, train_data in enumerate(train_datasets):
+            if not active[file_index]:
+                continue
+            subsample = np.sort(permutations[file_index][:rows])
+            y = train_data[dependent_var].to_numpy()[subsample]
+            splits = list(KFold(n_splits=folds).split(y))
+            for model_name, var in candidates[file_index]:
+                X = train_data[[var]].to_numpy()[subsample]
+                for fold, (train_index, test_index) in enumerate(splits):
+                    tasks.append(((file_index, model_name, var, fold), X, y, train_index, test_index))
+
+        print(f"\nSuccessive halving round {round_index + 1}: up to {rows} rows, {folds} folds")
+        _, timings = run_cross_validation_tasks(tasks, models, workers)
+        scores = timings.groupby(['File', 'Model', 'Variable'])['R2'].mean()
+        budgets = timings.groupby(['File', 'Model', 'Variable'])['CPUTime'].sum()
+
+        for file_index, train_data in enumerate(train_datasets):
+            if not active[file_index]:
+                continue
+            ranked = sorted(candidates[file_index],
+                            key=lambda candidate: -selection_score(scores[(file_index, *candidate)]))
+            kept = ranked[:max(factor, int(np.ceil(len(ranked) / factor)))]
+            for model_name, var in ranked:
+                history.append({'Round': round_index + 1, 'File': file_index, 'Model': model_name, 'Variable': var,
+                                'Rows': min(rows, len(train_data)), 'Folds': folds,
+                                'R2': scores[(file_index, model_name, var)],
+                                'CPUTime': budgets[(file_index, model_name, var)],
+                                'Advanced': (model_name, var) in kept})
+            print(f"File {file_index}: kept {len(kept)} of {len(ranked)} candidates "
+                  f"({', '.join(f'{model_name} with {var}' for model_name, var in kept)})")
+            candidates[file_index] = kept
+            # A larger subsample would not hold more rows than this round's
+            active[file_index] = len(kept) > factor and rows < len(train_data)
+        round_index += 1
+
+    if history_file is not None:
+        pd.DataFrame(history).to_csv(history_file, index=False)
+    return cross_validation_grid(train_datasets, models, dependent_var, independent_vars, workers, timings_file,
+                                 return_estimator, candidates)
+
+def perform_data_analysis(train_files, validation_files, output_directory, dependent_var, independent_vars, models_config,
+                          workers=1, prediction='refit', search='grid', halving_factor=3, halving_min_rows=10000):
+    if prediction not in PREDICTION_MODES:
+        raise ValueError(f"Unknown prediction mode '{prediction}', expected one of {PREDICTION_MODES}.")
+    if search not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{search}', expected one of {SEARCH_MODES}.")
+
     current_time = time.strftime('%Y-%m-%d_%H-%M-%S')
     file_name = os.path.join(output_directory, f"model_evaluation_results_{current_time}.txt")
 
@@ -36,41 +282,32 @@ def perform_data_analysis(train_files, validation_files, output_directory, depen
             if model_class:
                 models[model_name] = model_class(**params)
 
-        for train_file_path, validation_file_path in zip(train_files, validation_files):
+        # Cross-validate the files × models × variables × folds grid at once, so every worker stays busy
+        train_datasets = [pd.read_csv(train_file_path) for train_file_path in train_files]
+        timings_file = os.path.join(output_directory, f"cross_validation_timings_{current_time}.csv")
+        if search == 'halving':
+            history_file = os.path.join(output_directory, f"successive_halving_history_{current_time}.csv")
+            grid_results = successive_halving_search(train_datasets, models, dependent_var, independent_vars, workers,
+                                                     halving_factor, halving_min_rows, timings_file=timings_file,
+                                                     history_file=history_file,
+                                                     return_estimator=prediction == 'ensemble')
+            file.write(f"Successive halving history saved to: {history_file}\n")
+        else:
+            grid_results = cross_validation_grid(train_datasets, models, dependent_var, independent_vars, workers,
+                                                 timings_file, return_estimator=prediction == 'ensemble')
+
+        for train_file_path, validation_file_path, train_data, results in zip(train_files, validation_files,
+                                                                              train_datasets, grid_results):
             print(f"\nFiles being processed：{os.path.basename(train_file_path)}")
             file.write(f"\nFiles being processed：{os.path.basename(train_file_path)}\n")
 
-            train_data = pd.read_csv(train_file_path)
             validation_data = pd.read_csv(validation_file_path)
 
-            results = {}
-
-            start_time = time.time()
-
-            for model_name, model in models.items():
-                print(f"\nStart testing the model：{model_name}")
-                for var in independent_vars:
-                    print(f"Variable being used：{var}")
-                    X_train = train_data[[var]]
-                    y_train = train_data[dependent_var]
-
-                    start_cv = time.time()
-                    cv_scores = cross_val_score(model, X_train, y_train, cv=5, scoring='r2')
-                    end_cv = time.time()
-
-                    cv_duration = end_cv - start_cv
+            for key, (_, _, cv_duration, _) in results.items():
+                print(f"Complete：{key}，Time cost：{cv_duration:.2f}sec")
 
-                    key = f"{model_name} with {var}"
-                    print(f"Complete：{key}，Time cost：{cv_duration:.2f}sec")
-
-                    results[key] = (cv_scores.mean(), cv_scores, cv_duration)
-
-            end_time = time.time()
-            total_duration = end_time - start_time
-
-            best_fit_key = max(results, key=lambda x: results[x][0])
+            best_fit_key = max(results, key=lambda x: selection_score(results[x][0]))
             best_fit_model_name, best_var = best_fit_key.split(" with ")
-            best_model = models[best_fit_model_name]
 
             best_cv_scores = results[best_fit_key][1]
             best_cv_mean_score = results[best_fit_key][0]
@@ -81,11 +318,17 @@ def perform_data_analysis(train_files, validation_files, output_directory, depen
             print(f"average coefficient of determination：{best_cv_mean_score}")
             print(f"time required to complete cross-validation：{best_cv_duration:.2f}sec")
 
-            X_train = train_data[[best_var]]
-            y_train = train_data[dependent_var]
-            best_model.fit(X_train, y_train)
-
-            X_validation = validation_data[[best_var]]
+            if prediction == 'ensemble':
+                # The fold models of the cross-validation replace a refit on the whole training file
+                best_model = FoldEnsemble(results[best_fit_key][3])
+                X_validation = validation_data[[best_var]].to_numpy()
+            else:
+                # A clone, so the configured model instance is never fitted
+                best_model = clone(models[best_fit_model_name])
+                X_train = train_data[[best_var]]
+                y_train = train_data[dependent_var]
+                best_model.fit(X_train, y_train)
+                X_validation = validation_data[[best_var]]
             predictions = best_model.predict(X_validation)
 
             page_names = validation_data['PageName']
@@ -99,7 +342,7 @@ def perform_data_analysis(train_files, validation_files, output_directory, depen
             results_df.to_csv(results_file, index=False)
 
             print(f"\nPredictions have been saved to: {results_file}")
-            file.write(f"Best fit model: {best_fit_model_name} using variable: {best_var}, average coefficient of determination: {best_cv_mean_score}\n")
+            file.write(f"Best fit model: {best_fit_model_name} using variable: {best_var}, average coefficient of determination: {best_cv_mean_score}, prediction: {prediction}\n")
             file.write(f"Predictions have been saved to: {results_file}\n")
 
     print(f"\nFile write complete")
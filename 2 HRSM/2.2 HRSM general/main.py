@@ -4,9 +4,11 @@ import json
 from data_analysis import perform_data_analysis
 from utils import format_elapsed_time
 
-def main(train_files, validation_files, output_directory, dependent_var, independent_vars, models_config):
+def main(train_files, validation_files, output_directory, dependent_var, independent_vars, models_config, workers=1,
+         prediction='refit', search='grid', halving_factor=3, halving_min_rows=10000):
     data_analysis_start_time = time.time()
-    perform_data_analysis(train_files, validation_files, output_directory, dependent_var, independent_vars, models_config)
+    perform_data_analysis(train_files, validation_files, output_directory, dependent_var, independent_vars, models_config,
+                          workers, prediction, search, halving_factor, halving_min_rows)
     data_analysis_end_time = time.time()
     print(f"Data analysis complete. Time elapsed: {format_elapsed_time(data_analysis_end_time - data_analysis_start_time)}.")
 
@@ -18,9 +20,15 @@ if __name__ == "__main__":
     parser.add_argument('--dependent_var', type=str, required=True, help='The dependent variable for the models.')
     parser.add_argument('--independent_vars', nargs='+', type=str, required=True, help='The independent variables for the models.')
     parser.add_argument('--models_config', type=str, required=True, help='JSON string representing the models to be tested.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes running the cross-validation (default: 1).')
+    parser.add_argument('--prediction', choices=['refit', 'ensemble'], default='refit', help='Refit the best model on the whole training file, or average its cross-validation fold models (default: refit).')
+    parser.add_argument('--search', choices=['grid', 'halving'], default='grid', help='Cross-validate every model and variable fully, or eliminate candidates by successive halving on row subsamples first (default: grid).')
+    parser.add_argument('--halving_factor', type=int, default=3, help='Successive halving: fraction 1/factor of the candidates kept each round, and growth of the row subsample (default: 3).')
+    parser.add_argument('--halving_min_rows', type=int, default=10000, help='Successive halving: rows of the subsample of the first round (default: 10000).')
 
     args = parser.parse_args()
 
     models_config = json.loads(args.models_config)
 
-    main(args.train_files, args.validation_files, args.output_directory, args.dependent_var, args.independent_vars, models_config)
+    main(args.train_files, args.validation_files, args.output_directory, args.dependent_var, args.independent_vars, models_config,
+         args.workers, args.prediction, args.search, args.halving_factor, args.halving_min_rows)
@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import BaseEstimator, RegressorMixin
+from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import KFold, cross_val_score
+from sklearn.tree import DecisionTreeRegressor
+import data_analysis
+
+
+# Training files where y depends on x1 and not on x2
+def training_files(n_files=2, rows=200):
+    rng = np.random.default_rng(0)
+    files = []
+    for _ in range(n_files):
+        x1, x2 = rng.normal(size=rows), rng.normal(size=rows)
+        files.append(pd.DataFrame({'FloorSUM': 3 * x1 + rng.normal(scale=0.5, size=rows), 'x1': x1, 'x2': x2}))
+    return files
+
+
+def models():
+    return {'LinearRegression': LinearRegression(), 'DecisionTreeRegressor': DecisionTreeRegressor(random_state=0)}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_fold_scores_match_cross_val_score(workers):
+    train_datasets = training_files()
+    results = data_analysis.cross_validation_grid(train_datasets, models(), 'FloorSUM', ['x1', 'x2'], workers)
+    assert len(results) == len(train_datasets)
+    for train_data, file_results in zip(train_datasets, results):
+        assert list(file_results) == [f"{model_name} with {var}" for model_name in models() for var in ['x1', 'x2']]
+        for model_name, model in models().items():
+            for var in ['x1', 'x2']:
+                mean_score, fold_scores, _, fold_models = file_results[f"{model_name} with {var}"]
+                expected = cross_val_score(model, train_data[[var]], train_data['FloorSUM'], cv=5)
+                np.testing.assert_allclose(fold_scores, expected)
+                assert mean_score == pytest.approx(expected.mean())
+                assert fold_models is None
+
+
+def test_timings_have_one_row_per_task(tmp_path):
+    timings_file = tmp_path / "timings.csv"
+    data_analysis.cross_validation_grid(training_files(3), models(), 'FloorSUM', ['x1', 'x2'], 2, str(timings_file))
+    timings = pd.read_csv(timings_file)
+    assert list(timings.columns) == ['File', 'Model', 'Variable', 'Fold', 'R2', 'WallTime', 'CPUTime']
+    assert len(timings) == 3 * 2 * 2 * data_analysis.CV_FOLDS
+    assert not timings.duplicated(['File', 'Model', 'Variable', 'Fold']).any()
+    assert set(timings['Fold']) == set(range(data_analysis.CV_FOLDS))
+    assert (timings[['WallTime', 'CPUTime']] >= 0).all().all()
+
+
+# Regressor whose folds all score `score` once r2_score is replaced by fold_score (NaN included)
+class FixedScore(RegressorMixin, BaseEstimator):
+    def __init__(self, score=0.0):
+        self.score = score
+
+    def fit(self, X, y):
+        return self
+
+    def predict(self, X):
+        return np.full(len(X), self.score)
+
+
+def fold_score(y_true, y_pred):
+    return y_pred[0]
+
+
+@pytest.mark.parametrize("scores, expected", [
+    ({'A': 0.5, 'B': np.nan, 'C': 0.5}, "A with x1"),  # tie, broken by the result order
+    ({'A': np.nan, 'B': 0.2, 'C': -0.1}, "B with x1"),  # NaN ranks last
+    ({'A': -0.3, 'B': 0.0, 'C': np.nan}, "B with x1"),
+    ({'A': np.nan, 'B': np.nan, 'C': np.nan}, "A with x1"),  # no score at all: the first candidate
+])
+def test_fold_models_are_kept_for_the_selected_candidate(monkeypatch, scores, expected):
+    monkeypatch.setattr(data_analysis, "r2_score", fold_score)
+    models = {name: FixedScore(score) for name, score in scores.items()}
+    # x2 gets the same scores as x1, so every model also ties with itself across the variables
+    results = data_analysis.cross_validation_grid(training_files(), models, 'FloorSUM', ['x1', 'x2'],
+                                                  return_estimator=True)
+    for file_results in results:
+        # Same selection as perform_data_analysis
+        best_fit_key = max(file_results, key=lambda key: data_analysis.selection_score(file_results[key][0]))
+        assert best_fit_key == expected
+        assert [key for key, result in file_results.items() if result[3] is not None] == [best_fit_key]
+        fold_models = file_results[best_fit_key][3]
+        assert len(fold_models) == data_analysis.CV_FOLDS
+        assert all(fold_model.score is scores[best_fit_key.split(" with ")[0]] for fold_model in fold_models)
+
+
+def test_ensemble_prediction_averages_the_fold_models_of_the_best_candidate(tmp_path):
+    train_data, validation_data = training_files()
+    validation_data = validation_data.assign(PageName=[f"{k}_0" for k in range(len(validation_data))])
+    train_data.to_csv(tmp_path / "train.csv", index=False)
+    validation_data.to_csv(tmp_path / "validation.csv", index=False)
+
+    data_analysis.perform_data_analysis([str(tmp_path / "train.csv")], [str(tmp_path / "validation.csv")],
+                                        str(tmp_path), 'FloorSUM', ['x2', 'x1'],
+                                        {'DecisionTreeRegressor': {'max_depth': 3}, 'LinearRegression': {}},
+                                        prediction='ensemble')
+    predictions = pd.read_csv(next(tmp_path.glob("predictions_validation_*.csv")))
+
+    # LinearRegression with x1 is the best candidate
+    X, y = train_data[['x1']].to_numpy(), train_data['FloorSUM'].to_numpy()
+    X_validation = validation_data[['x1']].to_numpy()
+    expected = np.mean([LinearRegression().fit(X[train_index], y[train_index]).predict(X_validation)
+                        for train_index, _ in KFold(n_splits=data_analysis.CV_FOLDS).split(X)], axis=0)
+    np.testing.assert_allclose(predictions['PredictedFloorSUM'], expected)
+
+
+HISTORY_COLUMNS = ['Round', 'File', 'Model', 'Variable', 'Rows', 'Folds', 'R2', 'CPUTime', 'Advanced']
+
+
+# Successive halving over models with fixed scores (one variable), returning the history and the finalists
+def halving_with_scores(monkeypatch, tmp_path, scores, factor, min_rows, rows=200):
+    monkeypatch.setattr(data_analysis, "r2_score", fold_score)
+    models = {f"M{k}": FixedScore(score) for k, score in enumerate(scores)}
+    history_file = tmp_path / "history.csv"
+    results = data_analysis.successive_halving_search(training_files(1, rows), models, 'FloorSUM', ['x1'],
+                                                      factor=factor, min_rows=min_rows,
+                                                      history_file=str(history_file))
+    return pd.read_csv(history_file), [key.split(" with ")[0] for key in results[0]]
+
+
+def test_halving_keeps_a_factor_of_the_candidates_per_round(monkeypatch, tmp_path):
+    history, finalists = halving_with_scores(monkeypatch, tmp_path, np.linspace(0, 0.9, 10), factor=3, min_rows=10)
+    assert list(history.columns) == HISTORY_COLUMNS
+    rounds = history.groupby('Round')
+    # 10 -> max(3, ceil(10 / 3)) = 4 -> max(3, ceil(4 / 3)) = 3
+    assert rounds.size().tolist() == [10, 4]
+    assert rounds['Advanced'].sum().tolist() == [4, 3]
+    assert rounds['Rows'].first().tolist() == [10, 30]
+    assert (history['Folds'] == 2).all()
+    assert finalists == ['M7', 'M8', 'M9']
+    assert set(history.loc[history['Advanced'] & (history['Round'] == 1), 'Model']) == {'M6', 'M7', 'M8', 'M9'}
+
+
+def test_halving_stops_once_a_round_used_the_whole_file(monkeypatch, tmp_path):
+    history, finalists = halving_with_scores(monkeypatch, tmp_path, np.linspace(0, 0.9, 30), factor=2,
+                                             min_rows=100, rows=200)
+    # Round 2 already scores all 200 rows, so its 8 survivors go to the full cross-validation
+    assert history.groupby('Round')['Rows'].first().tolist() == [100, 200]
+    assert history.groupby('Round')['Advanced'].sum().tolist() == [15, 8]
+    assert len(finalists) == 8
+
+    history, finalists = halving_with_scores(monkeypatch, tmp_path, np.linspace(0, 0.9, 30), factor=2,
+                                             min_rows=500, rows=200)
+    assert history['Round'].max() == 1 and (history['Rows'] == 200).all()
+    assert len(finalists) == 15
+
+
+def test_halving_ranks_nan_scores_last(monkeypatch, tmp_path):
+    scores = [np.nan, 0.1, np.nan, -0.5, 0.0, -0.2, np.nan, -0.1, -0.3]
+    history, finalists = halving_with_scores(monkeypatch, tmp_path, scores, factor=3, min_rows=10)
+    assert finalists == ['M1', 'M4', 'M7']
+    assert not history.loc[history['Model'].isin(['M0', 'M2', 'M6']), 'Advanced'].any()
+
+
+def test_halving_finds_the_grid_winner(tmp_path):
+    rng = np.random.default_rng(5)
+    train_datasets = training_files(2, rows=900)
+    for train_data in train_datasets:
+        for k in range(4):
+            train_data[f"noise{k}"] = rng.normal(size=len(train_data))
+    independent_vars = ['noise0', 'x2', 'noise1', 'x1', 'noise2', 'noise3']
+    models = {'DecisionTreeRegressor': DecisionTreeRegressor(max_depth=3, random_state=0),
+              'LinearRegression': LinearRegression()}
+
+    def winners(results):
+        return [max(file_results, key=lambda key: data_analysis.selection_score(file_results[key][0]))
+                for file_results in results]
+
+    grid = data_analysis.cross_validation_grid(train_datasets, models, 'FloorSUM', independent_vars)
+    halving = data_analysis.successive_halving_search(train_datasets, models, 'FloorSUM', independent_vars,
+                                                      factor=2, min_rows=100)
+    assert winners(halving) == winners(grid) == ["LinearRegression with x1"] * 2
+    for grid_results, halving_results in zip(grid, halving):
+        assert 2 <= len(halving_results) < len(grid_results)
+        for key, (mean_score, fold_scores, _, _) in halving_results.items():
+            np.testing.assert_allclose(fold_scores, grid_results[key][1])